@@ -0,0 +1,29 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from traintrack.schema.job import JobRequest, QueuedJob
+
+
+@pytest.fixture
+def make_job():
+    """Build a queued job. Jobs made later are enqueued later."""
+    counter = iter(range(1000000))
+    start = datetime(2024, 1, 1)
+
+    def _make(project: str = "p", group: str = "g", **request) -> QueuedJob:
+        i = next(counter)
+        desc = {
+            "project": project,
+            "group": group,
+            "name": f"job{i}",
+            "repo": "Hobot",
+            "spec": {"branch": "main", "config": "conf.py"},
+        }
+        return QueuedJob(
+            id=f"job{i}",
+            request=JobRequest.parse_obj({"job": desc, **request}),
+            enqueued_at=start + timedelta(seconds=i),
+        )
+
+    return _make
@@ -0,0 +1,58 @@
+from traintrack.runner.job_log import JobLogs
+
+
+def _read_all(logs: JobLogs, job_id: str, offset: int = 0) -> bytes:
+    start, end = logs.window(job_id)
+    offset = max(offset, start)
+    data = b""
+    while offset < end:
+        offset, chunk = logs.read(job_id, offset, 7)
+        data += chunk
+        offset += len(chunk)
+    return data
+
+
+def test_offsets_across_rotation(tmp_path):
+    logs = JobLogs(tmp_path, max_bytes=10)
+    written = b""
+    for i in range(20):
+        line = f"line {i}\n".encode()
+        logs.append("j", line)
+        written += line
+
+    start, end = logs.window("j")
+    # Offsets count every byte written, the window is what is still on disk
+    assert end == len(written)
+    assert 0 < start < end
+    assert logs.size("j") == end - start
+    assert end - start <= 2 * 10 + len(b"line 19\n")
+    assert _read_all(logs, "j") == written[start:]
+
+    # An offset that was rotated out moves forward to the oldest byte kept
+    offset, chunk = logs.read("j", 0, 4)
+    assert offset == start and chunk == written[start : start + 4]
+    # Reading past the end returns nothing
+    assert logs.read("j", end, 100) == (end, b"")
+
+
+def test_rotate_keeps_output_written_by_another_process(tmp_path):
+    logs = JobLogs(tmp_path, max_bytes=10)
+    # e.g. tee in a tmux pane
+    with open(logs.path("j"), "ab") as f:
+        f.write(b"0123456789abcdef")
+        f.flush()
+        logs.rotate("j")
+        f.write(b"ghij")
+    assert logs.window("j") == (0, 20)
+    assert _read_all(logs, "j") == b"0123456789abcdefghij"
+
+
+def test_remove(tmp_path):
+    logs = JobLogs(tmp_path, max_bytes=10)
+    logs.append("a", b"0123456789abcdef")
+    logs.append("b", b"x")
+    assert sorted(logs.job_ids()) == ["a", "b"]
+    logs.remove("a")
+    assert logs.job_ids() == ["b"]
+    assert logs.window("a") == (0, 0)
+    assert logs.size("a") == 0
@@ -0,0 +1,136 @@
+from traintrack.scheduler.job_queue import JobQueue, constraint_key
+from traintrack.scheduler.policy import FairSharePolicy
+from traintrack.schema.central_config import ShareConfig
+
+
+def _drain(queue: JobQueue):
+    order = []
+    while True:
+        job = queue.next_job()
+        if job is None:
+            return order
+        order.append(job.id)
+        queue.remove(job.id)
+
+
+def _fair_share(**shares) -> FairSharePolicy:
+    return FairSharePolicy(
+        by_group=False,
+        shares={name: ShareConfig(**share) for name, share in shares.items()},
+        default_share=ShareConfig(),
+        half_life=24.0,
+        held_gpu_hours=1.0,
+    )
+
+
+def test_priority_then_fifo(make_job):
+    queue = JobQueue()
+    a = make_job(priority=0)
+    b = make_job(priority=1)
+    c = make_job(priority=0)
+    d = make_job(priority=1)
+    for job in (a, b, c, d):
+        queue.push(job)
+    assert len(queue) == 4
+    assert _drain(queue) == [b.id, d.id, a.id, c.id]
+    assert len(queue) == 0
+
+
+def test_remove_and_reprioritize(make_job):
+    queue = JobQueue()
+    jobs = [make_job() for _ in range(4)]
+    for job in jobs:
+        queue.push(job)
+    assert queue.remove(jobs[0].id).id == jobs[0].id
+    assert queue.remove(jobs[0].id) is None
+    assert jobs[0].id not in queue
+
+    # Moved ahead of the others, then back behind the jobs enqueued before it
+    assert queue.reprioritize(jobs[3].id, 5).request.priority == 5
+    assert queue.next_job().id == jobs[3].id
+    queue.reprioritize(jobs[3].id, 0)
+    assert _drain(queue) == [jobs[1].id, jobs[2].id, jobs[3].id]
+
+
+def test_next_job_excludes_constraint_classes(make_job):
+    queue = JobQueue()
+    big = make_job(num_gpus=2, priority=1)
+    small = make_job()
+    queue.push(big)
+    queue.push(small)
+    assert queue.next_job().id == big.id
+    excluded = [constraint_key(big.request)]
+    assert queue.next_job(exclude=excluded).id == small.id
+
+
+def test_top_is_a_look_ahead(make_job):
+    queue = JobQueue()
+    for i in range(30):
+        queue.push(make_job(priority=i % 3, num_gpus=1 + i % 2))
+    for i in range(0, 30, 4):
+        queue.remove(f"job{i}")
+    top = [job.id for job in queue.top(10)]
+    # top() does not consume the queue
+    assert len(queue) == 30 - 8
+    assert top == _drain(queue)[:10]
+
+
+def test_fair_share_serves_the_least_used_account(make_job):
+    policy = _fair_share()
+    queue = JobQueue(policy)
+    busy = [make_job("busy") for _ in range(3)]
+    idle = make_job("idle")
+    for job in busy + [idle]:
+        queue.push(job)
+    # The busy project holds a GPU already
+    policy.refresh([make_job("busy")])
+    assert queue.next_job().id == idle.id
+
+
+def test_fair_share_quota(make_job):
+    policy = _fair_share(capped={"max_gpus": 1})
+    queue = JobQueue(policy)
+    job = make_job("capped")
+    queue.push(job)
+    policy.refresh([make_job("capped")])
+    assert queue.next_job() is None
+    # Still in the look-ahead, last
+    other = make_job("other")
+    queue.push(other)
+    assert [j.id for j in queue.top(2)] == [other.id, job.id]
+
+
+def test_top_follows_scheduling_order(make_job):
+    policy = _fair_share(heavy={"weight": 3.0})
+    queue = JobQueue(policy)
+    for i in range(60):
+        queue.push(
+            make_job(
+                ["heavy", "light", "other"][i % 3],
+                priority=i % 4,
+                num_gpus=1 + i % 2,
+            )
+        )
+    for i in range(0, 60, 7):
+        queue.remove(f"job{i}")
+    policy.refresh([make_job("light"), make_job("other", num_gpus=2)])
+
+    top = [job.id for job in queue.top(20)]
+    # top() does not consume the queue, and ranks as next_job() would
+    # without charging the jobs it picks.
+    assert len(queue) == 60 - 9
+    assert top == _drain(queue)[:20]
+
+
+def test_find_by_project_and_group(make_job):
+    queue = JobQueue()
+    a = make_job("p1", "g1")
+    b = make_job("p1", "g2")
+    c = make_job("p2", "g1")
+    for job in (a, b, c):
+        queue.push(job)
+    assert {j.id for j in queue.find("p1")} == {a.id, b.id}
+    assert {j.id for j in queue.find("p1", "g2")} == {b.id}
+    assert {j.id for j in queue.find()} == {a.id, b.id, c.id}
+    queue.remove(b.id)
+    assert list(queue.find("p1", "g2")) == []
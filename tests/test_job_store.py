@@ -0,0 +1,99 @@
+import sqlite3
+import time
+
+import pytest
+
+from traintrack.scheduler.job_store import FencedError, JobStore
+from traintrack.scheduler.leader import LeaderLease
+from traintrack.schema.job import CentralJobState
+
+
+class _CountingStore(JobStore):
+    """Counts the transactions committed by the writer."""
+
+    commits = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = super()._connect()
+        conn.set_trace_callback(self._trace)
+        return conn
+
+    def _trace(self, sql: str):
+        if sql == "COMMIT":
+            self.commits += 1
+
+
+def test_round_trip(tmp_path, make_job):
+    path = str(tmp_path / "jobs.sqlite")
+    store = JobStore(path)
+    queued = make_job()
+    done = make_job()
+    store.put(queued, CentralJobState.QUEUED).result()
+    store.put(done, CentralJobState.SUCCEEDED, agent="a1").result()
+    store.set_disabled("a2", True).result()
+    store.close()
+
+    jobs, blacklist = JobStore(path).load(max_finished=10)
+    assert [(s.job.id, s.state, s.agent) for s in jobs] == [
+        (queued.id, CentralJobState.QUEUED, None),
+        (done.id, CentralJobState.SUCCEEDED, "a1"),
+    ]
+    assert blacklist == {"a2": True}
+
+
+def test_load_trims_the_finished_jobs(tmp_path, make_job):
+    path = str(tmp_path / "jobs.sqlite")
+    store = JobStore(path)
+    live = make_job()
+    finished = [make_job() for _ in range(5)]
+    store.put(live, CentralJobState.RUNNING, agent="a1")
+    for job in finished:
+        store.put(job, CentralJobState.FAILED)
+    store.close()
+
+    jobs, _ = JobStore(path).load(max_finished=2)
+    assert [s.job.id for s in jobs] == [live.id] + [j.id for j in finished[-2:]]
+
+
+def test_group_commit(tmp_path, make_job):
+    path = str(tmp_path / "jobs.sqlite")
+    store = _CountingStore(path)
+    store.put(make_job(), CentralJobState.QUEUED).result()
+    assert store.commits == 1
+
+    # Keep the writer waiting for the database while the writes pile up
+    blocker = sqlite3.connect(path, isolation_level=None)
+    blocker.execute("BEGIN IMMEDIATE")
+    jobs = [make_job() for _ in range(50)]
+    futures = [store.put(job, CentralJobState.QUEUED) for job in jobs]
+    time.sleep(0.2)
+    assert not any(f.done() for f in futures)
+    blocker.execute("COMMIT")
+    blocker.close()
+
+    for future in futures:
+        future.result(timeout=10)
+    # The first write may have been picked up alone before the others
+    assert store.commits <= 3
+    store.close()
+    jobs_loaded, _ = JobStore(path).load(max_finished=0)
+    assert len(jobs_loaded) == 51
+
+
+def test_fenced_by_the_lease(tmp_path, make_job):
+    path = str(tmp_path / "jobs.sqlite")
+    lease = LeaderLease(path, "old", None, ttl=0.3)
+    assert lease.acquire()
+    store = JobStore(path)
+    store.fence(lease.holder, lease.term)
+    store.put(make_job(), CentralJobState.QUEUED).result()
+
+    time.sleep(0.4)
+    usurper = LeaderLease(path, "new", None, ttl=10)
+    assert usurper.acquire()
+    with pytest.raises(FencedError):
+        store.put(make_job(), CentralJobState.QUEUED).result()
+    store.close()
+
+    jobs, _ = JobStore(path).load(max_finished=10)
+    assert len(jobs) == 1
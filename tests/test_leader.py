@@ -0,0 +1,109 @@
+import multiprocessing
+import os
+import queue
+import signal
+import time
+
+from traintrack.scheduler.leader import LeaderLease
+
+
+def test_single_holder(tmp_path):
+    path = str(tmp_path / "lease.sqlite")
+    a = LeaderLease(path, "a", "http://a", ttl=10)
+    b = LeaderLease(path, "b", "http://b", ttl=10)
+    assert a.leader() is None
+    assert a.acquire()
+    assert a.held and a.term == 1
+    assert not b.acquire()
+    assert not b.held
+    assert b.leader() == ("a", "http://a")
+
+
+def test_renewal_keeps_the_term(tmp_path):
+    lease = LeaderLease(str(tmp_path / "lease.sqlite"), "a", None, ttl=10)
+    assert lease.acquire()
+    assert lease.acquire()
+    assert lease.term == 1
+
+
+def test_takeover_after_expiry(tmp_path):
+    path = str(tmp_path / "lease.sqlite")
+    a = LeaderLease(path, "a", None, ttl=0.3)
+    b = LeaderLease(path, "b", None, ttl=10)
+    assert a.acquire()
+    assert not b.acquire()
+    time.sleep(0.4)
+    assert not a.held
+    assert b.acquire()
+    assert b.term == 2
+    # The old leader cannot come back while the new one holds the lease
+    assert not a.acquire()
+
+
+def test_same_holder_after_losing_bumps_the_term(tmp_path):
+    lease = LeaderLease(str(tmp_path / "lease.sqlite"), "a", None, ttl=0.2)
+    assert lease.acquire()
+    time.sleep(0.3)
+    assert lease.acquire()
+    assert lease.term == 2
+
+
+def test_release_hands_over_right_away(tmp_path):
+    path = str(tmp_path / "lease.sqlite")
+    a = LeaderLease(path, "a", None, ttl=10)
+    b = LeaderLease(path, "b", None, ttl=10)
+    assert a.acquire()
+    a.release()
+    assert not a.held
+    assert a.leader() is None
+    assert b.acquire()
+    assert b.term == 2
+
+
+def _contend(path: str, holder: str, ttl: float, terms):
+    """Keep the lease like central does, recording the terms held."""
+    lease = LeaderLease(path, holder, None, ttl=ttl)
+    while True:
+        if lease.acquire():
+            terms.put((holder, lease.term))
+        time.sleep(ttl / 3)
+
+
+def test_failover_between_processes(tmp_path):
+    path = str(tmp_path / "lease.sqlite")
+    ttl = 0.6
+    ctx = multiprocessing.get_context("spawn")
+    terms = ctx.Queue()
+    procs = [
+        ctx.Process(target=_contend, args=(path, f"c{i}", ttl, terms), daemon=True)
+        for i in range(3)
+    ]
+    for p in procs:
+        p.start()
+    seen = {}
+
+    def _collect(until: float):
+        while time.monotonic() < until:
+            try:
+                holder, term = terms.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            # Each term has a single holder
+            assert seen.setdefault(term, holder) == holder
+
+    try:
+        _collect(time.monotonic() + 3 * ttl)
+        first = max(seen)
+        leader = seen[first]
+        os.kill(procs[int(leader[1:])].pid, signal.SIGKILL)
+        killed_at = time.monotonic()
+        _collect(killed_at + 4 * ttl)
+    finally:
+        for p in procs:
+            p.kill()
+            p.join()
+
+    assert first == 1
+    # A standby took over with the next term once the lease expired
+    assert max(seen) == 2
+    assert seen[2] != leader
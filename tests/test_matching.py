@@ -0,0 +1,77 @@
+from typing import List
+
+from traintrack.scheduler.matching import CapacityTable
+from traintrack.schema.status import AgentStatus, WorkerStatus
+
+NOW = 1000.0
+
+
+def _status(busy: List[bool], gpu_type: str = "3090") -> AgentStatus:
+    return AgentStatus(
+        workers=[
+            WorkerStatus(host="h", id=i, gpu_type=gpu_type, available=not b)
+            for i, b in enumerate(busy)
+        ]
+    )
+
+
+def test_find_prefers_best_fit(make_job):
+    table = CapacityTable()
+    table.add_agent("roomy", _status([False, False, False]))
+    table.add_agent("tight", _status([False, True, True]))
+    agent, rc = table.find(make_job().request)
+    assert agent == "tight"
+    assert table.take(agent, rc) == [0]
+    assert table.free("tight") == 0
+    assert table.find(make_job(num_gpus=3).request)[0] == "roomy"
+    assert table.find(make_job(gpu_types=["a100"]).request) is None
+
+
+def test_reserve_for_holds_the_closest_agent(make_job):
+    table = CapacityTable()
+    table.add_agent("a", _status([False, False, True, True]))
+    table.add_agent("b", _status([False, True, True, True]))
+    big = make_job(num_gpus=4).request
+    assert table.find(big) is None
+    assert table.reserve_for(big, NOW) == "a"
+    # The free workers of a are kept for the big job, and nothing is known
+    # about when it can start, so they cannot be backfilled.
+    assert table.free("a") == 0
+    assert table.held == 0
+    assert table.find(make_job().request)[0] == "b"
+    assert table.backfill(make_job().request, 1.0, NOW) is None
+
+
+def test_reserve_for_skips_agents_too_small(make_job):
+    table = CapacityTable()
+    table.add_agent("small", _status([False, False]))
+    assert table.reserve_for(make_job(num_gpus=4).request, NOW) is None
+    assert table.free("small") == 2
+
+
+def test_backfill_before_the_expected_start(make_job):
+    table = CapacityTable()
+    table.add_agent("a", _status([False, False, True, True]))
+    table.release_at("a", [2], NOW + 100)
+    table.release_at("a", [3], NOW + 200)
+    table.reserve_for(make_job(num_gpus=4).request, NOW)
+    assert table.held == 2
+
+    short = make_job().request
+    assert table.backfill(short, None, NOW) is None
+    assert table.backfill(short, 300.0, NOW) is None
+    assert table.backfill(make_job(num_gpus=3).request, 50.0, NOW) is None
+    assert table.backfill(short, 50.0, NOW) == ("a", [0])
+    assert table.backfill(short, 200.0, NOW) == ("a", [1])
+    assert table.held == 0
+    assert table.backfill(short, 50.0, NOW) is None
+
+
+def test_reserve_for_gives_back_workers_not_needed(make_job):
+    table = CapacityTable()
+    table.add_agent("a", _status([False, True, True, True]))
+    # Three workers are freed at once, one more than the job needs
+    table.release_at("a", [1, 2, 3], NOW + 10)
+    table.reserve_for(make_job(num_gpus=3).request, NOW)
+    assert table.held == 0
+    assert table.find(make_job().request)[0] == "a"
@@ -0,0 +1,123 @@
+import os
+import time
+
+from traintrack.runner.base import Runner
+from traintrack.schema.agent_config import AgentConfig
+from traintrack.schema.job import AgentJob, JobDescription, JobState
+
+
+class FakeRunner(Runner):
+    """Jobs start right away and run until finished by the test."""
+
+    def __init__(self, agent_config: AgentConfig):
+        super().__init__(agent_config)
+        self._restore()
+
+    def _launch(self, job: AgentJob):
+        self._started(job.id)
+
+    def _kill(self, job: AgentJob):
+        self._finish(job.id, -15)
+
+
+def _runner(tmp_path, num_workers: int = 2, **config) -> FakeRunner:
+    return FakeRunner(
+        AgentConfig(
+            workers=[
+                {"gpu_id": i, "gpu_type": "3090", "repos": {}}
+                for i in range(num_workers)
+            ],
+            state_dir=str(tmp_path),
+            **config,
+        )
+    )
+
+
+def _job(name: str = "job") -> JobDescription:
+    return JobDescription(
+        project="p",
+        group="g",
+        name=name,
+        repo="Hobot",
+        spec={"branch": "main", "config": "conf.py"},
+    )
+
+
+def _wait_for(runner: Runner, job_id: str, state: JobState) -> AgentJob:
+    deadline = time.monotonic() + 5.0
+    while time.monotonic() < deadline:
+        job = runner.get_job(job_id)
+        if job is not None and job.state == state:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"Job {job_id} is not {state.value}.")
+
+
+def test_finished_logs_are_bounded(tmp_path):
+    runner = _runner(tmp_path, max_finished_log_bytes=25)
+    for i in range(4):
+        job_id = f"job{i}"
+        assert runner.run_job(_job(), job_id=job_id).accepted
+        _wait_for(runner, job_id, JobState.RUNNING)
+        runner.logs.append(job_id, b"0123456789")
+        runner._finish(job_id, 0)
+    # The oldest logs are removed, the jobs are still known
+    assert sorted(runner.logs.job_ids()) == ["job2", "job3"]
+    assert runner.get_job("job0").state == JobState.SUCCEEDED
+
+    # Leftovers of the jobs that finished before a restart count too, the
+    # least recently written first
+    os.utime(runner.logs.path("job2"), (0, 0))
+    runner = _runner(tmp_path, max_finished_log_bytes=15)
+    assert runner.logs.job_ids() == ["job3"]
+
+
+def test_reserve(tmp_path):
+    runner = _runner(tmp_path)
+    assert runner.reserve("a", [0], ttl=60).accepted
+    # Again only extends the reservation
+    assert runner.reserve("a", [0], ttl=60).accepted
+    assert not runner.reserve("b", [0], ttl=60).accepted
+    assert not runner.reserve("b", [2], ttl=60).accepted
+    assert runner.reserve("b", [1], ttl=60).accepted
+
+    runner.release("b")
+    assert runner.reserve("c", [1], ttl=0.0).accepted
+    # Expired right away
+    assert runner.reserve("b", [1], ttl=60).accepted
+
+
+def test_run_job_uses_the_reservation(tmp_path):
+    runner = _runner(tmp_path)
+    assert runner.reserve("a", [1], ttl=60).accepted
+    # Reserved workers are not given to other jobs
+    response = runner.run_job(_job(), job_id="b")
+    assert response.accepted
+    assert runner.get_job("b").worker_ids == [0]
+    assert not runner.run_job(_job(), job_id="c").accepted
+
+    assert runner.run_job(_job(), job_id="a").accepted
+    assert _wait_for(runner, "a", JobState.RUNNING).worker_ids == [1]
+    # The reservation is consumed, and a job that ran cannot reserve again
+    assert not runner.reserve("a", [1], ttl=60).accepted
+
+
+def test_run_job_is_idempotent(tmp_path):
+    runner = _runner(tmp_path)
+    response = runner.run_job(_job(), [0], job_id="a", idempotency_key="1/a")
+    assert response.accepted and response.job_id == "a"
+    _wait_for(runner, "a", JobState.RUNNING)
+
+    # The same placement sent again gets the same answer, without a second run
+    response = runner.run_job(_job(), [0], job_id="a", idempotency_key="1/a")
+    assert response.accepted and response.job_id == "a"
+    assert len(runner.list_jobs()) == 1
+
+    # Any other placement with the same id is a duplicate, even once finished
+    for key in ("2/a", None):
+        response = runner.run_job(_job(), [1], job_id="a", idempotency_key=key)
+        assert not response.accepted
+        assert "Duplicate" in response.reason
+    runner._finish("a", 0)
+    assert not runner.run_job(_job(), [1], job_id="a", idempotency_key="2/a").accepted
+    assert runner.get_job("a").state == JobState.SUCCEEDED
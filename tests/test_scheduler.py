@@ -0,0 +1,303 @@
+import asyncio
+import json
+from datetime import datetime
+from typing import Dict, List
+
+
+from traintrack.scheduler import CentralScheduler
+from traintrack.schema.job import (
+    AgentJob,
+    CentralJobState,
+    JobState,
+    QueuedJob,
+    ReserveResponse,
+    ReserveResult,
+    RunBatchResponse,
+    RunJobResponse,
+)
+from traintrack.schema.status import AgentStatus, WorkerStatus
+
+
+class FakeAgents(object):
+    """Stands in for the agents behind the scheduler's requests."""
+
+    def __init__(self, workers: Dict[str, int]):
+        self.workers = workers
+        # agent -> agent job id -> worker ids
+        self.running: Dict[str, Dict[str, List[int]]] = {a: {} for a in workers}
+        # agent -> the jobs it reports on /jobs
+        self.reports: Dict[str, List[AgentJob]] = {a: [] for a in workers}
+
+    def status(self, agent: str) -> AgentStatus:
+        busy = {i for ids in self.running[agent].values() for i in ids}
+        return AgentStatus(
+            workers=[
+                WorkerStatus(host=agent, id=i, gpu_type="3090", available=i not in busy)
+                for i in range(self.workers[agent])
+            ]
+        )
+
+    async def get(self, end_point, api: str) -> str | None:
+        if api == "status":
+            return self.status(end_point.name).json()
+        if api == "jobs":
+            return json.dumps(
+                [json.loads(job.json()) for job in self.reports[end_point.name]]
+            )
+        return None
+
+    async def post(self, end_point, api: str, payload: str, idempotent=False):
+        body = json.loads(payload)
+        if api == "reserve":
+            results = [ReserveResult(accepted=True) for _ in body["reservations"]]
+            return ReserveResponse(results=results).json()
+        if api == "run_batch":
+            for p in body["placements"]:
+                self.running[end_point.name][p["job_id"]] = p["worker_ids"]
+            results = [
+                RunJobResponse(accepted=True, job_id=p["job_id"])
+                for p in body["placements"]
+            ]
+            return RunBatchResponse(results=results).json()
+        return json.dumps({"success": True})
+
+    def finish(self, agent: str, job_id: str) -> List[int]:
+        return self.running[agent].pop(job_id)
+
+
+def _scheduler(tmp_path, monkeypatch, agents: Dict[str, int], **config):
+    end_points = [
+        {
+            "name": name,
+            "port": 5975,
+            "ssh_uri": name,
+            "ssh_port": 22,
+            "ssh_proxy": None,
+            "ssh_proxy_port": None,
+            "ssh_key_file": "key",
+        }
+        for name in agents
+    ]
+    path = tmp_path / "central.json"
+    path.write_text(
+        json.dumps(
+            {
+                "agents": end_points,
+                "job_store": str(tmp_path / "jobs.sqlite"),
+                **config,
+            }
+        )
+    )
+    monkeypatch.setenv("TRAINTRACK_CENTRAL_CONFIG", str(path))
+    scheduler = CentralScheduler()
+    fake = FakeAgents(agents)
+    scheduler.afetch_get = fake.get
+    scheduler.afetch_post = fake.post
+    assert scheduler._lease.acquire()
+    return scheduler, fake
+
+
+def _request(**request) -> dict:
+    desc = {
+        "project": "p",
+        "group": "g",
+        "name": "job",
+        "repo": "Hobot",
+        "spec": {"branch": "main", "config": "conf.py"},
+    }
+    return {"job": desc, **request}
+
+
+def _finished(fake: FakeAgents, job: QueuedJob, state: JobState, code: int) -> AgentJob:
+    """Finish the current attempt of the job on its agent."""
+    worker_ids = fake.finish(job.agent, job.agent_job_id)
+    return AgentJob(
+        id=job.agent_job_id,
+        job=job.request.job,
+        worker_ids=worker_ids,
+        state=state,
+        created_at=datetime.now(),
+        finished_at=datetime.now(),
+        exit_code=code,
+    )
+
+
+def _fail(scheduler: CentralScheduler, fake: FakeAgents, job: QueuedJob, code: int):
+    """Report the current attempt of the job as failed on its agent."""
+    job = scheduler.get_job(job.id)
+    report = _finished(fake, job, JobState.FAILED, code)
+    with scheduler._lock:
+        scheduler._apply_report(job.agent, report)
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+def _retried(tmp_path, monkeypatch, agents, **config) -> List[str]:
+    """Run a job that fails on its first agent, and return the agents of
+    its attempts."""
+    scheduler, fake = _scheduler(tmp_path, monkeypatch, agents, **config)
+
+    async def _main():
+        retry = {"max_attempts": 3, "backoff": 0.0}
+        [job] = await scheduler.enqueue_batch([_request(retry=retry)])
+        await scheduler._schedule_pass()
+        first = scheduler.get_job(job.id).agent
+        _fail(scheduler, fake, job, 1)
+        scheduler._maintain()
+        await scheduler._schedule_pass()
+        return [first, scheduler.get_job(job.id).agent]
+
+    try:
+        return _run(_main())
+    finally:
+        scheduler.close()
+
+
+def test_retry_avoids_the_failed_agent(tmp_path, monkeypatch):
+    first, second = _retried(tmp_path, monkeypatch, {"a0": 1, "a1": 1})
+    assert first is not None and second is not None
+    assert first != second
+
+
+def test_retry_falls_back_when_other_agents_are_disabled(tmp_path, monkeypatch):
+    agents = _retried(
+        tmp_path, monkeypatch, {"a0": 1, "a1": 1}, default_blacklist=["a0"]
+    )
+    assert agents == ["a1", "a1"]
+
+
+def test_retry_falls_back_when_other_agents_are_too_small(tmp_path, monkeypatch):
+    scheduler, fake = _scheduler(tmp_path, monkeypatch, {"a0": 1, "a1": 2})
+
+    async def _main():
+        retry = {"max_attempts": 2, "backoff": 0.0}
+        [job] = await scheduler.enqueue_batch([_request(num_gpus=2, retry=retry)])
+        await scheduler._schedule_pass()
+        _fail(scheduler, fake, job, 1)
+        scheduler._maintain()
+        await scheduler._schedule_pass()
+        job = scheduler.get_job(job.id)
+        # The user's blacklist is left alone
+        assert job.request.agent_blacklist == []
+        assert job.avoided_agents == ["a1"]
+        return job
+
+    try:
+        job = _run(_main())
+    finally:
+        scheduler.close()
+    assert (job.attempt, job.agent) == (2, "a1")
+
+
+def test_retry_backs_off(tmp_path, monkeypatch):
+    scheduler, fake = _scheduler(tmp_path, monkeypatch, {"a0": 1})
+
+    async def _main():
+        retry = {"max_attempts": 2, "backoff": 3600.0}
+        [job] = await scheduler.enqueue_batch([_request(retry=retry)])
+        await scheduler._schedule_pass()
+        _fail(scheduler, fake, job, 1)
+        scheduler._maintain()
+        await scheduler._schedule_pass()
+        job = scheduler.get_job(job.id)
+        assert job.state.value == "queued" and job.agent is None
+        assert (job.not_before - datetime.now()).total_seconds() > 3500
+
+        # Given up after max_attempts
+        scheduler._delayed = [(datetime.now(), job.id)]
+        scheduler._maintain()
+        await scheduler._schedule_pass()
+        _fail(scheduler, fake, job, 1)
+        return scheduler.get_job(job.id)
+
+    try:
+        job = _run(_main())
+    finally:
+        scheduler.close()
+    assert (job.state.value, job.attempt, job.failures) == ("failed", 2, 2)
+
+
+def test_ready_once_the_jobs_are_loaded(tmp_path, monkeypatch):
+    scheduler, _ = _scheduler(tmp_path, monkeypatch, {"a0": 1})
+    try:
+        # Holding the lease is not enough to serve requests
+        assert scheduler.is_leader and not scheduler.is_ready
+        _run(scheduler._lead())
+        assert scheduler.is_ready
+    finally:
+        scheduler.close()
+
+
+def test_pass_polls_the_jobs_of_polled_agents(tmp_path, monkeypatch):
+    scheduler, fake = _scheduler(tmp_path, monkeypatch, {"a0": 1})
+
+    async def _main():
+        [job] = await scheduler.enqueue_batch([_request()])
+        await scheduler._schedule_pass()
+        job = scheduler.get_job(job.id)
+        assert job.state.value == "dispatched"
+        # No heartbeats, the next pass polls the agent
+        fake.reports["a0"] = [_finished(fake, job, JobState.SUCCEEDED, 0)]
+        scheduler.invalidate_agent("a0")
+        await scheduler._schedule_pass()
+        return scheduler.get_job(job.id)
+
+    try:
+        job = _run(_main())
+    finally:
+        scheduler.close()
+    assert (job.state.value, job.exit_code) == ("succeeded", 0)
+
+
+def test_list_jobs(tmp_path, monkeypatch):
+    scheduler, _ = _scheduler(tmp_path, monkeypatch, {"a0": 1, "a1": 1})
+
+    async def _main():
+        requests = []
+        for i in range(5):
+            request = _request(priority=-i)
+            request["job"]["project"] = f"p{i % 2}"
+            requests.append(request)
+        jobs = await scheduler.enqueue_batch(requests)
+        # The first two jobs go to the two agents
+        await scheduler._schedule_pass()
+        return [job.id for job in jobs]
+
+    try:
+        ids = _run(_main())
+        pages = []
+        cursor = None
+        while True:
+            page = scheduler.list_jobs(cursor=cursor, limit=2)
+            pages.append([job.id for job in page.jobs])
+            cursor = page.next_cursor
+            if cursor is None:
+                break
+        # Every job once, in the order they were enqueued
+        assert [len(page) for page in pages] == [2, 2, 1]
+        everything = [job_id for page in pages for job_id in page]
+        assert sorted(everything) == sorted(ids)
+        assert everything == [job.id for job in scheduler.list_jobs().jobs]
+
+        def _ids(**filters):
+            return {job.id for job in scheduler.list_jobs(**filters).jobs}
+
+        assert _ids(project="p0") == {ids[0], ids[2], ids[4]}
+        assert _ids(project="p1", group="g") == {ids[1], ids[3]}
+        assert _ids(project="p1", group="other") == set()
+        assert _ids(state=CentralJobState.QUEUED) == set(ids[2:])
+        assert _ids(state=CentralJobState.DISPATCHED) == set(ids[:2])
+        assert _ids(state=CentralJobState.QUEUED, agent="a0") == set()
+        assert len(_ids(agent="a0")) == 1
+        assert _ids(project="p0", state=CentralJobState.DISPATCHED) == {ids[0]}
+        # A filtered listing pages too
+        page = scheduler.list_jobs(state=CentralJobState.QUEUED, limit=2)
+        rest = scheduler.list_jobs(
+            state=CentralJobState.QUEUED, cursor=page.next_cursor
+        )
+        assert {job.id for job in page.jobs + rest.jobs} == set(ids[2:])
+        assert rest.next_cursor is None
+    finally:
+        scheduler.close()
@@ -0,0 +1,71 @@
+import pytest
+
+from traintrack.schema.job import JobRequest
+from traintrack.templates.sweep import expand_sweep, parse_grid, parse_random
+
+
+def _base(**spec) -> JobRequest:
+    return JobRequest(
+        job={
+            "project": "p",
+            "group": "g",
+            "name": "run",
+            "notes": "base",
+            "repo": "Hobot",
+            "spec": {"branch": "main", "config": "conf.py", **spec},
+        },
+        priority=2,
+    )
+
+
+def test_parse_grid():
+    assert parse_grid(["lr=0.1,0.01", "bs=32"]) == {
+        "lr": ["0.1", "0.01"],
+        "bs": ["32"],
+    }
+    for option in ("lr", "lr="):
+        with pytest.raises(ValueError):
+            parse_grid([option])
+
+
+def test_parse_random():
+    assert parse_random(["lr=log:1e-4:1e-2", "wd=0:0.1"]) == {
+        "lr": (1e-4, 1e-2, True),
+        "wd": (0.0, 0.1, False),
+    }
+    for option in ("lr", "lr=1", "lr=1:2:3", "lr=log:0:1"):
+        with pytest.raises(ValueError):
+            parse_random([option])
+
+
+def test_expand_grid():
+    base = _base(overrides={"epochs": "10", "lr": "1"})
+    jobs = expand_sweep(base, parse_grid(["lr=0.1,0.01", "bs=32,64"]), {})
+    assert len(jobs) == 4
+    assert [job.job.name for job in jobs] == [f"run.{i:03d}" for i in range(4)]
+    # The swept overrides win over the base ones, the others are kept
+    assert [job.job.spec.overrides for job in jobs] == [
+        {"epochs": "10", "lr": lr, "bs": bs}
+        for lr in ("0.1", "0.01")
+        for bs in ("32", "64")
+    ]
+    assert jobs[0].job.notes == "base lr=0.1 bs=32"
+    assert all(job.priority == 2 for job in jobs)
+    # The base job is left alone
+    assert base.job.spec.overrides == {"epochs": "10", "lr": "1"}
+
+
+def test_expand_random():
+    ranges = parse_random(["lr=log:1e-4:1e-2", "wd=0:0.1"])
+    jobs = expand_sweep(_base(), parse_grid(["bs=32,64"]), ranges, samples=3, seed=1)
+    assert len(jobs) == 6
+    for job in jobs:
+        overrides = job.job.spec.overrides
+        assert 1e-4 <= float(overrides["lr"]) <= 1e-2
+        assert 0.0 <= float(overrides["wd"]) <= 0.1
+    assert [job.job.spec.overrides["bs"] for job in jobs] == ["32"] * 3 + ["64"] * 3
+    # Seeded sweeps are reproducible
+    again = expand_sweep(_base(), parse_grid(["bs=32,64"]), ranges, samples=3, seed=1)
+    assert [job.job.spec for job in again] == [job.job.spec for job in jobs]
+    # Samples only apply to random ranges
+    assert len(expand_sweep(_base(), {}, {}, samples=3)) == 1
@@ -1,13 +1,28 @@
 import os
 import socket
+import asyncio
+from typing import Dict, List
 
+import requests
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from loguru import logger
 from traintrack.schema.agent_config import AgentConfig
 
-from traintrack.schema.job import JobDescription
+from traintrack.schema.job import (
+    AgentJob,
+    JobDescription,
+    PrepareRequest,
+    ReleaseRequest,
+    ReserveRequest,
+    ReserveResponse,
+    RunBatchRequest,
+    RunBatchResponse,
+)
+from traintrack.schema.status import AgentHeartbeat, HeartbeatResponse
+from traintrack.runner.process_runner import ProcessRunner
 from traintrack.runner.tmux_runner import TmuxRunner
 
 
@@ -21,24 +36,119 @@ app.add_middleware(
 )
 
 
-def init_runner() -> TmuxRunner:
+def load_config() -> AgentConfig:
     # Read the path to the configuration file from an environment variable
     config_file_path = os.environ.get("TRAINTRACK_AGENT_CONFIG")
     if config_file_path is None:
         raise ValueError("TRAINTRACK_AGENT_CONFIG environment variable is not set")
 
     # Load the agent configuration from the file
-    agent_config = AgentConfig.parse_file(config_file_path)
+    return AgentConfig.parse_file(config_file_path)
+
 
+def init_runner(agent_config: AgentConfig) -> TmuxRunner | ProcessRunner:
+    if agent_config.runner == "process":
+        return ProcessRunner(agent_config)
     return TmuxRunner(agent_config)
 
 
-runner = init_runner()
+agent_config = load_config()
+runner = init_runner(agent_config)
+# Set to push a heartbeat right away instead of waiting for the next one.
+status_changed = asyncio.Event()
+# Job id -> its latest state, for the jobs whose transitions have not been
+# reported to central yet
+changed_jobs: Dict[str, AgentJob] = {}
+
+# Size of the chunks the logs are streamed in
+_LOG_CHUNK_BYTES = 64 * 1024
+# Seconds between two reads of a log that is followed and has nothing new
+_LOG_POLL_INTERVAL = 0.5
+
+
+async def _heartbeat_loop(central_urls: List[str]):
+    """Push the status to central on change and at every heartbeat.
+
+    The full status is only sent when it changed (or when central asks for
+    it, e.g. after a restart). Otherwise the heartbeat just carries the
+    version so that central can keep the cached status fresh. The jobs that
+    changed state are sent until central acknowledges them.
+
+    Central instances that fail or are standing by are skipped for the next
+    one of the list, until the leader is found.
+
+    """
+    global runner, agent_config
+    name = agent_config.name or socket.gethostname()
+    current = 0
+    version = 0
+    last_status = None
+    send_status = True
+    while True:
+        status_changed.clear()
+        status = await asyncio.to_thread(runner.status)
+        if status != last_status:
+            version += 1
+            last_status = status
+            send_status = True
+
+        jobs = dict(changed_jobs)
+        heartbeat = AgentHeartbeat(
+            name=name,
+            version=version,
+            status=status if send_status else None,
+            jobs=list(jobs.values()),
+        )
+        retry_now = False
+        central_url = central_urls[current]
+        try:
+            response = await asyncio.to_thread(
+                requests.post,
+                f"{central_url}/heartbeat",
+                data=heartbeat.json(),
+                headers={"Content-Type": "application/json"},
+                timeout=agent_config.heartbeat_interval,
+            )
+            response.raise_for_status()
+            send_status = HeartbeatResponse.parse_raw(response.content).need_status
+            retry_now = send_status
+            for job_id, job in jobs.items():
+                # Unless it changed again in the meantime
+                if changed_jobs.get(job_id) is job:
+                    del changed_jobs[job_id]
+        except requests.RequestException as e:
+            logger.warning(f"Failed to send heartbeat to {central_url}: {e}")
+            send_status = True
+            if len(central_urls) > 1:
+                current = (current + 1) % len(central_urls)
+                # Try the next one right away, unless they have all failed
+                retry_now = current != 0
+
+        if retry_now:
+            continue
+        try:
+            await asyncio.wait_for(
+                status_changed.wait(), timeout=agent_config.heartbeat_interval
+            )
+        except asyncio.TimeoutError:
+            pass
+
+
+def _job_changed(job: AgentJob):
+    if agent_config.central_url is not None:
+        changed_jobs[job.id] = job
+    status_changed.set()
 
 
 @app.on_event("startup")
 async def on_startup():
-    global runner
+    global runner, agent_config
+    # Jobs change state in the launch threads, wake up the heartbeat loop.
+    loop = asyncio.get_running_loop()
+    runner.add_listener(lambda job: loop.call_soon_threadsafe(_job_changed, job))
+    if agent_config.central_url is not None:
+        central_urls = [agent_config.central_url] + agent_config.standby_urls
+        asyncio.create_task(_heartbeat_loop(central_urls))
     logger.success(f"Traintrack agent started on {socket.gethostname()}.")
 
 
@@ -53,6 +163,118 @@ async def run_job(job: JobDescription):
     return runner.run_job(job)
 
 
+@app.post("/run_batch")
+async def run_batch(batch: RunBatchRequest) -> RunBatchResponse:
+    global runner
+    results = [
+        runner.run_job(
+            p.job,
+            worker_ids=p.worker_ids,
+            job_id=p.job_id,
+            idempotency_key=p.idempotency_key,
+        )
+        for p in batch.placements
+    ]
+    return RunBatchResponse(results=results)
+
+
+@app.post("/reserve")
+async def reserve(request: ReserveRequest) -> ReserveResponse:
+    """First phase of running jobs: hold the workers, then run_batch the jobs
+    with the same ids."""
+    global runner
+    results = [
+        runner.reserve(r.job_id, r.worker_ids, ttl=request.ttl)
+        for r in request.reservations
+    ]
+    return ReserveResponse(results=results)
+
+
+@app.post("/release")
+async def release(request: ReleaseRequest):
+    global runner
+    for job_id in request.job_ids:
+        runner.release(job_id)
+    return {"success": True}
+
+
+@app.post("/prepare")
+async def prepare(request: PrepareRequest):
+    global runner
+    return {"taken": runner.prepare(request.hints)}
+
+
+@app.get("/jobs")
+async def list_jobs() -> List[AgentJob]:
+    global runner
+    return runner.list_jobs()
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str) -> AgentJob:
+    global runner
+    job = runner.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    global runner
+    return {"success": await asyncio.to_thread(runner.cancel_job, job_id)}
+
+
+async def _stream_log(job_id: str, offset: int, end: int | None, follow: bool):
+    global runner
+    while end is None or offset < end:
+        length = (
+            _LOG_CHUNK_BYTES if end is None else min(_LOG_CHUNK_BYTES, end - offset)
+        )
+        # Check before reading, so that nothing written before the job
+        # finished is missed.
+        job = runner.get_job(job_id)
+        finished = job is None or job.finished_at is not None
+        offset, data = await asyncio.to_thread(runner.logs.read, job_id, offset, length)
+        if len(data) > 0:
+            offset += len(data)
+            yield data
+        elif not follow or finished:
+            break
+        else:
+            await asyncio.sleep(_LOG_POLL_INTERVAL)
+
+
+@app.get("/jobs/{job_id}/log")
+async def get_log(
+    job_id: str, offset: int = 0, length: int | None = None, follow: bool = False
+):
+    """Stream the output of the job from the offset.
+
+    A negative offset counts from the end of the log. With ``follow`` the
+    stream keeps going until the job finishes, otherwise it stops at the end
+    of what has been written so far, or after ``length`` bytes. The offset of
+    the first byte is sent in the ``X-Log-Offset`` header, since the oldest
+    part of the log may have been rotated out.
+
+    """
+    global runner
+    if runner.get_job(job_id) is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    start, end = await asyncio.to_thread(runner.logs.window, job_id)
+    if offset < 0:
+        offset = end + offset
+    offset = max(offset, start)
+    stop = None if length is None else offset + length
+    if not follow and stop is None:
+        stop = end
+    return StreamingResponse(
+        _stream_log(job_id, offset, stop, follow),
+        media_type="application/octet-stream",
+        headers={"X-Log-Offset": str(offset)},
+    )
+
+
 @app.get("/status")
 async def status():
     global runner
@@ -1,16 +1,27 @@
 import os
 import socket
 import asyncio
-from typing import List
 
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from loguru import logger
 
 from traintrack.scheduler import CentralScheduler
-from traintrack.schema.job import JobDescription, JobRequest
-from traintrack.schema.status import ListWorkersResponse
+from traintrack.schema.job import (
+    CentralJobState,
+    EnqueueBatchRequest,
+    JobDescription,
+    JobPage,
+    JobRequest,
+    QueuedJob,
+)
+from traintrack.schema.status import (
+    AgentHeartbeat,
+    HeartbeatResponse,
+    ListWorkersResponse,
+)
 
 
 app = FastAPI()
@@ -27,50 +38,194 @@ scheduler = CentralScheduler()
 
 
 @app.on_event("startup")
-def on_startup():
-    async def _periodic_try_schedule():
-        global scheduler
-        while True:
-            scheduler._try_schedule()
-            await asyncio.sleep(scheduler._config.schedule_interval)
-
-    asyncio.create_task(_periodic_try_schedule())
+async def on_startup():
+    global scheduler
+    asyncio.create_task(scheduler.run())
     logger.success(f"Traintrack central started on {socket.gethostname()}.")
 
 
+@app.on_event("shutdown")
+def on_shutdown():
+    global scheduler
+    scheduler.close()
+
+
+@app.middleware("http")
+async def only_leader(request: Request, call_next):
+    """A standby instance only answers where the leader is. The leader only
+    answers once it has loaded the jobs."""
+    global scheduler
+    if request.url.path == "/leader" or scheduler.is_ready:
+        return await call_next(request)
+    if scheduler.is_leader:
+        return JSONResponse(
+            status_code=503,
+            content={"detail": "Taking over, not ready yet.", "leader": None},
+        )
+    leader = await asyncio.to_thread(scheduler.leader)
+    return JSONResponse(
+        status_code=503,
+        content={
+            "detail": "Standing by, not the leader.",
+            "leader": None if leader is None else leader[1],
+        },
+    )
+
+
+@app.get("/leader")
+async def get_leader():
+    global scheduler
+    leader = await asyncio.to_thread(scheduler.leader)
+    return {
+        "is_leader": scheduler.is_leader,
+        "ready": scheduler.is_ready,
+        "leader": None if leader is None else leader[0],
+        "url": None if leader is None else leader[1],
+    }
+
+
 @app.get("/workers")
-def list_workers() -> ListWorkersResponse:
+async def list_workers() -> ListWorkersResponse:
+    global scheduler
+    return ListWorkersResponse(workers=await scheduler.list_workers())
+
+
+@app.get("/workers/stream")
+async def stream_workers():
+    """Newline delimited JSON, one ListWorkersResponse per agent."""
     global scheduler
-    return ListWorkersResponse(workers=scheduler.list_workers())
+
+    async def _lines():
+        async for workers in scheduler.stream_workers():
+            yield ListWorkersResponse(workers=workers).json() + "\n"
+
+    return StreamingResponse(_lines(), media_type="application/x-ndjson")
 
 
 @app.post("/enqueue")
-def enqueue_job(job: JobRequest):
+async def enqueue_job(job: JobRequest):
     global scheduler
-    success = scheduler.enqueue(job)
-    return {"success": success}
+    queued = await scheduler.enqueue(job)
+    return {"success": True, "id": queued.id}
+
+
+@app.post("/enqueue_batch")
+async def enqueue_batch(batch: EnqueueBatchRequest):
+    global scheduler
+    queued = await scheduler.enqueue_batch(batch.jobs)
+    return {"success": True, "ids": [q.id for q in queued]}
 
 
 @app.get("/jobs")
-def list_jobs() -> List[JobRequest]:
+def list_jobs(
+    project: str | None = None,
+    group: str | None = None,
+    state: CentralJobState | None = None,
+    agent: str | None = None,
+    cursor: str | None = None,
+    limit: int = Query(default=100, ge=1, le=1000),
+) -> JobPage:
+    global scheduler
+    try:
+        return scheduler.list_jobs(
+            project=project,
+            group=group,
+            state=state,
+            agent=agent,
+            cursor=cursor,
+            limit=limit,
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid cursor '{cursor}'")
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str) -> QueuedJob:
+    global scheduler
+    job = scheduler.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+
+@app.get("/jobs/{job_id}/log")
+async def get_log(
+    job_id: str,
+    offset: int = 0,
+    length: int | None = None,
+    follow: bool = False,
+    agent: str | None = None,
+):
+    """Stream the log of the job from its agent, see the agent's /jobs/{id}/log.
+
+    The agent is found from the jobs central tracks, ``agent`` is only needed
+    for jobs that it has forgotten.
+
+    """
     global scheduler
-    return scheduler.list_jobs()
+    location = scheduler.job_end_point(job_id, agent)
+    if location is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} is not on any agent")
+    end_point, agent_job_id = location
+    if follow:
+        result = await scheduler.logs.follow(end_point, agent_job_id, offset)
+    else:
+        result = await scheduler.logs.read(end_point, agent_job_id, offset, length)
+    if result is None:
+        raise HTTPException(
+            status_code=502, detail=f"Cannot read the log from {end_point.name}"
+        )
+    offset, data = result
+    return StreamingResponse(
+        data,
+        media_type="application/octet-stream",
+        headers={"X-Log-Offset": str(offset)},
+    )
+
+
+@app.get("/cancel/{job_id}")
+async def cancel_job(job_id: str):
+    global scheduler
+    return {"success": await scheduler.cancel_job(job_id)}
+
+
+@app.get("/reprioritize/{job_id}/{priority}")
+async def reprioritize_job(job_id: str, priority: int):
+    global scheduler
+    job = scheduler.reprioritize_job(job_id, priority)
+    if job is None:
+        return {"success": False}
+    scheduler.request_schedule()
+    return {"success": True}
 
 
 @app.get("/disable/{agent_name}")
-def disable_agent(agent_name: str):
+async def disable_agent(agent_name: str):
     global scheduler
     scheduler.disable_agent(agent_name)
     return scheduler.agent_blacklist
 
 
 @app.get("/enable/{agent_name}")
-def enable_agent(agent_name: str):
+async def enable_agent(agent_name: str):
     global scheduler
     scheduler.enable_agent(agent_name)
     return scheduler.agent_blacklist
 
 
+@app.get("/invalidate/{agent_name}")
+def invalidate_agent(agent_name: str):
+    global scheduler
+    scheduler.invalidate_agent(agent_name)
+    return {"success": True}
+
+
+@app.post("/heartbeat")
+async def heartbeat(heartbeat: AgentHeartbeat) -> HeartbeatResponse:
+    global scheduler
+    return scheduler.report_heartbeat(heartbeat)
+
+
 @app.get("/blacklist")
 def agent_blacklist():
     global scheduler
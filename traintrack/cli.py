@@ -1,6 +1,7 @@
 import os
+import sys
 import json
-from typing import List
+from urllib.parse import urlencode
 
 import click
 from loguru import logger
@@ -8,24 +9,44 @@ from pydantic import BaseModel
 import pydantic
 import questionary
 import requests
+from rich.live import Live
 from rich.table import Table
 from rich.console import Console
-from traintrack.schema.job import JobRequest
+from traintrack.schema.job import (
+    CentralJobState,
+    EnqueueBatchRequest,
+    JobPage,
+    JobRequest,
+)
 
 from traintrack.schema.status import ListWorkersResponse
-from traintrack.templates.hobot import prompt_for_closing_gap_job, prompt_for_whole_body_job
+from traintrack.templates.hobot import (
+    prompt_for_closing_gap_job,
+    prompt_for_whole_body_job,
+)
+from traintrack.templates.sweep import expand_sweep, parse_grid, parse_random
 
 
 PORT = os.environ.get("TRAINTRACK_CENTRAL_PORT") or 5976
 
 
+def request(method: str, command: str, **kwargs) -> requests.Response:
+    """Send the request to central, or to the leader if it is a standby."""
+    response = requests.request(method, f"http://localhost:{PORT}/{command}", **kwargs)
+    content_type = response.headers.get("content-type")
+    if response.status_code == 503 and content_type == "application/json":
+        leader = response.json().get("leader")
+        if leader is not None:
+            response.close()
+            response = requests.request(method, f"{leader}/{command}", **kwargs)
+    return response
+
+
 def fetch(command: str, payload: BaseModel | None = None):
     if payload is not None:
-        response = requests.post(
-            f"http://localhost:{PORT}/{command}", json=payload.dict()
-        )
+        response = request("POST", command, json=payload.dict())
     else:
-        response = requests.get(f"http://localhost:{PORT}/{command}")
+        response = request("GET", command)
 
     if response.status_code == 200:
         return json.loads(response.content)
@@ -71,19 +92,66 @@ def new():
         return
 
     if result["success"]:
-        logger.success("Successfully submitted job.")
+        logger.success(f"Successfully submitted job {result['id']}.")
     else:
         logger.error("Job was rejected.")
 
 
 @cli.command()
-def workers():
-    result = fetch("workers")
+@click.argument("base", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--grid", "-g", multiple=True, help="Override values to try, KEY=V1,V2,..."
+)
+@click.option(
+    "--random",
+    "-r",
+    "ranges",
+    multiple=True,
+    help="Override to sample, KEY=LOW:HIGH or KEY=log:LOW:HIGH",
+)
+@click.option("--samples", "-n", default=1, help="Random draws per grid point")
+@click.option("--seed", type=int, default=None)
+@click.option("--dry-run", is_flag=True, help="Only show the jobs")
+def sweep(base: str, grid, ranges, samples: int, seed: int | None, dry_run: bool):
+    """Submit a grid or random search over the overrides of the BASE job.
+
+    BASE is a JSON file of a job request, as submitted by `new`.
+
+    """
+    try:
+        job_list = expand_sweep(
+            JobRequest.parse_file(base),
+            parse_grid(grid),
+            parse_random(ranges),
+            samples=samples,
+            seed=seed,
+        )
+    except (ValueError, pydantic.ValidationError) as e:
+        logger.error(f"Invalid sweep: {e}")
+        return
+
+    table = Table(title=f"Sweep ({len(job_list)} jobs)")
+    table.add_column("Name", no_wrap=True)
+    table.add_column("Overrides")
+    for j in job_list:
+        overrides = " ".join(f"{k}={v}" for k, v in j.job.spec.overrides.items())
+        table.add_row(j.job.name, overrides)
+    console = Console()
+    console.print(table)
+    if dry_run:
+        return
+
+    result = fetch("enqueue_batch", payload=EnqueueBatchRequest(jobs=job_list))
     if result is None:
         return
-    worker_list = ListWorkersResponse.parse_obj(result)
+    logger.success(f"Successfully submitted {len(result['ids'])} jobs.")
 
-    blacklist = fetch("blacklist") or []
+
+@cli.command()
+def workers():
+    blacklist = fetch("blacklist")
+    if blacklist is None:
+        return
 
     table = Table(title="All Workers")
     table.add_column("Agent", justify="right", no_wrap=True)
@@ -91,38 +159,126 @@ def workers():
     table.add_column("GPU", justify="left", style="cornflower_blue", no_wrap=True)
     table.add_column("Status", justify="full", no_wrap=True)
 
-    for w in worker_list.workers:
-        status = "[red]Busy"
-        if w.available:
-            status = "[green]Free"
-        agent = f"[yellow]{w.host}"
-        if w.host in blacklist:
-            agent = f"{w.host} (disabled)"
-            status = "N/A"
-        table.add_row(agent, f"{w.id}", w.gpu_type, status)
-    console = Console()
-    console.print(table)
+    # Each agent's workers are shown as soon as central hears from it.
+    with request("GET", "workers/stream", stream=True) as response, Live(
+        table, console=Console()
+    ) as live:
+        for line in response.iter_lines():
+            if len(line) == 0:
+                continue
+            for w in ListWorkersResponse.parse_raw(line).workers:
+                status = "[red]Busy"
+                if w.available:
+                    status = "[green]Free"
+                if w.stale:
+                    status = f"{status} [dim](stale)"
+                agent = f"[yellow]{w.host}"
+                if w.host in blacklist:
+                    agent = f"{w.host} (disabled)"
+                    status = "N/A"
+                gpu = w.gpu_type
+                if w.gpu_memory is not None:
+                    gpu = f"{gpu} ({w.gpu_memory}G)"
+                table.add_row(agent, f"{w.id}", gpu, status)
+            live.refresh()
 
 
 @cli.command()
-def jobs():
-    result = fetch("jobs")
-    if result is None:
-        return
-    job_list = pydantic.parse_obj_as(List[JobRequest], result)
+@click.option("--project", "-p", default=None)
+@click.option("--group", "-g", default=None)
+@click.option(
+    "--state", "-s", type=click.Choice([s.value for s in CentralJobState]), default=None
+)
+@click.option("--agent", "-a", default=None)
+@click.option("--page-size", default=200, help="Number of jobs fetched per request")
+def jobs(project, group, state, agent, page_size: int):
+    params = {"project": project, "group": group, "state": state, "agent": agent}
+    params = {k: v for k, v in params.items() if v is not None}
 
     table = Table(title="All Jobs")
+    table.add_column("ID", no_wrap=True)
+    table.add_column("State", no_wrap=True)
+    table.add_column("Priority", justify="right", no_wrap=True)
     table.add_column("Project", no_wrap=True)
     table.add_column("Group", no_wrap=True)
     table.add_column("Name", no_wrap=True)
+    table.add_column("Agent", no_wrap=True)
+    table.add_column("Exit Code", justify="right", no_wrap=True)
     table.add_column("Agent Blacklist", no_wrap=True)
 
-    for j in job_list:
-        table.add_row(
-            j.job.project, j.job.group, j.job.name, ", ".join(j.agent_blacklist)
-        )
-    console = Console()
-    console.print(table)
+    # Pages are shown as they arrive.
+    cursor = None
+    with Live(table, console=Console()) as live:
+        while True:
+            query = {**params, "limit": page_size}
+            if cursor is not None:
+                query["cursor"] = cursor
+            result = fetch(f"jobs?{urlencode(query)}")
+            if result is None:
+                return
+            page = JobPage.parse_obj(result)
+            for q in page.jobs:
+                j = q.request
+                table.add_row(
+                    q.id,
+                    q.state.value,
+                    f"{j.priority}",
+                    j.job.project,
+                    j.job.group,
+                    j.job.name,
+                    q.agent or "",
+                    "" if q.exit_code is None else f"{q.exit_code}",
+                    ", ".join(j.agent_blacklist),
+                )
+            live.refresh()
+            cursor = page.next_cursor
+            if cursor is None:
+                break
+
+
+@cli.command()
+@click.argument("job_id")
+@click.option("--follow", "-f", is_flag=True, help="Keep printing until the job ends")
+@click.option(
+    "--tail", "-n", type=int, default=None, help="Start from the last N bytes"
+)
+@click.option(
+    "--agent", "-a", default=None, help="Agent of a job central no longer tracks"
+)
+def logs(job_id: str, follow: bool, tail: int | None, agent: str | None):
+    params = {"offset": 0 if tail is None else -tail, "follow": str(follow).lower()}
+    if agent is not None:
+        params["agent"] = agent
+    response = request("GET", f"jobs/{job_id}/log?{urlencode(params)}", stream=True)
+    if response.status_code != 200:
+        logger.error(f"Cannot read the log of job {job_id}: {response.text}")
+        return
+    out = sys.stdout.buffer
+    try:
+        for chunk in response.iter_content(chunk_size=None):
+            out.write(chunk)
+            out.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        response.close()
+
+
+@cli.command()
+@click.argument("job_id")
+def cancel(job_id: str):
+    result = fetch(f"cancel/{job_id}")
+    if result is not None and not result["success"]:
+        logger.error(f"Job {job_id} cannot be cancelled, it may have finished.")
+
+
+@cli.command()
+@click.argument("job_id")
+@click.argument("priority", type=int)
+def reprioritize(job_id: str, priority: int):
+    result = fetch(f"reprioritize/{job_id}/{priority}")
+    if result is not None and not result["success"]:
+        logger.error(f"Job {job_id} is not in the queue.")
 
 
 @cli.command()
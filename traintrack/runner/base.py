@@ -0,0 +1,485 @@
+import socket
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, List, Set, Tuple
+
+from loguru import logger
+
+from traintrack.runner.dev_env import DevEnvCache
+from traintrack.runner.git_cache import GitCache
+from traintrack.runner.job_log import JobLogs
+from traintrack.schema.agent_config import AgentConfig, RepoConfig
+from traintrack.schema.job import (
+    AgentJob,
+    JobDescription,
+    JobState,
+    PrepareHint,
+    ReserveResult,
+    RunJobResponse,
+)
+from traintrack.schema.status import AgentStatus, WorkerStatus
+
+
+# Finished jobs are kept around for queries until there are more than this.
+_MAX_FINISHED_JOBS = 1000
+# Job ids seen by the agent that are remembered to reject duplicates, which
+# outlives the finished jobs themselves
+_MAX_KNOWN_JOB_IDS = 100000
+
+# Seconds between two checks of the size of the logs of running jobs
+_LOG_ROTATE_INTERVAL = 10.0
+
+
+class _Cancelled(Exception):
+    pass
+
+
+class Runner(object):
+    """Bookkeeping shared by the runners.
+
+    ``run_job`` reserves the workers under a lock and returns right away. The
+    slow part (checking out the code, evaluating its environment, starting the
+    job) runs in a thread pool with one thread per worker, so several workers
+    can prepare at the same time while the agent keeps serving requests. A
+    worker stays reserved by its job until the job finishes, which is reported
+    by the subclass through ``_finish``.
+
+    Running jobs are also recorded under ``state_dir/running``. Jobs that
+    survive an agent restart are taken back from there by ``_restore``, with
+    their workers held, and are reported like any other job.
+
+    Subclasses implement ``_launch`` and ``_kill``, and may refine
+    ``_is_worker_free``. They call ``_restore`` at the end of their
+    ``__init__``, and finish the restored jobs from ``_poll``.
+
+    """
+
+    def __init__(self, agent_config: AgentConfig):
+        self._worker_config = agent_config.workers
+        self._state_dir = Path(agent_config.state_dir).expanduser()
+        self._state_dir.mkdir(parents=True, exist_ok=True)
+        self._dev_env = DevEnvCache(
+            self._state_dir / "env", max_entries=agent_config.max_cached_envs
+        )
+        self._git = GitCache(
+            self._state_dir / "git",
+            max_branches=agent_config.max_cached_branches,
+            on_fetch=self._dev_env.prewarm,
+        )
+        self._logs = JobLogs(
+            self._state_dir / "logs", max_bytes=agent_config.max_log_bytes
+        )
+        self._max_finished_log_bytes = agent_config.max_finished_log_bytes
+        # job id -> bytes of the log of a finished job, the oldest first
+        self._finished_logs: OrderedDict[str, int] = OrderedDict()
+        # The jobs that are running, one file each
+        self._running_dir = self._state_dir / "running"
+        self._running_dir.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        # worker id -> id of the job holding it
+        self._holders: Dict[int, str] = {}
+        self._jobs: Dict[str, AgentJob] = {}
+        self._finished: OrderedDict[str, None] = OrderedDict()
+        # job id -> the workers reserved for it, and when the reservation
+        # expires (monotonic) unless the job is run before
+        self._reservations: Dict[str, Tuple[List[int], float]] = {}
+        # job id -> idempotency key of the placement that created it
+        self._known_ids: OrderedDict[str, str | None] = OrderedDict()
+        # Jobs to stop, they are cancelled once they finish
+        self._cancelled: Set[str] = set()
+        self._listeners: List[Callable[[AgentJob], None]] = []
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, len(self._worker_config)),
+            thread_name_prefix="traintrack_launch",
+        )
+        # Prefetching runs on a single thread, so that speculative work never
+        # takes more than one fetch worth of bandwidth.
+        self._prefetch_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="traintrack_prefetch"
+        )
+        # (repo, branch) waiting to be prefetched
+        self._prefetching: Set[Tuple[str, str]] = set()
+        self._max_prefetching = agent_config.max_cached_branches
+        threading.Thread(
+            target=self._rotate_logs, name="traintrack_logs", daemon=True
+        ).start()
+
+    @property
+    def num_workers(self):
+        return len(self._worker_config)
+
+    @property
+    def logs(self) -> JobLogs:
+        return self._logs
+
+    def _rotate_logs(self):
+        while True:
+            time.sleep(_LOG_ROTATE_INTERVAL)
+            for job in self.list_jobs():
+                if job.finished_at is not None:
+                    continue
+                try:
+                    self._logs.rotate(job.id)
+                except OSError as e:
+                    logger.warning(f"Failed to rotate the log of job {job.id}: {e}")
+
+    def add_listener(self, listener: Callable[[AgentJob], None]):
+        """Call the listener (from any thread) whenever a job changes state."""
+        self._listeners.append(listener)
+
+    def _running_file(self, job_id: str) -> Path:
+        return self._running_dir / f"{job_id}.json"
+
+    def _restore(self) -> List[AgentJob]:
+        """Take back the jobs that were running when the agent last stopped,
+        and return them."""
+        restored = []
+        for path in self._running_dir.glob("*.json"):
+            try:
+                job = AgentJob.parse_file(path)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Dropping unreadable job record {path}: {e}")
+                path.unlink(missing_ok=True)
+                continue
+            logger.info(f"Job {job.id} is still running on workers {job.worker_ids}.")
+            with self._lock:
+                self._jobs[job.id] = job
+                for i in job.worker_ids:
+                    self._holders[i] = job.id
+                self._known_ids[job.id] = None
+            restored.append(job)
+        # Logs left over by the jobs that finished before the restart
+        with self._lock:
+            for job_id in self._logs.job_ids():
+                if job_id not in self._jobs:
+                    self._keep_log(job_id)
+        return restored
+
+    def _keep_log(self, job_id: str):
+        """Count the log of a finished job against the budget, and remove the
+        oldest ones over it. Called with the lock held."""
+        self._finished_logs[job_id] = self._logs.size(job_id)
+        total = sum(self._finished_logs.values())
+        while total > self._max_finished_log_bytes:
+            old, size = self._finished_logs.popitem(last=False)
+            self._logs.remove(old)
+            total -= size
+
+    def _is_worker_free(self, worker_id: int) -> bool:
+        """Whether a worker that is not held by any job can be used.
+
+        Called with the lock held.
+
+        """
+        return True
+
+    def _launch(self, job: AgentJob):
+        """Prepare and start the job. Runs in the launch thread pool.
+
+        Raise to fail the job. Call ``_started`` once the job is running and
+        ``_finish`` once it has exited.
+
+        """
+        raise NotImplementedError()
+
+    def _kill(self, job: AgentJob):
+        """Stop the running job, which then finishes as usual. Called without
+        the lock."""
+        raise NotImplementedError()
+
+    def _poll(self):
+        """Catch up with jobs that finished on their own. Called without the
+        lock before the workers are inspected."""
+        pass
+
+    def _free_workers(self, job_id: str | None = None) -> List[int]:
+        """Workers that are neither held by a job nor reserved, except for the
+        job with the given id. Called with the lock held."""
+        now = time.monotonic()
+        reserved = set()
+        for other, (worker_ids, expires_at) in list(self._reservations.items()):
+            if expires_at <= now:
+                logger.info(f"Reservation of workers {worker_ids} for {other} expired.")
+                del self._reservations[other]
+            elif other != job_id:
+                reserved.update(worker_ids)
+        return [
+            i
+            for i in range(self.num_workers)
+            if i not in self._holders and i not in reserved and self._is_worker_free(i)
+        ]
+
+    def reserve(self, job_id: str, worker_ids: List[int], ttl: float) -> ReserveResult:
+        """Hold the workers for the job for ``ttl`` seconds, until it is run.
+
+        Reserving the same workers for the same job again only extends the
+        reservation, so retries are safe. A job has at most one reservation,
+        and reserving other workers for it replaces it.
+
+        """
+        self._poll()
+        with self._lock:
+            if job_id in self._known_ids:
+                return ReserveResult(accepted=False, reason=f"Job {job_id} has run.")
+            free = self._free_workers(job_id)
+            for i in worker_ids:
+                if i < 0 or i >= self.num_workers:
+                    return ReserveResult(accepted=False, reason=f"Invalid worker {i}.")
+                if i not in free:
+                    return ReserveResult(accepted=False, reason=f"Worker {i} is busy.")
+            self._reservations[job_id] = (list(worker_ids), time.monotonic() + ttl)
+        return ReserveResult(accepted=True)
+
+    def release(self, job_id: str):
+        """Drop the reservation of the job, if any."""
+        with self._lock:
+            self._reservations.pop(job_id, None)
+
+    def run_job(
+        self,
+        job: JobDescription,
+        worker_ids: List[int] | None = None,
+        job_id: str | None = None,
+        idempotency_key: str | None = None,
+    ) -> RunJobResponse:
+        """Start preparing the job on the workers.
+
+        A job id is only ever run once. A placement sent again with the same
+        idempotency key gets the same answer, any other one with the id of a
+        known job is refused. The workers reserved for the job, if any, are
+        used when none are given, and released otherwise.
+
+        """
+        if job.repo != "Hobot":
+            logger.error(f"Invalid job repo '{job.repo}'")
+            return RunJobResponse(
+                accepted=False, reason=f"Invalid job repo '{job.repo}'"
+            )
+
+        self._poll()
+        with self._lock:
+            if job_id is not None and job_id in self._known_ids:
+                if (
+                    idempotency_key is not None
+                    and self._known_ids[job_id] == idempotency_key
+                ):
+                    return RunJobResponse(accepted=True, job_id=job_id)
+                logger.warning(f"Refusing duplicate job {job_id}.")
+                return RunJobResponse(
+                    accepted=False, reason=f"Duplicate job id {job_id}."
+                )
+            free = self._free_workers(job_id)
+            reservation = self._reservations.pop(job_id, None)
+            if reservation is not None and not worker_ids:
+                worker_ids = reservation[0]
+            # Select the workers, unless central has already chosen them
+            if worker_ids is None or len(worker_ids) == 0:
+                if len(free) == 0:
+                    logger.info("No available worker.")
+                    return RunJobResponse(accepted=False, reason="No available worker.")
+                worker_ids = free[:1]
+            else:
+                for i in worker_ids:
+                    if i < 0 or i >= self.num_workers:
+                        return RunJobResponse(
+                            accepted=False, reason=f"Invalid worker {i}."
+                        )
+                    if i not in free:
+                        logger.info(f"Requested worker {i} is busy.")
+                        return RunJobResponse(
+                            accepted=False, reason=f"Worker {i} is busy."
+                        )
+
+            agent_job = AgentJob(
+                id=job_id or uuid.uuid4().hex[:12],
+                job=job,
+                worker_ids=worker_ids,
+                state=JobState.PREPARING,
+                created_at=datetime.now(),
+            )
+            for i in worker_ids:
+                self._holders[i] = agent_job.id
+            self._jobs[agent_job.id] = agent_job
+            self._known_ids[agent_job.id] = idempotency_key
+            if len(self._known_ids) > _MAX_KNOWN_JOB_IDS:
+                self._known_ids.popitem(last=False)
+
+        logger.info(f"Preparing job {agent_job.id} on workers {worker_ids}")
+        self._executor.submit(self._run_launch, agent_job)
+        self._notify(agent_job)
+        return RunJobResponse(accepted=True, job_id=agent_job.id)
+
+    def _run_launch(self, job: AgentJob):
+        try:
+            self._launch(job)
+        except _Cancelled:
+            self._finish(job.id, exit_code=None)
+        except Exception as e:
+            logger.error(f"Failed to launch job {job.id}: {e}")
+            self._finish(job.id, exit_code=None, message=f"Launch failed: {e}")
+
+    def _update(self, job_id: str, **changes) -> AgentJob | None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job = job.copy(update=changes)
+            self._jobs[job_id] = job
+        self._notify(job)
+        return job
+
+    def _prepare(self, job: AgentJob, output: BinaryIO) -> Tuple[Path, Path | None]:
+        """Check out the code of the job in its own worktree and get its dev
+        environment. Returns the worktree and the script that sets up the
+        environment, if the repo has one."""
+        repo_config = self._worker_config[job.worker_ids[0]].repos[job.job.repo]
+        checkout = self._git.checkout(repo_config, job.job.spec.branch, job.id, output)
+        logger.info(f"Job {job.id} runs commit {checkout.commit}")
+        self._update(job.id, commit=checkout.commit)
+        env_file = self._dev_env.get(checkout.mirror, checkout.commit, output)
+        with self._lock:
+            if job.id in self._cancelled:
+                raise _Cancelled()
+        return checkout.worktree, env_file
+
+    def prepare(self, hints: List[PrepareHint]) -> int:
+        """Fetch the code of jobs that are likely to run here soon and warm
+        their environment in the background. Returns the number of hints
+        that are taken."""
+        taken = 0
+        for hint in hints:
+            repo_config = self._worker_config[0].repos.get(hint.repo)
+            if repo_config is None:
+                continue
+            key = (hint.repo, hint.branch)
+            with self._lock:
+                if key in self._prefetching:
+                    continue
+                if len(self._prefetching) >= self._max_prefetching:
+                    break
+                self._prefetching.add(key)
+            self._prefetch_executor.submit(self._prefetch, repo_config, key)
+            taken += 1
+        return taken
+
+    def _prefetch(self, repo_config: RepoConfig, key: Tuple[str, str]):
+        try:
+            mirror, commit = self._git.fetch(repo_config, key[1])
+            self._dev_env.get(mirror, commit)
+        except Exception as e:
+            logger.warning(f"Failed to prefetch branch '{key[1]}' of {key[0]}: {e}")
+        finally:
+            with self._lock:
+                self._prefetching.discard(key)
+
+    def _started(self, job_id: str):
+        job = self._update(job_id, state=JobState.RUNNING, started_at=datetime.now())
+        if job is not None:
+            self._running_file(job_id).write_text(job.json())
+        with self._lock:
+            cancelled = job_id in self._cancelled
+        # Cancelled while it was being launched
+        if job is not None and cancelled:
+            self._kill(job)
+
+    def cancel_job(self, job_id: str) -> bool:
+        """Stop the job if it has not finished yet.
+
+        A job that is still preparing is stopped before it starts. Returns
+        False if there is no such job or it has already finished.
+
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.state.finished:
+                return False
+            self._cancelled.add(job_id)
+        logger.info(f"Cancelling job {job_id}")
+        if job.state == JobState.RUNNING:
+            self._kill(job)
+        return True
+
+    def _finish(self, job_id: str, exit_code: int | None, message: str | None = None):
+        """Mark the job as finished, free its workers and its checkout."""
+        state = JobState.SUCCEEDED if exit_code == 0 else JobState.FAILED
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.state.finished:
+                return
+            if job_id in self._cancelled:
+                self._cancelled.discard(job_id)
+                state = JobState.CANCELLED
+            job = job.copy(
+                update={
+                    "state": state,
+                    "exit_code": exit_code,
+                    "message": message,
+                    "finished_at": datetime.now(),
+                }
+            )
+            self._jobs[job_id] = job
+            for i in job.worker_ids:
+                if self._holders.get(i) == job_id:
+                    del self._holders[i]
+            self._running_file(job_id).unlink(missing_ok=True)
+            self._finished[job_id] = None
+            while len(self._finished) > _MAX_FINISHED_JOBS:
+                old, _ = self._finished.popitem(last=False)
+                del self._jobs[old]
+                self._finished_logs.pop(old, None)
+                self._logs.remove(old)
+            self._keep_log(job_id)
+        try:
+            self._git.remove(job_id)
+        except Exception as e:
+            logger.warning(f"Failed to remove the checkout of job {job_id}: {e}")
+        if state == JobState.SUCCEEDED:
+            logger.success(f"Job {job_id} finished.")
+        elif state == JobState.CANCELLED:
+            logger.info(f"Job {job_id} cancelled.")
+        else:
+            logger.warning(f"Job {job_id} failed (exit code {exit_code}).")
+        self._notify(job)
+
+    def _notify(self, job: AgentJob):
+        for listener in self._listeners:
+            try:
+                listener(job)
+            except Exception as e:
+                logger.warning(f"Job listener failed: {e}")
+
+    def get_job(self, job_id: str) -> AgentJob | None:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def running_jobs(self) -> List[AgentJob]:
+        with self._lock:
+            return [j for j in self._jobs.values() if j.state == JobState.RUNNING]
+
+    def list_jobs(self) -> List[AgentJob]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def status(self) -> AgentStatus:
+        host = socket.gethostname()
+        self._poll()
+        with self._lock:
+            free = set(self._free_workers())
+            return AgentStatus(
+                workers=[
+                    WorkerStatus(
+                        host=host,
+                        id=i,
+                        gpu_type=self._worker_config[i].gpu_type,
+                        gpu_memory=self._worker_config[i].gpu_memory,
+                        available=i in free,
+                    )
+                    for i in range(self.num_workers)
+                ]
+            )
@@ -0,0 +1,125 @@
+import hashlib
+import os
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import BinaryIO, Dict
+
+from loguru import logger
+
+
+class DevEnvCache(object):
+    """Evaluated ``nix develop`` environments, stored on disk.
+
+    The environment of a commit only depends on its ``flake.nix`` and
+    ``flake.lock``, so it is evaluated once per distinct pair with ``nix
+    print-dev-env`` and the resulting script is sourced by every job that
+    shares it. Evaluating the same environment concurrently is deduplicated,
+    and a profile is kept next to each script so that the store paths it
+    refers to survive garbage collection. At most ``max_entries`` environments
+    are kept, the least recently used ones are evicted first.
+
+    """
+
+    def __init__(self, root: Path, max_entries: int = 16):
+        self._root = root
+        self._max_entries = max_entries
+        self._root.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # Held while the environment with this key is evaluated
+        self._key_locks: Dict[str, threading.Lock] = {}
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="traintrack_prewarm"
+        )
+
+    @staticmethod
+    def _key(mirror: Path, commit: str) -> str | None:
+        """Hash of the flake files of the commit, None if it has no flake."""
+        h = hashlib.sha256()
+        for name in ["flake.nix", "flake.lock"]:
+            result = subprocess.run(
+                ["git", "show", f"{commit}:{name}"],
+                cwd=mirror,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+            )
+            if result.returncode != 0:
+                if name == "flake.nix":
+                    return None
+                continue
+            h.update(name.encode())
+            h.update(result.stdout)
+        return h.hexdigest()[:32]
+
+    def get(
+        self, mirror: Path, commit: str, output: BinaryIO | None = None
+    ) -> Path | None:
+        """The script that sets up the environment of the commit.
+
+        Evaluates the environment if it is not cached yet. Returns None if the
+        commit does not have a flake.
+
+        """
+        key = self._key(mirror, commit)
+        if key is None:
+            return None
+        env_file = self._root / f"{key}.sh"
+        if self._hit(env_file):
+            return env_file
+
+        with self._lock:
+            lock = self._key_locks.setdefault(key, threading.Lock())
+        with lock:
+            # Another job may have evaluated it while we were waiting.
+            if self._hit(env_file):
+                return env_file
+            logger.info(f"Evaluating the dev environment of {commit}")
+            partial = self._root / f"{key}.sh.partial"
+            with open(partial, "wb") as f:
+                subprocess.run(
+                    [
+                        "nix",
+                        "print-dev-env",
+                        "--profile",
+                        str(self._root / f"{key}.profile"),
+                        f"git+file://{mirror}?rev={commit}&allRefs=1",
+                    ],
+                    stdin=subprocess.DEVNULL,
+                    stdout=f,
+                    stderr=subprocess.DEVNULL if output is None else output,
+                    check=True,
+                )
+            os.replace(partial, env_file)
+        with self._lock:
+            self._evict()
+        return env_file
+
+    @staticmethod
+    def _hit(env_file: Path) -> bool:
+        try:
+            # The modification time tracks when the environment was last used.
+            os.utime(env_file)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _evict(self):
+        entries = sorted(self._root.glob("*.sh"), key=lambda p: p.stat().st_mtime)
+        for env_file in entries[: max(0, len(entries) - self._max_entries)]:
+            logger.info(f"Evicting the dev environment {env_file.stem}")
+            env_file.unlink(missing_ok=True)
+            # The profile and its generations, which release the store paths
+            for profile in self._root.glob(f"{env_file.stem}.profile*"):
+                profile.unlink(missing_ok=True)
+
+    def prewarm(self, mirror: Path, commit: str):
+        """Evaluate the environment of the commit in the background."""
+
+        def _run():
+            try:
+                self.get(mirror, commit)
+            except Exception as e:
+                logger.warning(f"Failed to prewarm the environment of {commit}: {e}")
+
+        self._executor.submit(_run)
@@ -0,0 +1,190 @@
+import hashlib
+import shutil
+import subprocess
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, Tuple
+
+from loguru import logger
+
+from traintrack.schema.agent_config import RepoConfig
+
+
+def _git(*args: str, cwd: Path | str | None = None, output: BinaryIO | None = None):
+    """Run git and return its stdout. The stderr goes to ``output`` if set."""
+    result = subprocess.run(
+        ["git", *args],
+        cwd=cwd,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE if output is None else output,
+        check=True,
+    )
+    return result.stdout.decode().strip()
+
+
+class Checkout(object):
+    def __init__(self, worktree: Path, mirror: Path, commit: str):
+        self.worktree = worktree
+        self.mirror = mirror
+        self.commit = commit
+
+
+class GitCache(object):
+    """One bare mirror per repository, shared by all the jobs of the agent.
+
+    Every job gets its own worktree of the mirror, checked out at the exact
+    commit its branch pointed to at launch, so jobs never touch each other's
+    files and can be reproduced from the commit alone. Objects are fetched
+    into the mirror at most once per branch update: the fetch is skipped when
+    the commit is already there, and concurrent launches of the same
+    repository wait for a single fetch instead of running their own. At
+    most ``max_branches`` branches are kept, the least recently used ones are
+    dropped from the mirrors first.
+
+    ``on_fetch`` is called with the mirror and the commit after every fetch,
+    e.g. to prepare what the new commit needs before any job asks for it.
+
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        max_branches: int = 16,
+        on_fetch: Callable[[Path, str], None] | None = None,
+    ):
+        self._mirror_dir = root / "mirrors"
+        self._worktree_dir = root / "worktrees"
+        self._mirror_dir.mkdir(parents=True, exist_ok=True)
+        self._worktree_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # Held while a mirror is created or fetched into
+        self._mirror_locks: Dict[Path, threading.Lock] = {}
+        # repo path -> url of its origin
+        self._urls: Dict[str, str] = {}
+        self._on_fetch = on_fetch
+        # (mirror, branch) of the fetched branches, least recently used first
+        self._branches: OrderedDict[Tuple[Path, str], None] = OrderedDict()
+        self._max_branches = max_branches
+
+    def _url(self, repo: RepoConfig) -> str:
+        if repo.url is not None:
+            return repo.url
+        with self._lock:
+            url = self._urls.get(repo.path)
+        if url is None:
+            url = _git("remote", "get-url", "origin", cwd=repo.path)
+            with self._lock:
+                self._urls[repo.path] = url
+        return url
+
+    def _mirror(self, url: str) -> Tuple[Path, threading.Lock]:
+        name = hashlib.sha1(url.encode()).hexdigest()[:16]
+        return self._mirror_lock(self._mirror_dir / f"{name}.git")
+
+    def _mirror_lock(self, mirror: Path) -> Tuple[Path, threading.Lock]:
+        with self._lock:
+            lock = self._mirror_locks.setdefault(mirror, threading.Lock())
+        return mirror, lock
+
+    @staticmethod
+    def _has_commit(mirror: Path, commit: str) -> bool:
+        result = subprocess.run(
+            ["git", "cat-file", "-e", f"{commit}^{{commit}}"],
+            cwd=mirror,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        return result.returncode == 0
+
+    def worktree(self, job_id: str) -> Path:
+        return self._worktree_dir / job_id
+
+    def fetch(
+        self, repo: RepoConfig, branch: str, output: BinaryIO | None = None
+    ) -> Tuple[Path, str]:
+        """Make sure the mirror has the head of the branch.
+
+        Returns the mirror and the commit the branch points to.
+
+        """
+        url = self._url(repo)
+        refs = _git("ls-remote", url, f"refs/heads/{branch}", output=output)
+        if len(refs) == 0:
+            raise ValueError(f"Branch '{branch}' does not exist in {url}")
+        commit = refs.split()[0]
+
+        mirror, lock = self._mirror(url)
+        with lock:
+            if not mirror.exists():
+                logger.info(f"Creating a mirror of {url} in {mirror}")
+                _git("init", "--bare", "--quiet", str(mirror), output=output)
+            # Another job may have fetched the commit while we were waiting.
+            if not self._has_commit(mirror, commit):
+                logger.info(f"Fetching branch '{branch}' of {url}")
+                _git(
+                    "fetch",
+                    "--no-tags",
+                    url,
+                    f"+refs/heads/{branch}:refs/heads/{branch}",
+                    cwd=mirror,
+                    output=output,
+                )
+                if self._on_fetch is not None:
+                    self._on_fetch(mirror, commit)
+            else:
+                # The objects are already there, e.g. from another branch.
+                # The ref keeps them from being pruned until it is evicted.
+                _git("update-ref", f"refs/heads/{branch}", commit, cwd=mirror)
+        self._touch(mirror, branch)
+        return mirror, commit
+
+    def _touch(self, mirror: Path, branch: str):
+        """Mark the branch as recently used and evict the least recently used
+        branches beyond the budget."""
+        with self._lock:
+            self._branches[(mirror, branch)] = None
+            self._branches.move_to_end((mirror, branch))
+            evicted = []
+            while len(self._branches) > self._max_branches:
+                key, _ = self._branches.popitem(last=False)
+                evicted.append(key)
+        for mirror, branch in evicted:
+            logger.info(f"Evicting branch '{branch}' from {mirror}")
+            _, lock = self._mirror_lock(mirror)
+            with lock:
+                # Unreferenced objects are then pruned by git gc, except the
+                # ones still checked out by a worktree.
+                _git("update-ref", "-d", f"refs/heads/{branch}", cwd=mirror)
+                _git("gc", "--auto", "--quiet", cwd=mirror)
+
+    def checkout(
+        self, repo: RepoConfig, branch: str, job_id: str, output: BinaryIO
+    ) -> Checkout:
+        """Create the worktree of the job at the head of the branch."""
+        mirror, commit = self.fetch(repo, branch, output)
+        worktree = self.worktree(job_id)
+        _git(
+            "worktree",
+            "add",
+            "--detach",
+            str(worktree),
+            commit,
+            cwd=mirror,
+            output=output,
+        )
+        return Checkout(worktree, mirror, commit)
+
+    def remove(self, job_id: str):
+        """Delete the worktree of the job, if any."""
+        worktree = self.worktree(job_id)
+        if not worktree.exists():
+            return
+        try:
+            mirror = _git("rev-parse", "--git-common-dir", cwd=worktree)
+        except subprocess.CalledProcessError:
+            mirror = None
+        shutil.rmtree(worktree, ignore_errors=True)
+        if mirror is not None:
+            _git("worktree", "prune", cwd=Path(worktree, mirror).resolve())
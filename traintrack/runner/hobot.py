@@ -1,4 +1,6 @@
-import time
+import shlex
+from pathlib import Path
+from typing import List
 
 import libtmux
 from jinja2 import Environment
@@ -8,20 +10,10 @@ from traintrack.schema.job import HobotSpec, JobDescription
 
 
 _RUN_COMMAND="""
-ALF_USE_GIN=0 python -m alf.bin.train --store_snapshot=false --conf {{config}} --root_dir {{root_dir}} --notes "{{notes}}" {{extra}}
+CUDA_VISIBLE_DEVICES={{gpu_ids}} ALF_USE_GIN=0 python -m alf.bin.train --store_snapshot=false --conf {{config}} --root_dir {{root_dir}} --notes "{{notes}}" {{extra}}
 """
 
-def run_hobot_job(pane: libtmux.Pane, repo: RepoConfig, job: JobDescription):
-    pane.send_keys(f"cd {repo.path}", enter=True)
-    # Wait for nix develop to finish
-    while pane.pane_current_command != "zsh":
-        time.sleep(1)
-    pane.send_keys(f"git reset --hard HEAD", enter=True)
-    pane.send_keys(f"git fetch --all", enter=True)
-    pane.send_keys(f"git switch {job.spec.branch}", enter=True)
-    pane.send_keys(f"git pull", enter=True)
-    while pane.pane_current_command != "zsh":
-        time.sleep(1)
+def hobot_command(repo: RepoConfig, job: JobDescription, gpu_ids: List[int]) -> str:
     env = Environment()
     template = env.from_string(_RUN_COMMAND)
 
@@ -34,11 +26,41 @@ def run_hobot_job(pane: libtmux.Pane, repo: RepoConfig, job: JobDescription):
     for key, value in job.spec.overrides.items():
         extra.append("--conf_param")
         extra.append(f'"_CONFIG._USER.{key}={value}"')
-        
-    command = template.render(
+
+    return template.render(
+        gpu_ids=",".join(str(i) for i in gpu_ids),
         config=job.spec.config,
         root_dir=root_dir,
         notes=job.notes,
-        extra=" ".join(extra))
+        extra=" ".join(extra)).strip()
+
+
+def hobot_script(
+    repo: RepoConfig, job: JobDescription, gpu_ids: List[int], env_file: Path | None
+) -> str:
+    """Bash script that runs the job in its (cached) dev environment."""
+    command = hobot_command(repo, job, gpu_ids)
+    if env_file is None:
+        return command
+    return f"source {shlex.quote(str(env_file))} && {command}"
+
 
-    pane.send_keys(command, enter=True)
+def run_hobot_job(
+    pane: libtmux.Pane,
+    checkout: Path,
+    env_file: Path | None,
+    repo: RepoConfig,
+    job: JobDescription,
+    gpu_ids: List[int],
+    log_file: Path,
+    exit_file: Path,
+):
+    pane.send_keys(f"cd {checkout}", enter=True)
+    # The environment is sourced from the cache instead of waiting for nix
+    # develop. The output is also appended to the job's log so that it can be
+    # read without the pane. The exit code is written to a file so that the
+    # agent knows when the job has finished, without relying on what the pane
+    # is running.
+    script = hobot_script(repo, job, gpu_ids, env_file)
+    script = f"set -o pipefail; ({script}) 2>&1 | tee -a {shlex.quote(str(log_file))}"
+    pane.send_keys(f"bash -c {shlex.quote(script)}; echo $? > {exit_file}", enter=True)
@@ -0,0 +1,160 @@
+import os
+import shutil
+import threading
+from pathlib import Path
+from typing import List, Tuple
+
+
+class JobLogs(object):
+    """The output of the jobs, kept on disk with a bounded size per job.
+
+    Output goes to ``<job id>.log``, either through ``append`` or straight
+    from another process (opened with O_APPEND, e.g. by ``tee``). Once it
+    grows over ``max_bytes`` it is copied to ``<job id>.log.1`` and truncated
+    in place, so that a writer never has to reopen it. Offsets are logical:
+    they count every byte the job has written, including the ones rotated
+    out, and are only valid within the window that is still on disk (the two
+    files).
+
+    Rotation loses nothing written through ``append``. Another process may
+    still append between the last copy and the truncation, so it is only
+    used where the agent cannot own the output.
+
+    """
+
+    def __init__(self, log_dir: Path, max_bytes: int):
+        self._log_dir = log_dir
+        self._log_dir.mkdir(parents=True, exist_ok=True)
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def path(self, job_id: str) -> Path:
+        return self._log_dir / f"{job_id}.log"
+
+    def _rotated(self, job_id: str) -> Path:
+        return self._log_dir / f"{job_id}.log.1"
+
+    def _base_file(self, job_id: str) -> Path:
+        return self._log_dir / f"{job_id}.log.base"
+
+    def _base(self, job_id: str) -> int:
+        """Logical offset of the first byte of the current log file."""
+        try:
+            return int(self._base_file(job_id).read_text())
+        except (OSError, ValueError):
+            return 0
+
+    def append(self, job_id: str, data: bytes):
+        """Add output of the job, rotating its log if needed."""
+        with self._lock:
+            with open(self.path(job_id), "ab") as f:
+                f.write(data)
+            self._rotate(job_id)
+
+    def rotate(self, job_id: str):
+        """Rotate the log of the job if it has grown too large."""
+        with self._lock:
+            self._rotate(job_id)
+
+    def _rotate(self, job_id: str):
+        path = self.path(job_id)
+        try:
+            if path.stat().st_size <= self._max_bytes:
+                return
+        except FileNotFoundError:
+            return
+        rotated = self._rotated(job_id)
+        partial = rotated.with_suffix(".partial")
+        copied = 0
+        with open(path, "rb") as src, open(partial, "wb") as dst:
+            # Another process may still be appending. Copy until the size
+            # stops changing and truncate right after, which leaves it the
+            # shortest time to write what would be lost.
+            while True:
+                size = os.fstat(src.fileno()).st_size
+                if size == copied:
+                    break
+                shutil.copyfileobj(_Limited(src, size - copied), dst)
+                copied = size
+            os.truncate(path, 0)
+        os.replace(partial, rotated)
+        base = self._base(job_id) + copied
+        self._base_file(job_id).write_text(f"{base}")
+
+    def size(self, job_id: str) -> int:
+        """Bytes the log of the job takes on disk."""
+        with self._lock:
+            start, end = self._window(job_id)
+            return end - start
+
+    def job_ids(self) -> List[str]:
+        """The jobs that have a log, the least recently written first."""
+        with self._lock:
+            paths = sorted(self._log_dir.glob("*.log"), key=lambda p: p.stat().st_mtime)
+        return [p.stem for p in paths]
+
+    def remove(self, job_id: str):
+        with self._lock:
+            for path in [
+                self.path(job_id),
+                self._rotated(job_id),
+                self._base_file(job_id),
+            ]:
+                path.unlink(missing_ok=True)
+
+    def window(self, job_id: str) -> Tuple[int, int]:
+        """The range of logical offsets [start, end) that can be read."""
+        with self._lock:
+            return self._window(job_id)
+
+    def _window(self, job_id: str) -> Tuple[int, int]:
+        base = self._base(job_id)
+        try:
+            size = self.path(job_id).stat().st_size
+        except FileNotFoundError:
+            size = 0
+        try:
+            rotated = self._rotated(job_id).stat().st_size
+        except FileNotFoundError:
+            rotated = 0
+        return base - rotated, base + size
+
+    def read(self, job_id: str, offset: int, length: int) -> Tuple[int, bytes]:
+        """Read up to ``length`` bytes from the logical offset.
+
+        Offsets that were rotated out are moved forward to the oldest byte
+        still on disk. Returns the offset of the returned bytes.
+
+        """
+        with self._lock:
+            start, end = self._window(job_id)
+            offset = max(offset, start)
+            length = min(length, end - offset)
+            if length <= 0:
+                return offset, b""
+            base = self._base(job_id)
+            if offset < base:
+                path, position = self._rotated(job_id), offset - start
+                length = min(length, base - offset)
+            else:
+                path, position = self.path(job_id), offset - base
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                # Positioned read of just the requested chunk, the file is
+                # never loaded as a whole.
+                return offset, os.pread(fd, length, position)
+            finally:
+                os.close(fd)
+
+
+class _Limited(object):
+    def __init__(self, f, limit: int):
+        self._f = f
+        self._left = limit
+
+    def read(self, n: int = -1) -> bytes:
+        if n < 0 or n > self._left:
+            n = self._left
+        data = self._f.read(n)
+        self._left -= len(data)
+        return data
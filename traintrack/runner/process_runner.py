@@ -0,0 +1,219 @@
+import os
+import select
+import signal
+import subprocess
+import threading
+from pathlib import Path
+from typing import Dict
+
+from loguru import logger
+
+from traintrack.runner.base import Runner
+from traintrack.runner.hobot import hobot_script
+from traintrack.schema.agent_config import AgentConfig
+from traintrack.schema.job import AgentJob
+
+
+# Seconds to wait for the rest of the output once a job has exited, in case
+# processes it left behind keep its pipe open.
+_DRAIN_TIMEOUT = 10.0
+# Seconds between checks that the job of an idle pipe is still running
+_PUMP_POLL_INTERVAL = 1.0
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class ProcessRunner(Runner):
+    """Runs each job as a child process of the agent.
+
+    Worker state lives in memory and is only changed under a lock, so reading
+    the status costs no external call and a worker cannot be handed out
+    twice. Once started, each child is waited for by a daemon thread of its
+    own (the same approach as asyncio's threaded child watcher), which frees
+    the workers as soon as it exits. The launch thread pool is only busy while
+    the jobs prepare, and the agent can exit while jobs are still running.
+
+    The output of each job goes through a named pipe under ``state_dir/pipes``
+    and is appended to its log (see ``JobLogs``) by the agent, so rotating the
+    log loses nothing. The job holds the pipe open for reading too: while the
+    agent restarts, its output waits in the pipe instead of killing it with
+    SIGPIPE, and the job blocks once the pipe is full. The pid of each running
+    job is also written under ``state_dir/workers``, and its exit code under
+    ``state_dir/exit``, so that the jobs which survive an agent restart are
+    followed until they exit.
+
+    """
+
+    def __init__(self, agent_config: AgentConfig):
+        super().__init__(agent_config)
+        self._pid_dir = self._state_dir / "workers"
+        self._pid_dir.mkdir(parents=True, exist_ok=True)
+        self._exit_dir = self._state_dir / "exit"
+        self._exit_dir.mkdir(parents=True, exist_ok=True)
+        self._pipe_dir = self._state_dir / "pipes"
+        self._pipe_dir.mkdir(parents=True, exist_ok=True)
+        # job id -> pid of a job left over by a previous agent process, which
+        # cannot be reaped and is checked by pid instead.
+        self._adopted: Dict[str, int] = {}
+        for job in self._restore():
+            try:
+                self._adopted[job.id] = int(
+                    self._pid_file(job.worker_ids[0]).read_text()
+                )
+            except (OSError, ValueError):
+                # Started right before the agent stopped, or already gone
+                self._adopted[job.id] = -1
+            try:
+                reader = os.open(self._pipe_file(job.id), os.O_RDONLY | os.O_NONBLOCK)
+            except OSError:
+                continue
+            self._start_pump(job.id, reader)
+
+    def _pid_file(self, worker_id: int) -> Path:
+        return self._pid_dir / f"worker{worker_id}.pid"
+
+    def _exit_file(self, job_id: str) -> Path:
+        return self._exit_dir / f"{job_id}.exit"
+
+    def _pipe_file(self, job_id: str) -> Path:
+        return self._pipe_dir / f"{job_id}.pipe"
+
+    def _start_pump(self, job_id: str, reader: int) -> threading.Thread:
+        pump = threading.Thread(
+            target=self._pump,
+            args=(job_id, reader),
+            name=f"traintrack_pump_{job_id}",
+            daemon=True,
+        )
+        pump.start()
+        return pump
+
+    def _pump(self, job_id: str, reader: int):
+        """Copy the output of the job from its pipe to its log, until all the
+        processes of the job have closed the pipe."""
+        try:
+            while True:
+                ready, _, _ = select.select([reader], [], [], _PUMP_POLL_INTERVAL)
+                if len(ready) == 0:
+                    # A pipe that had no writer since it was opened does not
+                    # report the end, e.g. the job exited while the agent was
+                    # down.
+                    job = self.get_job(job_id)
+                    if job is None or job.state.finished:
+                        break
+                    continue
+                try:
+                    data = os.read(reader, 64 * 1024)
+                except BlockingIOError:
+                    continue
+                if len(data) == 0:
+                    break
+                self._logs.append(job_id, data)
+        except OSError as e:
+            logger.warning(f"Failed to copy the output of job {job_id}: {e}")
+        finally:
+            os.close(reader)
+
+    def _poll(self):
+        for job_id, pid in list(self._adopted.items()):
+            if pid > 0 and _is_alive(pid):
+                continue
+            # _poll may run in several threads at once
+            if self._adopted.pop(job_id, None) is None:
+                continue
+            job = self.get_job(job_id)
+            if job is None:
+                continue
+            for i in job.worker_ids:
+                self._pid_file(i).unlink(missing_ok=True)
+            self._pipe_file(job_id).unlink(missing_ok=True)
+            exit_file = self._exit_file(job_id)
+            try:
+                exit_code = int(exit_file.read_text())
+            except (OSError, ValueError):
+                self._finish(job_id, None, message="Exited while the agent was down")
+                continue
+            exit_file.unlink(missing_ok=True)
+            self._finish(job_id, exit_code)
+
+    def _launch(self, job: AgentJob):
+        desc = job.job
+        repo_config = self._worker_config[job.worker_ids[0]].repos[desc.repo]
+        gpu_ids = [self._worker_config[i].gpu_id for i in job.worker_ids]
+        exit_file = self._exit_file(job.id)
+        exit_file.unlink(missing_ok=True)
+        with open(self._logs.path(job.id), "ab") as log_file:
+            worktree, env_file = self._prepare(job, log_file)
+        # The exit code is also written to a file, for when the agent has
+        # restarted and the job is no longer its child.
+        script = hobot_script(repo_config, desc, gpu_ids, env_file)
+        script = f"{script}\ncode=$?; echo $code > {exit_file}; exit $code"
+        pipe = self._pipe_file(job.id)
+        pipe.unlink(missing_ok=True)
+        os.mkfifo(pipe)
+        # Opened for reading first, so that opening it for writing does not
+        # block.
+        reader = os.open(pipe, os.O_RDONLY | os.O_NONBLOCK)
+        writer = os.open(pipe, os.O_RDWR)
+        try:
+            proc = subprocess.Popen(
+                ["bash", "-c", script],
+                cwd=worktree,
+                stdin=subprocess.DEVNULL,
+                stdout=writer,
+                stderr=subprocess.STDOUT,
+                # Keep the job alive if the agent restarts
+                start_new_session=True,
+            )
+        except BaseException:
+            os.close(reader)
+            pipe.unlink(missing_ok=True)
+            raise
+        finally:
+            os.close(writer)
+        pump = self._start_pump(job.id, reader)
+
+        for i in job.worker_ids:
+            self._pid_file(i).write_text(f"{proc.pid}")
+        logger.info(
+            f"Started job {job.id} (pid {proc.pid}) on workers {job.worker_ids}"
+        )
+        self._started(job.id)
+        threading.Thread(
+            target=self._reap,
+            args=(job, proc, exit_file, pump),
+            name=f"traintrack_reap_{job.id}",
+            daemon=True,
+        ).start()
+
+    def _reap(
+        self,
+        job: AgentJob,
+        proc: subprocess.Popen,
+        exit_file: Path,
+        pump: threading.Thread,
+    ):
+        exit_code = proc.wait()
+        pump.join(timeout=_DRAIN_TIMEOUT)
+        for i in job.worker_ids:
+            self._pid_file(i).unlink(missing_ok=True)
+        self._pipe_file(job.id).unlink(missing_ok=True)
+        exit_file.unlink(missing_ok=True)
+        self._finish(job.id, exit_code)
+
+    def _kill(self, job: AgentJob):
+        try:
+            pid = int(self._pid_file(job.worker_ids[0]).read_text())
+            # The job leads its own session, stop the whole process group.
+            os.killpg(pid, signal.SIGTERM)
+        except (OSError, ValueError):
+            # Already exited
+            pass
@@ -1,26 +1,35 @@
-import socket
 import subprocess
+
 import libtmux
 from loguru import logger
+from traintrack.runner.base import Runner
 from traintrack.runner.hobot import run_hobot_job
 
 from traintrack.schema.agent_config import AgentConfig
-from traintrack.schema.job import JobDescription, RunJobResponse
-from traintrack.schema.status import WorkerStatus, AgentStatus
+from traintrack.schema.job import AgentJob
 
 
-class TmuxRunner(object):
+class TmuxRunner(Runner):
     def __init__(self, agent_config: AgentConfig):
+        super().__init__(agent_config)
         try:
             subprocess.run(["tmux", "start-server"], check=True)
         except subprocess.CalledProcessError as e:
             logger.critical("Cannot ensure tmux server running. Abort.")
             raise e
 
-        self._worker_config = agent_config.workers
         self._server = libtmux.Server()
+        # The shell in the pane writes the exit code of the job here.
+        self._exit_dir = self._state_dir / "exit"
+        self._exit_dir.mkdir(parents=True, exist_ok=True)
         for i in range(len(self._worker_config)):
             self.ensure_window(i)
+        for job in self._restore():
+            exit_file = self._exit_dir / f"{job.id}.exit"
+            pane_idle = self.is_worker_available(self.ensure_window(job.worker_ids[0]))
+            if pane_idle and not exit_file.exists():
+                # The pane was closed or reused, the exit code is gone.
+                self._finish(job.id, None, message="Exited while the agent was down")
 
     def ensure_session(self) -> libtmux.Session:
         for s in self._server.sessions:
@@ -45,52 +54,53 @@ class TmuxRunner(object):
         logger.info(f"Tmux worker '{worker_name}' created.")
         return w
 
-    @property
-    def num_workers(self):
-        return len(self._worker_config)
-
     def is_worker_available(self, w: libtmux.Window) -> bool:
         # TODO(breakds): Need a more sophisticated way to check availability.
         # The current approach is simplified and prone to race condition.
         return w.panes[0].pane_current_command == "zsh"
 
-    def run_job(self, job: JobDescription) -> RunJobResponse:
-        # First select a worker
-        pane = None
-        worker_id = -1
-        for i in range(self.num_workers):
-            w = self.ensure_window(i)
-            if self.is_worker_available(w):
-                pane = w.panes[0]
-                worker_id = i
-                break
-        if pane is None:
-            logger.info("No available worker.")
-            return RunJobResponse(accepted=False, reason="No available worker.")
-
-        logger.info(f"Found available worker {worker_id}")
+    def _is_worker_free(self, worker_id: int) -> bool:
+        # Workers held by a job are never checked here, this only catches
+        # panes that are used by hand.
+        return self.is_worker_available(self.ensure_window(worker_id))
 
-        if job.repo == "Hobot":
-            repo_config = self._worker_config[worker_id].repos[job.repo]
-            run_hobot_job(pane, repo=repo_config, job=job)
-        else:
-            logger.error(f"Invalid job repo '{job.repo}'")
-            return RunJobResponse(
-                accepted=False, reason=f"Invalid job repo '{job.repo}'"
-            )
+    def _launch(self, job: AgentJob):
+        # The job runs in the pane of the first worker, with all the GPUs
+        # visible to it.
+        leader = job.worker_ids[0]
+        pane = self.ensure_window(leader).panes[0]
+        gpu_ids = [self._worker_config[i].gpu_id for i in job.worker_ids]
+        repo_config = self._worker_config[leader].repos[job.job.repo]
+        exit_file = self._exit_dir / f"{job.id}.exit"
+        exit_file.unlink(missing_ok=True)
+        log_file = self._logs.path(job.id)
+        with open(log_file, "ab") as output:
+            worktree, env_file = self._prepare(job, output)
+        run_hobot_job(
+            pane,
+            checkout=worktree,
+            env_file=env_file,
+            repo=repo_config,
+            job=job.job,
+            gpu_ids=gpu_ids,
+            log_file=log_file,
+            exit_file=exit_file,
+        )
+        self._started(job.id)
 
-        return RunJobResponse(accepted=True)
+    def _kill(self, job: AgentJob):
+        # Interrupt it like from the keyboard, the shell then writes the exit
+        # code as usual.
+        pane = self.ensure_window(job.worker_ids[0]).panes[0]
+        pane.send_keys("C-c", enter=False)
 
-    def status(self):
-        host = socket.gethostname()
-        workers = []
-        for i in range(self.num_workers):
-            w = self.ensure_window(i)
-            workers.append(
-                WorkerStatus(
-                    host=host,
-                    id=i,
-                    gpu_type=self._worker_config[i].gpu_type,
-                    available=self.is_worker_available(w))
-            )
-        return AgentStatus(workers=workers)
+    def _poll(self):
+        for job in self.running_jobs():
+            exit_file = self._exit_dir / f"{job.id}.exit"
+            try:
+                exit_code = int(exit_file.read_text())
+            except (OSError, ValueError):
+                # Not finished yet, or the shell is still writing the file.
+                continue
+            exit_file.unlink(missing_ok=True)
+            self._finish(job.id, exit_code)
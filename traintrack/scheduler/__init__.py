@@ -1,46 +1,58 @@
 import os
-from typing import List
-from contextlib import contextmanager
-from collections import deque
+import json
+import time
+import signal
+import socket
+import sqlite3
+import uuid
+import heapq
+import asyncio
+import itertools
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Dict, List, Set, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
 import threading
 
-import paramiko
 from loguru import logger
+from pydantic import parse_raw_as
 
+from traintrack.scheduler.cluster_state import ClusterState
+from traintrack.scheduler.http_tunnel import TunnelHTTPClient
+from traintrack.scheduler.job_index import JobIndex
+from traintrack.scheduler.job_queue import JobQueue, constraint_key
+from traintrack.scheduler.job_store import JobStore
+from traintrack.scheduler.leader import LeaderLease
+from traintrack.scheduler.log_hub import LogHub
+from traintrack.scheduler.matching import CapacityTable
+from traintrack.scheduler.policy import init_policy
+from traintrack.scheduler.quarantine import Quarantine
+from traintrack.scheduler.runtime import RuntimeEstimator
+from traintrack.scheduler.ssh_pool import SSHConnectionPool
 from traintrack.schema.central_config import CentralConfig, EndPointConfig
-from traintrack.schema.job import JobRequest, RunJobResponse
-from traintrack.schema.status import AgentStatus, WorkerStatus
-
-
-@contextmanager
-def ssh_client(end_point: EndPointConfig):
-    ssh = paramiko.SSHClient()
-    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy)
-    try:
-        proxy = None
-        if end_point.ssh_proxy is not None:
-            proxy = paramiko.ProxyCommand(
-                "ssh -o StrictHostKeyChecking=no "
-                f"{end_point.ssh_proxy} nc "
-                f"{end_point.ssh_uri} {end_point.ssh_proxy_port}"
-            )
-        try:
-            ssh.connect(
-                hostname=end_point.ssh_uri,
-                username=os.environ.get("USER"),
-                key_filename=end_point.ssh_key_file,
-                sock=proxy,
-            )
-        except Exception as e:
-            logger.warning(f"SSH connection failed: {e}")
-            ssh = None
-        yield ssh
-    finally:
-        if ssh is not None:
-            ssh.close()
+from traintrack.schema.job import (
+    AgentJob,
+    CentralJobState,
+    JobPage,
+    JobRequest,
+    Placement,
+    PrepareHint,
+    PrepareRequest,
+    QueuedJob,
+    ReleaseRequest,
+    Reservation,
+    ReserveRequest,
+    ReserveResponse,
+    RunBatchRequest,
+    RunBatchResponse,
+)
+from traintrack.schema.status import (
+    AgentHeartbeat,
+    AgentStatus,
+    HeartbeatResponse,
+    WorkerStatus,
+)
 
 
-# TODO(breakds): There is a lot of IO. We should support await for them.
 class CentralScheduler(object):
     def __init__(self):
         config_file_path = os.environ.get("TRAINTRACK_CENTRAL_CONFIG")
@@ -49,150 +61,1043 @@ class CentralScheduler(object):
                 "TRAINTRACK_CENTRAL_CONFIG environment variable is not set"
             )
         self._config = CentralConfig.parse_file(config_file_path)
-        self._queue = deque()
+        self._end_points = {agent.name: agent for agent in self._config.agents}
+        self._policy = init_policy(self._config)
+        self._queue = JobQueue(self._policy)
+        # Jobs that have left the queue, or wait to go back in
+        self._jobs = JobIndex(max_finished=self._config.max_finished_jobs)
+        # (not_before, job id) of the jobs backing off before a retry
+        self._delayed: List[Tuple[datetime, str]] = []
         self._lock = threading.Lock()
+        self._runtime = RuntimeEstimator(
+            history=self._config.runtime_history,
+            quantile=self._config.runtime_quantile,
+        )
 
         self._agent_blacklist = set(self._config.default_blacklist)
+        self._quarantine = Quarantine(
+            max_failures=self._config.quarantine_failures,
+            window=self._config.quarantine_window,
+            duration=self._config.quarantine_duration,
+        )
+        # agent -> when it was last heard of
+        self._last_seen = {a.name: time.monotonic() for a in self._config.agents}
+        # Agents whose jobs were requeued because they were gone
+        self._lost_agents: Set[str] = set()
+        # Requests sent in the background, referenced until they are done
+        self._background: Set[asyncio.Task] = set()
+        self._store = JobStore(self._config.job_store)
+        # The jobs are only loaded from the store once the lease is taken.
+        port = os.environ.get("TRAINTRACK_CENTRAL_PORT") or 5976
+        self._lease = LeaderLease(
+            self._config.job_store,
+            holder=f"{socket.gethostname()}:{port}",
+            url=os.environ.get("TRAINTRACK_CENTRAL_URL") or f"http://localhost:{port}",
+            ttl=self._config.lease_ttl,
+        )
+        # Set once the jobs are loaded after taking the lease
+        self._ready = False
+        self._last_reconcile: float | None = None
+        self._ssh_pool = SSHConnectionPool(
+            keepalive_interval=self._config.ssh_keepalive_interval,
+            idle_timeout=self._config.ssh_idle_timeout,
+            backoff=self._config.ssh_reconnect_backoff,
+            backoff_max=self._config.ssh_reconnect_backoff_max,
+            connect_timeout=self._config.agent_timeout,
+        )
+        self._http = TunnelHTTPClient(
+            self._ssh_pool, timeout=self._config.agent_timeout
+        )
+        self._logs = LogHub(self._http)
 
-    def fetch_get(self, end_point: EndPointConfig, api: str) -> str | None:
-        with ssh_client(end_point) as ssh:
-            if ssh is None:
-                return None
+        # Paramiko is blocking, so agent requests run on a dedicated thread
+        # pool and are awaited from the event loop.
+        self._executor = ThreadPoolExecutor(
+            max_workers=self._config.max_concurrent_requests,
+            thread_name_prefix="traintrack_io",
+        )
+        self._io_semaphore = asyncio.Semaphore(self._config.max_concurrent_requests)
+        self._schedule_lock = asyncio.Lock()
 
-            stdin, stdout, stderr = ssh.exec_command(
-                f"curl http://localhost:{end_point.port}/{api}"
+        self._cluster = ClusterState(
+            ttl=self._config.status_ttl,
+            heartbeat_timeout=self._config.heartbeat_timeout,
+        )
+        # Set to wake up the scheduling loop for a (coalesced) pass.
+        self._wakeup = asyncio.Event()
+        # (agent, repo, branch) -> when it was last hinted to prefetch
+        self._hinted: Dict[Tuple[str, str, str], float] = {}
+
+    def _recover(self):
+        """Load the jobs and the blacklist persisted before the last exit.
+
+        Whether the dispatched jobs are still running is checked against the
+        agents later, by the first reconciliation.
+
+        """
+        jobs, blacklist = self._store.load(self._config.max_finished_jobs)
+        for agent_name, disabled in blacklist.items():
+            if disabled:
+                self._agent_blacklist.add(agent_name)
+            else:
+                self._agent_blacklist.discard(agent_name)
+        for stored in jobs:
+            job = stored.job.copy(update={"state": stored.state, "agent": stored.agent})
+            if job.state == CentralJobState.QUEUED:
+                self._enqueue(job)
+            else:
+                self._jobs.put(job)
+                self._runtime.observe(job)
+        if len(jobs) > 0:
+            logger.info(
+                f"Recovered {len(self._queue)} queued, "
+                f"{len(self._jobs.live())} dispatched and "
+                f"{len(self._jobs) - len(self._jobs.live())} finished jobs."
             )
 
-            result = []
-            for line in stdout.readlines():
-                result.append(line)
-            return "".join(result)
+    def fetch_get(self, end_point: EndPointConfig, api: str) -> str | None:
+        return self._http.request(end_point, "GET", api)
 
     def fetch_post(
-        self, end_point: EndPointConfig, api: str, payload: str
+        self,
+        end_point: EndPointConfig,
+        api: str,
+        payload: str,
+        idempotent: bool = False,
     ) -> str | None:
-        with ssh_client(end_point) as ssh:
-            if ssh is None:
-                return None
+        return self._http.request(
+            end_point, "POST", api, body=payload, idempotent=idempotent
+        )
+
+    async def _run_io(self, end_point: EndPointConfig, fn, *args):
+        """Run a blocking agent request off the event loop with a timeout.
 
-            stdin, stdout, stderr = ssh.exec_command(
-                'curl -X POST -H "Content-Type: application/json" '
-                f"-d '{payload}' "
-                f"http://localhost:{end_point.port}/{api}"
+        The caller stops waiting after the timeout, but the request keeps its
+        slot until its thread is done, so that requests stuck on a dead agent
+        cannot pile up on the thread pool.
+
+        """
+        await self._io_semaphore.acquire()
+        future = asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        future.add_done_callback(self._io_done)
+        try:
+            return await asyncio.wait_for(
+                asyncio.shield(future), timeout=self._config.agent_timeout
             )
+        except asyncio.TimeoutError:
+            logger.warning(f"Request to agent {end_point.name} timed out.")
+            return None
+
+    def _io_done(self, future: asyncio.Future):
+        self._io_semaphore.release()
+        # Nobody awaits the requests that timed out, retrieve their errors.
+        if not future.cancelled() and future.exception() is not None:
+            logger.debug(f"Agent request failed: {future.exception()}")
+
+    async def afetch_get(self, end_point: EndPointConfig, api: str) -> str | None:
+        return await self._run_io(end_point, self.fetch_get, end_point, api)
+
+    async def afetch_post(
+        self,
+        end_point: EndPointConfig,
+        api: str,
+        payload: str,
+        idempotent: bool = False,
+    ) -> str | None:
+        return await self._run_io(
+            end_point, self.fetch_post, end_point, api, payload, idempotent
+        )
+
+    async def _fetch_status(self, end_point: EndPointConfig) -> AgentStatus | None:
+        response = await self.afetch_get(end_point, "status")
+        if response is None:
+            logger.warning(f"Agent {end_point.name} is unreachable.")
+            return None
+        return AgentStatus.parse_raw(response)
+
+    async def _refresh_status(
+        self, agents: List[EndPointConfig]
+    ) -> List[EndPointConfig]:
+        """Re-fetch the status of the agents whose cached entry is stale.
+
+        The agents are queried concurrently, so the latency is bounded by the
+        slowest agent (or the timeout) instead of the sum over all agents.
+        Unreachable agents keep their last known (now stale) entry. Returns
+        the agents whose status was fetched.
+
+        """
+        stale = [a for a in agents if not self._cluster.is_fresh(a.name)]
+        results = await asyncio.gather(*[self._fetch_status(a) for a in stale])
+        polled = []
+        for agent, status in zip(stale, results):
+            if status is not None:
+                self._cluster.update(agent.name, status)
+                self._seen(agent.name)
+                polled.append(agent)
+        return polled
+
+    async def _poll_jobs(self, agents: List[EndPointConfig]):
+        """Apply the job reports of agents that were polled rather than
+        pushing heartbeats, so that their jobs do not wait for the next
+        reconciliation to be seen finishing."""
+        with self._lock:
+            busy = {job.agent for job in self._jobs.live()}
+        agents = [a for a in agents if a.name in busy]
+        results = await asyncio.gather(*[self._fetch_jobs(a) for a in agents])
+        with self._lock:
+            if not self._lease.held:
+                return
+            for agent, jobs in zip(agents, results):
+                for job in jobs or []:
+                    self._apply_report(agent.name, job)
+
+    def _agent_workers(self, agent: EndPointConfig) -> List[WorkerStatus]:
+        """The workers of the agent, as far as central knows."""
+        if agent.name in self._agent_blacklist:
+            # TODO(breakds): This is just a temporary solution.
+            return [
+                WorkerStatus(host=agent.name, id=-1, gpu_type="N/A", available=False)
+            ]
+        entry = self._cluster.get(agent.name)
+        if entry is None:
+            return []
+        stale = not self._cluster.is_fresh(agent.name)
+        return [w.copy(update={"stale": stale}) for w in entry.status.workers]
 
-            result = []
-            for line in stdout.readlines():
-                result.append(line)
-            return "".join(result)
+    async def list_workers(self) -> List[WorkerStatus]:
+        agents = [a for a in self._config.agents if a.name not in self._agent_blacklist]
+        await self._refresh_status(agents)
+        return [w for agent in self._config.agents for w in self._agent_workers(agent)]
 
-    def list_workers(self) -> List[WorkerStatus]:
-        workers = []
+    async def stream_workers(self) -> AsyncIterator[List[WorkerStatus]]:
+        """The workers of each agent, as soon as they are known.
+
+        Agents with a fresh cached status come first, then the others one by
+        one as they answer (or fail to), so that a slow agent does not hold
+        back the rest.
+
+        """
+        pending = []
         for agent in self._config.agents:
-            if agent.name in self._agent_blacklist:
-                # TODO(breakds): This is just a temporary solution.
-                workers.append(
-                    WorkerStatus(
-                        host=agent.name, id=-1, gpu_type="N/A", available=False
-                    )
-                )
-                continue
-            response = self.fetch_get(agent, "status")
-            if response is None:
-                logger.warning(f"Agent {agent.name} is unreachable.")
-                continue
-            agent_status = AgentStatus.parse_raw(response)
-            workers += agent_status.workers
+            if agent.name in self._agent_blacklist or self._cluster.is_fresh(
+                agent.name
+            ):
+                yield self._agent_workers(agent)
+            else:
+                pending.append(self._refresh_agent(agent))
+        for refreshed in asyncio.as_completed(pending):
+            workers = self._agent_workers(await refreshed)
+            if len(workers) > 0:
+                yield workers
+
+    async def _refresh_agent(self, agent: EndPointConfig) -> EndPointConfig:
+        status = await self._fetch_status(agent)
+        if status is not None:
+            self._cluster.update(agent.name, status)
+            self._seen(agent.name)
+        return agent
 
-        return workers
+    def invalidate_agent(self, agent_name: str):
+        self._cluster.invalidate(agent_name)
+
+    def report_heartbeat(self, heartbeat: AgentHeartbeat) -> HeartbeatResponse:
+        try:
+            self.find_agent_by_name(heartbeat.name)
+        except KeyError:
+            logger.warning(f"Ignoring heartbeat from unknown agent {heartbeat.name}.")
+            return HeartbeatResponse()
+
+        self._seen(heartbeat.name)
+        if len(heartbeat.jobs) > 0:
+            with self._lock:
+                for job in heartbeat.jobs:
+                    self._apply_report(heartbeat.name, job)
+
+        if heartbeat.status is None:
+            if not self._cluster.touch(heartbeat.name, heartbeat.version):
+                return HeartbeatResponse(need_status=True)
+            return HeartbeatResponse()
+
+        self._cluster.update(heartbeat.name, heartbeat.status, heartbeat.version)
+        # Schedule right away instead of waiting for the next tick when the
+        # agent reports free capacity.
+        if (
+            heartbeat.name not in self._agent_blacklist
+            and any(w.available for w in heartbeat.status.workers)
+            and len(self._queue) > 0
+        ):
+            self.request_schedule()
+        return HeartbeatResponse()
 
     def find_agent_by_name(self, name: str):
-        for agent in self._config.agents:
-            if agent.name == name:
-                return agent
-        raise KeyError(f"Cannot find agent with name '{name}'.")
+        try:
+            return self._end_points[name]
+        except KeyError:
+            raise KeyError(f"Cannot find agent with name '{name}'.")
 
-    def _try_schedule(self):
+    async def _try_schedule(self):
         """Query all the agents and schedule jobs if possible.
 
-        Note that this function can only be called within scheduler's event loop
-        in order to be thread safe.
+        Only one scheduling pass runs at a time. The queue lock is never held
+        across an await, so the API stays responsive while a pass is running.
 
         """
-        # First scan all the agents and get the number of available workers on
-        # each agent.
-        worker_count = {}
-        for agent in self._config.agents:
-            if agent.name in self._agent_blacklist:
+        async with self._schedule_lock:
+            await self._schedule_pass()
+
+    def request_schedule(self):
+        """Wake up the scheduling loop.
+
+        Requests made while a pass is pending or running are coalesced into a
+        single follow-up pass. Must be called from the event loop thread.
+
+        """
+        self._wakeup.set()
+
+    @property
+    def is_leader(self) -> bool:
+        return self._lease.held
+
+    @property
+    def is_ready(self) -> bool:
+        """Whether this instance leads and has loaded the jobs, i.e. can
+        serve requests."""
+        return self._ready and self._lease.held
+
+    def leader(self) -> Tuple[str, str | None] | None:
+        """The name and URL of the leading instance, if any."""
+        return self._lease.leader()
+
+    async def _lead(self):
+        """Stand by until this instance takes the lease, then load the jobs.
+
+        Only the leader schedules and writes to the store. The other instances
+        share the store and take over once the leader's lease expires, which
+        takes at most lease_ttl seconds.
+
+        """
+        standing_by = False
+        while True:
+            try:
+                if await asyncio.to_thread(self._lease.acquire):
+                    break
+            except sqlite3.Error as e:
+                logger.warning(f"Failed to take the lease: {e}")
+            if not standing_by:
+                standing_by = True
+                leader = self._lease.leader()
+                logger.info(f"Standing by, {leader and leader[0]} is leading.")
+            await asyncio.sleep(self._config.lease_ttl / 3)
+        # Nothing has been heard from the agents while standing by. They get
+        # a full agent_lost_timeout from now before their jobs are requeued.
+        now = time.monotonic()
+        self._last_seen = {a.name: now for a in self._config.agents}
+        self._lost_agents.clear()
+        # From now on the store refuses writes made after losing the lease.
+        self._store.fence(self._lease.holder, self._lease.term)
+        with self._lock:
+            self._recover()
+        self._ready = True
+        logger.success(f"Leading the cluster, term {self._lease.term}.")
+        task = asyncio.get_running_loop().create_task(self._keep_lease())
+        self._background.add(task)
+
+    async def _keep_lease(self):
+        """Renew the lease. If it is lost anyway, e.g. after a long pause, the
+        process shuts down rather than compete with the new leader."""
+        while True:
+            await asyncio.sleep(self._config.lease_ttl / 3)
+            try:
+                await asyncio.to_thread(self._lease.acquire)
+            except sqlite3.Error as e:
+                logger.warning(f"Failed to renew the lease: {e}")
+            if not self._lease.held:
+                logger.error("Lost the lease to another instance, shutting down.")
+                os.kill(os.getpid(), signal.SIGTERM)
+                return
+
+    async def run(self):
+        """The scheduling loop.
+
+        Waits to be the leader first, see ``_lead``. A pass runs whenever the
+        loop is woken up by request_schedule(), when a pushed agent misses its
+        heartbeat, when a job is done backing off or an agent leaves
+        quarantine, and at least every schedule_interval seconds as a safety
+        net. The jobs are reconciled with the agents on startup and then every
+        reconcile_interval seconds.
+
+        """
+        await self._lead()
+        while True:
+            if (
+                self._last_reconcile is None
+                or time.monotonic() - self._last_reconcile
+                > self._config.reconcile_interval
+            ):
+                try:
+                    # Not while a pass is dispatching jobs, which would then
+                    # look lost.
+                    async with self._schedule_lock:
+                        await self._reconcile()
+                except Exception as e:
+                    logger.exception(f"Reconciliation failed: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self._timeout())
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            self._maintain()
+            try:
+                await self._try_schedule()
+            except Exception as e:
+                logger.exception(f"Scheduling pass failed: {e}")
+
+    def _timeout(self) -> float:
+        """Seconds until the loop has to wake up on its own."""
+        now = time.monotonic()
+        timeout = self._config.schedule_interval
+        for expiry in [self._cluster.next_expiry(), self._quarantine.next_expiry()]:
+            if expiry is not None:
+                timeout = min(timeout, max(0.0, expiry - now))
+        with self._lock:
+            if len(self._delayed) > 0:
+                delay = (self._delayed[0][0] - datetime.now()).total_seconds()
+                timeout = min(timeout, max(0.0, delay))
+            busy = {job.agent for job in self._jobs.live()}
+        for agent_name in busy:
+            lost_at = (
+                self._last_seen.get(agent_name, now) + self._config.agent_lost_timeout
+            )
+            timeout = min(timeout, max(0.0, lost_at - now))
+        return timeout
+
+    def _maintain(self):
+        """Requeue the jobs of lost agents and the jobs done backing off, and
+        lift the quarantines that are over."""
+        if not self._lease.held:
+            return
+        for agent_name in self._quarantine.expire():
+            logger.info(f"Agent {agent_name} leaves quarantine.")
+            self._agent_blacklist.discard(agent_name)
+
+        now = time.monotonic()
+        lost = set()
+        with self._lock:
+            for job in self._jobs.live():
+                last_seen = self._last_seen.get(job.agent, now)
+                if now - last_seen > self._config.agent_lost_timeout:
+                    logger.warning(f"Agent {job.agent} is gone, requeue job {job.id}.")
+                    lost.add(job.agent)
+                    self._requeue(job, message=f"Lost with agent {job.agent}")
+
+            while len(self._delayed) > 0 and self._delayed[0][0] <= datetime.now():
+                not_before, job_id = heapq.heappop(self._delayed)
+                job = self._jobs.get(job_id)
+                # Unless it has been cancelled while backing off
+                if job is not None and job.state == CentralJobState.QUEUED:
+                    self._jobs.remove(job_id)
+                    self._queue.push(job)
+        for agent_name in lost:
+            self._lost_agents.add(agent_name)
+            self._agent_failed(agent_name)
+
+    def _seen(self, agent_name: str):
+        self._last_seen[agent_name] = time.monotonic()
+        if agent_name in self._lost_agents:
+            # Its jobs may still be running, reconcile to stop them since
+            # they have been requeued.
+            logger.info(f"Agent {agent_name} is back.")
+            self._lost_agents.discard(agent_name)
+            self._last_reconcile = None
+            self.request_schedule()
+
+    def _agent_failed(self, agent_name: str):
+        """Count a lost or crashed job against the agent."""
+        if self._quarantine.record_failure(agent_name):
+            logger.warning(f"Agent {agent_name} fails too often, quarantined.")
+            if agent_name not in self._agent_blacklist:
+                self._agent_blacklist.add(agent_name)
+                # For the loop to wake up at the end of the quarantine
+                self.request_schedule()
+            else:
+                # Already disabled by hand, which takes precedence
+                self._quarantine.release(agent_name)
+
+    def _cancel_in_background(self, agent_name: str, agent_job_id: str):
+        task = asyncio.get_running_loop().create_task(
+            self.afetch_post(
+                self._end_points[agent_name], f"jobs/{agent_job_id}/cancel", payload=""
+            )
+        )
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _fetch_jobs(self, end_point: EndPointConfig) -> List[AgentJob] | None:
+        response = await self.afetch_get(end_point, "jobs")
+        if response is None:
+            return None
+        self._seen(end_point.name)
+        return parse_raw_as(List[AgentJob], response)
+
+    async def _reconcile(self):
+        """Match the jobs central knows about with the jobs on the agents.
+
+        The state of every job is updated from what its agent reports, which
+        catches the transitions that heartbeats missed. A dispatched job that
+        its agent does not have (e.g. the agent restarted) goes back to the
+        queue. Jobs on agents that cannot be reached are left as they are,
+        until the agent is considered lost.
+
+        """
+        self._last_reconcile = time.monotonic()
+        agents = self._config.agents
+        results = await asyncio.gather(*[self._fetch_jobs(a) for a in agents])
+        on_agents: Dict[str, Tuple[str, AgentJob]] = {}
+        reachable = set()
+        for agent, jobs in zip(agents, results):
+            if jobs is None:
                 continue
-            response = self.fetch_get(agent, "status")
-            if response is None:
-                logger.warning(f"Agent {agent.name} is unreachable.")
+            reachable.add(agent.name)
+            for job in jobs:
+                on_agents[job.id] = (agent.name, job)
+
+        with self._lock:
+            if not self._lease.held:
+                return
+            for agent_name, job in on_agents.values():
+                self._apply_report(agent_name, job)
+            for job in self._jobs.live():
+                if job.agent_job_id not in on_agents and job.agent in reachable:
+                    logger.warning(f"Job {job.id} is lost by {job.agent}, requeue.")
+                    self._requeue(job, message=f"Lost by agent {job.agent}")
+
+    def _put(self, job: QueuedJob) -> Future:
+        """Record a job that is not queued. Called with the lock held."""
+        for job_id in self._jobs.put(job):
+            self._store.delete(job_id)
+        return self._store.put(job, job.state, job.agent)
+
+    def _enqueue(self, queued: QueuedJob):
+        """Queue the job, or hold it until it is done backing off. Called with
+        the lock held."""
+        if queued.not_before is not None and queued.not_before > datetime.now():
+            self._jobs.put(queued)
+            heapq.heappush(self._delayed, (queued.not_before, queued.id))
+        else:
+            self._queue.push(queued)
+
+    def _requeue(
+        self,
+        job: QueuedJob,
+        message: str | None = None,
+        not_before: datetime | None = None,
+        avoid: str | None = None,
+    ):
+        """Put a job that has left the queue back, for a new attempt.
+
+        It goes back with its original priority and enqueue time, so it keeps
+        its place in the queue. Called with the lock held.
+
+        """
+        self._jobs.remove(job.id)
+        avoided = job.avoided_agents
+        if avoid is not None and avoid not in avoided:
+            avoided = avoided + [avoid]
+        queued = QueuedJob(
+            id=job.id,
+            request=job.request,
+            enqueued_at=job.enqueued_at,
+            attempt=job.attempt + 1,
+            failures=job.failures,
+            avoided_agents=avoided,
+            not_before=not_before,
+            message=message,
+        )
+        self._enqueue(queued)
+        self._store.put(queued, queued.state)
+
+    def _retry(self, job: QueuedJob) -> bool:
+        """Requeue a failed job if its retry policy allows it. Called with the
+        lock held."""
+        policy = job.request.retry
+        failures = job.failures
+        if failures >= policy.max_attempts:
+            if policy.max_attempts > 1:
+                logger.warning(f"Job {job.id} failed {failures} times, giving up.")
+            return False
+        delay = min(
+            policy.backoff * policy.backoff_factor ** (failures - 1), policy.max_backoff
+        )
+        logger.info(f"Retrying job {job.id} in {delay:.0f} seconds.")
+        self._requeue(
+            job,
+            message=(
+                f"Attempt {job.attempt} failed on {job.agent} "
+                f"(exit code {job.exit_code})"
+            ),
+            not_before=datetime.now() + timedelta(seconds=delay),
+            avoid=job.agent if policy.avoid_failed_agents else None,
+        )
+        # For the loop to wake up at the end of the backoff
+        self.request_schedule()
+        return True
+
+    def _mark_dispatched(
+        self, queued: QueuedJob, agent_name: str, worker_ids: List[int]
+    ) -> Future:
+        """Record that the job is sent to the agent. Called with the lock
+        held. The returned future is resolved once the record is durable."""
+        return self._put(
+            queued.copy(
+                update={
+                    "state": CentralJobState.DISPATCHED,
+                    "agent": agent_name,
+                    "dispatched_at": datetime.now(),
+                    "worker_ids": worker_ids,
+                }
+            )
+        )
+
+    def _expected_end(self, job: QueuedJob, now: float) -> float | None:
+        """When the job on an agent is expected to be done, None if unknown."""
+        duration = self._runtime.estimate(job.request)
+        start = job.started_at or job.dispatched_at
+        if duration is None or start is None:
+            return None
+        # Overdue jobs may be done any time now
+        return max(now, start.timestamp() + duration)
+
+    def _apply_report(self, agent_name: str, report: AgentJob):
+        """Update a job from the state its agent reports. Called with the lock
+        held."""
+        job_id = report.id.partition("-")[0]
+        job = self._queue.get(job_id) or self._jobs.get(job_id)
+        if job is None:
+            # Not run by central, e.g. started on the agent directly
+            return
+        if job.agent_job_id != report.id:
+            # An earlier attempt, e.g. on an agent that came back after its
+            # jobs were requeued. It must not run twice.
+            if not report.state.finished:
+                logger.warning(f"Stopping stale job {report.id} on {agent_name}.")
+                self._cancel_in_background(agent_name, report.id)
+            return
+        if job.state.finished or job.agent not in (None, agent_name):
+            return
+        # Still queued if it was dispatched right before a crash
+        self._queue.remove(job_id)
+        state = CentralJobState(report.state.value)
+        updated = job.copy(
+            update={
+                "state": state,
+                "agent": agent_name,
+                "commit": report.commit,
+                "message": report.message,
+                "started_at": report.started_at,
+                "finished_at": report.finished_at,
+                "exit_code": report.exit_code,
+            }
+        )
+        if updated == job:
+            return
+        if state == CentralJobState.FAILED and job.state != state:
+            logger.warning(
+                f"Job {job.id} failed on {agent_name} (exit code {report.exit_code})."
+            )
+        elif state != job.state:
+            logger.info(f"Job {job.id} {state.value} on {agent_name}.")
+        if state == CentralJobState.FAILED:
+            # Killed by a signal (e.g. out of memory), rather than an error in
+            # the job itself. A job that could not be launched has no exit
+            # code, and is not held against the agent: that is mostly a bad
+            # branch or config, which would fail on any agent.
+            code = report.exit_code
+            if code is not None and (code < 0 or code > 128):
+                self._agent_failed(agent_name)
+            updated = updated.copy(update={"failures": job.failures + 1})
+            if self._retry(updated):
+                return
+        self._runtime.observe(updated)
+        self._put(updated)
+
+    async def _schedule_pass(self):
+        # First build the free worker slots of each agent from their status.
+        agents = [a for a in self._config.agents if a.name not in self._agent_blacklist]
+        await self._poll_jobs(await self._refresh_status(agents))
+        capacity = CapacityTable()
+        for agent in agents:
+            # Never schedule based on the stale status of an unreachable agent.
+            if not self._cluster.is_fresh(agent.name):
                 continue
-            count = 0
-            agent_status = AgentStatus.parse_raw(response)
-            for w in agent_status.workers:
-                if w.available:
-                    count += 1
-            worker_count[agent.name] = count
+            capacity.add_agent(agent.name, self._cluster.get(agent.name).status)
 
+        # Then assign jobs to the free slots in memory, without any I/O.
+        now = time.time()
+        placements: Dict[str, List[Tuple[QueuedJob, List[int]]]] = {}
+        # Constraint classes for which there is no eligible capacity left in
+        # this pass. Jobs of these classes are not tried anymore.
+        exhausted = set()
+        # Number of blocked multi-GPU jobs that may still hold back capacity.
+        reservations = self._config.max_gang_reservations
+        written: List[Future] = []
         with self._lock:
-            scheduled = []
-            unscheduled = []
-            while len(self._queue) > 0:
-                job_req: JobRequest = self._queue.pop()  # Pop from right
-                logger.info(f"Scheduling {job_req} ...")
-                success = False
-                for agent_name, count in worker_count.items():
-                    if agent_name in job_req.agent_blacklist or count == 0:
+            # The status refresh may have outlived the lease.
+            if not self._lease.held:
+                logger.error("The lease is lost, not scheduling.")
+                return
+            live = self._jobs.live()
+            for job in live:
+                capacity.release_at(
+                    job.agent, job.worker_ids, self._expected_end(job, now)
+                )
+            self._policy.refresh(live)
+            while capacity.total + capacity.held > 0:
+                queued = self._queue.next_job(exclude=exhausted)
+                if queued is None:
+                    break
+                request = self._placement_request(queued, capacity)
+                slot = capacity.find(request)
+                if slot is not None:
+                    agent_name, rc = slot
+                    worker_ids = capacity.take(agent_name, rc, request.num_gpus)
+                else:
+                    duration = self._runtime.estimate(request)
+                    backfill = capacity.backfill(request, duration, now)
+                    if backfill is None:
+                        if request.num_gpus > 1 and reservations > 0:
+                            reserved = capacity.reserve_for(request, now)
+                            if reserved is not None:
+                                reservations -= 1
+                                logger.info(f"Reserving {reserved} for {queued.id}.")
+                        exhausted.add(
+                            constraint_key(queued.request, queued.avoided_agents)
+                        )
                         continue
+                    agent_name, worker_ids = backfill
+                    logger.info(f"Backfilling {queued.id} on {agent_name}.")
+                # Mark the job before sending it, so that the agent's reports
+                # find it even if they arrive before the response.
+                self._queue.remove(queued.id)
+                written.append(self._mark_dispatched(queued, agent_name, worker_ids))
+                self._policy.charge(queued)
+                placements.setdefault(agent_name, []).append((queued, worker_ids))
+            upcoming = self._queue.top(self._config.prefetch_top_k)
 
-                    agent = self.find_agent_by_name(agent_name)
-                    response = self.fetch_post(agent, "run", payload=job_req.job.json())
-                    if response is None:
-                        logger.warning(f"Agent {agent.name} is unreachable.")
-                        worker_count[agent_name] = 0
-                        continue
+        # Finally send one batched placement request per agent, and let the
+        # agents prepare the jobs that are likely to run next. A new leader
+        # must find the jobs dispatched in the store, or it would send them
+        # again, so wait for the records to be durable. Nothing is sent
+        # without the lease, the next leader requeues the jobs.
+        await asyncio.gather(*[asyncio.wrap_future(f) for f in written])
+        if not self._lease.held:
+            logger.error("The lease is lost, not dispatching.")
+            return
+        hints = self._prepare_hints(capacity, upcoming)
+        await asyncio.gather(
+            *[self._dispatch(name, jobs) for name, jobs in placements.items()],
+            *[self._send_hints(name, h) for name, h in hints.items()],
+        )
+
+    def _placement_request(self, job: QueuedJob, capacity: CapacityTable) -> JobRequest:
+        """The request of the job, with the agents it failed on blacklisted as
+        long as another schedulable agent could run it."""
+        if len(job.avoided_agents) == 0:
+            return job.request
+        request = job.request.copy(
+            update={"agent_blacklist": job.request.agent_blacklist + job.avoided_agents}
+        )
+        if len(capacity.candidates(request)) == 0:
+            return job.request
+        return request
+
+    def _prepare_hints(
+        self, capacity: CapacityTable, upcoming: List[QueuedJob]
+    ) -> Dict[str, List[PrepareHint]]:
+        now = time.monotonic()
+        expired = now - self._config.prefetch_interval
+        self._hinted = {k: t for k, t in self._hinted.items() if t > expired}
+        hints: Dict[str, List[PrepareHint]] = {}
+        for queued in upcoming:
+            desc = queued.request.job
+            agents = capacity.candidates(queued.request)
+            for agent_name in agents[: self._config.prefetch_agents]:
+                key = (agent_name, desc.repo, desc.spec.branch)
+                if key in self._hinted:
+                    continue
+                self._hinted[key] = now
+                hints.setdefault(agent_name, []).append(
+                    PrepareHint(repo=desc.repo, branch=desc.spec.branch)
+                )
+        return hints
+
+    async def _send_hints(self, agent_name: str, hints: List[PrepareHint]):
+        agent = self._end_points[agent_name]
+        payload = PrepareRequest(hints=hints).json()
+        if await self.afetch_post(agent, "prepare", payload=payload) is None:
+            logger.warning(f"Failed to send prepare hints to {agent_name}.")
+
+    async def _post_idempotent(
+        self, end_point: EndPointConfig, api: str, payload: str
+    ) -> str | None:
+        """POST a request that is safe to send twice, once more if it fails."""
+        response = await self.afetch_post(end_point, api, payload, idempotent=True)
+        if response is None:
+            response = await self.afetch_post(end_point, api, payload, idempotent=True)
+        return response
+
+    async def _release(self, agent: EndPointConfig, job_ids: List[str]):
+        """Drop the reservations of the jobs on the agent, best effort."""
+        payload = ReleaseRequest(job_ids=job_ids).json()
+        if await self.afetch_post(agent, "release", payload, idempotent=True) is None:
+            logger.warning(f"Failed to release reservations on {agent.name}.")
 
-                    job_name = f"{job_req.job.group}.{job_req.job.name}"
-                    response = RunJobResponse.parse_raw(response)
-                    if not response.accepted:
-                        logger.warning(
-                            f"Agent {agent_name} refuse to run job "
-                            f"{job_name} - reason: {response.reason}"
+    async def _dispatch(
+        self, agent_name: str, placements: List[Tuple[QueuedJob, List[int]]]
+    ):
+        """Reserve the chosen workers on the agent, then run the jobs there.
+
+        Both phases are keyed by the id of the job's attempt and can be sent
+        again safely. Jobs that cannot get their workers go back to the queue
+        right away, as nothing has started on the agent. The reservations of
+        the jobs that are not run (the lease was lost, or the agent refused
+        them) are released, and they expire on the agent anyway if that is
+        lost too. If the run request fails, whether the jobs have started is
+        left to an early reconciliation. Refused jobs go back to the queue,
+        unless the agent has already reported them.
+
+        """
+        agent = self._end_points[agent_name]
+        payload = ReserveRequest(
+            reservations=[
+                Reservation(job_id=queued.agent_job_id, worker_ids=worker_ids)
+                for queued, worker_ids in placements
+            ],
+            ttl=self._config.reservation_ttl,
+        ).json()
+        response = await self._post_idempotent(agent, "reserve", payload)
+        rejected = []
+        reserved = []
+        # Reserved on the agent but not run
+        unused = []
+        if response is None:
+            logger.warning(f"Agent {agent_name} is unreachable.")
+            rejected = [queued for queued, _ in placements]
+            # The agent may have reserved them before the answer was lost
+            unused = list(rejected)
+        else:
+            results = ReserveResponse.parse_raw(response).results
+            for (queued, worker_ids), result in zip(placements, results):
+                if result.accepted:
+                    reserved.append((queued, worker_ids))
+                    continue
+                logger.warning(
+                    f"Agent {agent_name} cannot reserve workers {worker_ids} "
+                    f"for job {queued.id} - reason: {result.reason}"
+                )
+                rejected.append(queued)
+
+        if len(reserved) > 0 and not self._lease.held:
+            # The jobs are the new leader's to place now
+            unused = [queued for queued, _ in reserved]
+        elif len(reserved) > 0:
+            payload = RunBatchRequest(
+                placements=[
+                    Placement(
+                        job=queued.request.job,
+                        job_id=queued.agent_job_id,
+                        worker_ids=worker_ids,
+                        idempotency_key=f"{self._lease.term}/{queued.agent_job_id}",
+                    )
+                    for queued, worker_ids in reserved
+                ]
+            ).json()
+            # The agent answers a placement it has already accepted again
+            # with the same result instead of running it twice.
+            response = await self._post_idempotent(agent, "run_batch", payload)
+            if response is None:
+                logger.warning(f"Agent {agent_name} is unreachable, reconciling.")
+                self._last_reconcile = None
+            else:
+                results = RunBatchResponse.parse_raw(response).results
+                for (queued, _), result in zip(reserved, results):
+                    desc = queued.request.job
+                    job_name = f"{desc.group}.{desc.name}"
+                    if result.accepted:
+                        logger.success(
+                            f"Job {job_name} scheduled to run on {agent_name}."
                         )
                         continue
-                    logger.success(f"Job {job_name} scheduled to run on {agent_name}.")
-                    success = True
-                    break
+                    logger.warning(
+                        f"Agent {agent_name} refuse to run job "
+                        f"{job_name} - reason: {result.reason}"
+                    )
+                    rejected.append(queued)
+                    unused.append(queued)
+        if len(unused) > 0:
+            await self._release(agent, [queued.agent_job_id for queued in unused])
+        # Whether accepted or refused, the agent's status is no longer what we
+        # have in the cache.
+        self._cluster.invalidate(agent_name)
 
-                if success:
-                    scheduled.append(job_req)
-                else:
-                    unscheduled.append(job_req)
+        with self._lock:
+            for queued in rejected:
+                job = self._jobs.get(queued.id)
+                if job is not None and job.state == CentralJobState.DISPATCHED:
+                    self._requeue(job)
 
-            for job_req in unscheduled:
-                self._queue.appendleft(job_req)  # Append from right
+    async def enqueue(self, job: JobRequest) -> QueuedJob:
+        return (await self.enqueue_batch([job]))[0]
 
-    def enqueue(self, job: JobRequest) -> bool:
+    async def enqueue_batch(self, jobs: List[JobRequest]) -> List[QueuedJob]:
+        """Queue the jobs atomically, with a single scheduling pass after."""
+        now = datetime.now()
+        queued = [
+            QueuedJob(id=uuid.uuid4().hex[:12], request=job, enqueued_at=now)
+            for job in jobs
+        ]
+        # Concurrent enqueues are committed together by the store.
+        await asyncio.wrap_future(self._store.put_many(queued, CentralJobState.QUEUED))
         with self._lock:
-            self._queue.appendleft(job)
-        self._try_schedule()
-        return True
+            for q in queued:
+                self._queue.push(q)
+        self.request_schedule()
+        return queued
+
+    def list_jobs(
+        self,
+        project: str | None = None,
+        group: str | None = None,
+        state: CentralJobState | None = None,
+        agent: str | None = None,
+        cursor: str | None = None,
+        limit: int = 100,
+    ) -> JobPage:
+        """A page of the jobs that match all the given filters.
+
+        Jobs are ordered by (enqueued_at, id), which does not change while a
+        client pages through them, and the cursor is the key of the last job
+        of the previous page. A page costs O(n log limit) for the n jobs that
+        pass the filters.
+
+        """
+        after = None
+        if cursor is not None:
+            enqueued_at, _, job_id = cursor.partition("/")
+            after = (datetime.fromisoformat(enqueued_at), job_id)
+
+        def _key(job: QueuedJob):
+            return (job.enqueued_at, job.id)
+
+        def _match(job: QueuedJob) -> bool:
+            desc = job.request.job
+            if project is not None and desc.project != project:
+                return False
+            if group is not None and desc.group != group:
+                return False
+            return after is None or _key(job) > after
 
-    def list_jobs(self) -> List[JobRequest]:
         with self._lock:
-            result = []
-            for i in range(len(self._queue)):
-                result.append(self._queue[i])
-            return result
+            candidates = []
+            # Queued jobs are not on any agent yet
+            if state in (None, CentralJobState.QUEUED) and agent is None:
+                candidates.append(self._queue.find(project, group))
+            # Including the queued jobs that are backing off
+            states = None if state is None else [state]
+            candidates.append(self._jobs.find(states, agent))
+            page = heapq.nsmallest(
+                limit + 1,
+                filter(_match, itertools.chain(*candidates)),
+                key=_key,
+            )
+
+        next_cursor = None
+        if len(page) > limit:
+            page = page[:limit]
+            last = page[-1]
+            next_cursor = f"{last.enqueued_at.isoformat()}/{last.id}"
+        return JobPage(jobs=page, next_cursor=next_cursor)
+
+    def get_job(self, job_id: str) -> QueuedJob | None:
+        with self._lock:
+            return self._queue.get(job_id) or self._jobs.get(job_id)
+
+    def job_end_point(
+        self, job_id: str, agent_name: str | None = None
+    ) -> Tuple[EndPointConfig, str] | None:
+        """The agent that runs the job (or the named one if given), and the id
+        of the job's latest attempt on it."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if agent_name is None:
+            if job is None or job.agent is None:
+                return None
+            agent_name = job.agent
+        end_point = self._end_points.get(agent_name)
+        if end_point is None:
+            return None
+        return end_point, job_id if job is None else job.agent_job_id
+
+    @property
+    def logs(self) -> LogHub:
+        return self._logs
+
+    async def cancel_job(self, job_id: str) -> bool:
+        """Cancel a queued job, or ask its agent to stop it.
+
+        A job on an agent is only marked as cancelled once the agent reports
+        it. Returns False if the job has already finished or cannot be
+        stopped.
+
+        """
+        with self._lock:
+            job = self._queue.remove(job_id) or self._jobs.get(job_id)
+            if job is None or job.state.finished:
+                return False
+            if job.state == CentralJobState.QUEUED:
+                self._put(
+                    job.copy(
+                        update={
+                            "state": CentralJobState.CANCELLED,
+                            "finished_at": datetime.now(),
+                        }
+                    )
+                )
+                return True
+        agent = self._end_points[job.agent]
+        response = await self.afetch_post(
+            agent, f"jobs/{job.agent_job_id}/cancel", payload=""
+        )
+        return response is not None and json.loads(response)["success"]
+
+    def reprioritize_job(self, job_id: str, priority: int) -> QueuedJob | None:
+        with self._lock:
+            job = self._queue.reprioritize(job_id, priority)
+            if job is not None:
+                self._store.put(job, job.state)
+            return job
 
     def disable_agent(self, agent_name: str):
+        # Stays disabled after the quarantine, if any
+        self._quarantine.release(agent_name)
         self._agent_blacklist.add(agent_name)
+        self._store.set_disabled(agent_name, True)
+        self.request_schedule()
 
     def enable_agent(self, agent_name: str):
+        self._quarantine.release(agent_name)
         if agent_name in self._agent_blacklist:
             self._agent_blacklist.remove(agent_name)
+        self._store.set_disabled(agent_name, False)
+        self.request_schedule()
+
+    def close(self):
+        self._store.close()
+        # Once everything is written, for a standby to take over right away
+        self._lease.release()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._logs.close()
+        self._http.close()
+        self._ssh_pool.close()
 
     @property
     def agent_blacklist(self) -> List[str]:
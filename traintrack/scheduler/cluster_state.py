@@ -0,0 +1,78 @@
+import time
+from typing import Dict
+
+from traintrack.schema.status import AgentStatus
+
+
+class AgentState(object):
+    def __init__(
+        self, status: AgentStatus, fetched_at: float, version: int | None = None
+    ):
+        self.status = status
+        self.fetched_at = fetched_at
+        # Only set for agents that push their status with heartbeats
+        self.version = version
+
+    @property
+    def pushed(self) -> bool:
+        return self.version is not None
+
+
+class ClusterState(object):
+    """In-memory view of the last known status of every agent.
+
+    A polled entry is fresh for ``ttl`` seconds after it was fetched. An entry
+    pushed by the agent stays fresh as long as heartbeats keep arriving within
+    ``heartbeat_timeout``. Invalidated or expired entries keep their last known
+    status so that they can still be served (flagged as stale) when the agent
+    cannot be reached.
+
+    """
+
+    def __init__(self, ttl: float, heartbeat_timeout: float):
+        self._ttl = ttl
+        self._heartbeat_timeout = heartbeat_timeout
+        self._entries: Dict[str, AgentState] = {}
+
+    def get(self, name: str) -> AgentState | None:
+        return self._entries.get(name)
+
+    def is_fresh(self, name: str) -> bool:
+        entry = self._entries.get(name)
+        if entry is None:
+            return False
+        ttl = self._heartbeat_timeout if entry.pushed else self._ttl
+        return time.monotonic() - entry.fetched_at < ttl
+
+    def next_expiry(self) -> float | None:
+        """The earliest time at which a fresh pushed entry misses its heartbeat."""
+        now = time.monotonic()
+        result = None
+        for entry in self._entries.values():
+            if not entry.pushed:
+                continue
+            expiry = entry.fetched_at + self._heartbeat_timeout
+            if expiry > now and (result is None or expiry < result):
+                result = expiry
+        return result
+
+    def update(self, name: str, status: AgentStatus, version: int | None = None):
+        self._entries[name] = AgentState(status, time.monotonic(), version)
+
+    def touch(self, name: str, version: int) -> bool:
+        """Record a heartbeat that carries no status.
+
+        Returns False if the cached status is not the one of this version, in
+        which case the agent should send its full status.
+
+        """
+        entry = self._entries.get(name)
+        if entry is None or entry.version != version:
+            return False
+        entry.fetched_at = time.monotonic()
+        return True
+
+    def invalidate(self, name: str):
+        entry = self._entries.get(name)
+        if entry is not None:
+            entry.fetched_at = float("-inf")
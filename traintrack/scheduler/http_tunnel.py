@@ -0,0 +1,229 @@
+import http.client
+import io
+import threading
+from typing import Dict, List, Tuple
+
+import paramiko
+from loguru import logger
+
+from traintrack.scheduler.ssh_pool import SSHConnectionPool
+from traintrack.schema.central_config import EndPointConfig
+
+
+class _ChannelIO(io.RawIOBase):
+    def __init__(self, channel: paramiko.Channel):
+        self._channel = channel
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self._channel.recv(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+
+class _ChannelSocket(object):
+    """A channel whose ``makefile`` supports ``read1``, which paramiko's own
+    file objects lack, so that responses can be read as they arrive."""
+
+    def __init__(self, channel: paramiko.Channel):
+        self.channel = channel
+
+    def makefile(self, mode: str = "rb", *args, **kwargs) -> io.BufferedReader:
+        return io.BufferedReader(_ChannelIO(self.channel))
+
+    def __getattr__(self, name: str):
+        return getattr(self.channel, name)
+
+
+class ChannelHTTPConnection(http.client.HTTPConnection):
+    """An HTTP/1.1 connection whose socket is a direct-tcpip SSH channel.
+
+    The channel is forwarded to ``localhost:{port}`` on the remote host, so the
+    agent's HTTP server is reached without spawning any process over there.
+    ``paramiko.Channel`` already provides ``sendall`` and ``close``, and the
+    channel is wrapped to provide a ``makefile`` that ``http.client`` can
+    read incrementally.
+
+    """
+
+    def __init__(self, transport: paramiko.Transport, port: int, timeout: float):
+        super().__init__("localhost", port, timeout=timeout)
+        self.transport = transport
+
+    def connect(self):
+        channel = self.transport.open_channel(
+            "direct-tcpip",
+            dest_addr=("localhost", self.port),
+            src_addr=("127.0.0.1", 0),
+            timeout=self.timeout,
+        )
+        channel.settimeout(self.timeout)
+        self.sock = _ChannelSocket(channel)
+
+    @property
+    def is_reusable(self) -> bool:
+        channel = self.sock
+        if channel is None:
+            # Not connected yet, will open a new channel on demand.
+            return self.transport.is_active()
+        # The server closes idle keep-alive connections on its side, which
+        # shows up as EOF on the channel.
+        return not (channel.closed or channel.eof_received)
+
+
+class TunnelStream(object):
+    """The body of a response from an agent, read as it arrives."""
+
+    def __init__(self, conn: ChannelHTTPConnection, response: http.client.HTTPResponse):
+        self._conn = conn
+        self._response = response
+
+    def header(self, name: str) -> str | None:
+        return self._response.getheader(name)
+
+    def read(self, size: int = 64 * 1024) -> bytes:
+        """The next chunk of at most ``size`` bytes, empty at the end."""
+        try:
+            return self._response.read1(size)
+        except (http.client.HTTPException, paramiko.SSHException, OSError, EOFError):
+            return b""
+
+    def close(self):
+        """Stop reading, can be called from another thread."""
+        self._conn.close()
+
+
+class TunnelHTTPClient(object):
+    """Sends HTTP requests to agents over channels of the pooled SSH transports.
+
+    Idle keep-alive connections are kept per end point and reused, so many
+    requests share one forwarded stream. Concurrent requests to the same agent
+    each get their own channel on the same transport.
+
+    """
+
+    def __init__(self, ssh_pool: SSHConnectionPool, timeout: float = 30.0):
+        self._ssh_pool = ssh_pool
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        self._idle: Dict[str, List[ChannelHTTPConnection]] = {}
+
+    def _checkout(
+        self, end_point: EndPointConfig
+    ) -> Tuple[ChannelHTTPConnection | None, bool]:
+        ssh = self._ssh_pool.get(end_point)
+        if ssh is None:
+            return None, False
+        transport = ssh.get_transport()
+        if transport is None:
+            return None, False
+
+        with self._lock:
+            idle = self._idle.get(end_point.name, [])
+            while len(idle) > 0:
+                conn = idle.pop()
+                if conn.transport is transport and conn.is_reusable:
+                    return conn, True
+                conn.close()
+        return ChannelHTTPConnection(transport, end_point.port, self._timeout), False
+
+    def _checkin(self, end_point: EndPointConfig, conn: ChannelHTTPConnection):
+        with self._lock:
+            self._idle.setdefault(end_point.name, []).append(conn)
+
+    def request(
+        self,
+        end_point: EndPointConfig,
+        method: str,
+        api: str,
+        body: str | None = None,
+        idempotent: bool = False,
+    ) -> str | None:
+        """Returns the body of the response, None on failure.
+
+        Set ``idempotent`` for requests that the server can safely receive
+        twice, e.g. POSTs that carry idempotency keys.
+
+        """
+        headers = {}
+        payload = None
+        if body is not None:
+            payload = body.encode("utf-8")
+            headers["Content-Type"] = "application/json"
+
+        while True:
+            conn, reused = self._checkout(end_point)
+            if conn is None:
+                return None
+            try:
+                conn.request(method, f"/{api}", body=payload, headers=headers)
+                response = conn.getresponse()
+                data = response.read()
+            except (
+                http.client.HTTPException,
+                paramiko.SSHException,
+                OSError,
+                EOFError,
+            ) as e:
+                conn.close()
+                # A kept-alive stream may have been closed by the server right
+                # before being reused. Only GET and idempotent requests are
+                # safe to replay.
+                if reused and (method == "GET" or idempotent):
+                    continue
+                logger.warning(f"{method} /{api} on {end_point.name} failed: {e}")
+                return None
+
+            if response.will_close:
+                conn.close()
+            else:
+                self._checkin(end_point, conn)
+
+            if response.status != 200:
+                logger.warning(
+                    f"{method} /{api} on {end_point.name} returned "
+                    f"{response.status}: {data.decode('utf-8', errors='replace')}"
+                )
+                return None
+            return data.decode("utf-8")
+
+    def stream(self, end_point: EndPointConfig, api: str) -> TunnelStream | None:
+        """GET the api and return the body as a stream.
+
+        Streams may stay open for as long as the agent keeps sending, so each
+        one gets its own channel without a read timeout, and it is never
+        returned to the pool of idle connections.
+
+        """
+        ssh = self._ssh_pool.get(end_point)
+        transport = None if ssh is None else ssh.get_transport()
+        if transport is None:
+            return None
+        conn = ChannelHTTPConnection(transport, end_point.port, self._timeout)
+        try:
+            conn.request("GET", f"/{api}")
+            response = conn.getresponse()
+        except (
+            http.client.HTTPException,
+            paramiko.SSHException,
+            OSError,
+            EOFError,
+        ) as e:
+            conn.close()
+            logger.warning(f"GET /{api} on {end_point.name} failed: {e}")
+            return None
+        if response.status != 200:
+            conn.close()
+            logger.warning(f"GET /{api} on {end_point.name} returned {response.status}")
+            return None
+        conn.sock.settimeout(None)
+        return TunnelStream(conn, response)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
@@ -0,0 +1,92 @@
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Set
+
+from traintrack.schema.job import CentralJobState, QueuedJob
+
+
+class JobIndex(object):
+    """The jobs that have left the queue, indexed by state and by agent.
+
+    Lookups by state, by agent or by both only touch the matching jobs. The
+    finished jobs are kept as history, up to ``max_finished`` of them, and the
+    ones that finished first are dropped first.
+
+    Not thread safe, the caller is responsible for locking.
+
+    """
+
+    def __init__(self, max_finished: int):
+        self._jobs: Dict[str, QueuedJob] = {}
+        self._by_state: Dict[CentralJobState, Set[str]] = {}
+        self._by_agent: Dict[str, Set[str]] = {}
+        self._finished: OrderedDict[str, None] = OrderedDict()
+        self._max_finished = max_finished
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    def __contains__(self, job_id: str) -> bool:
+        return job_id in self._jobs
+
+    def get(self, job_id: str) -> QueuedJob | None:
+        return self._jobs.get(job_id)
+
+    def put(self, job: QueuedJob) -> List[str]:
+        """Add or update the job. Returns the ids of the finished jobs that
+        are dropped from the history to make room."""
+        self.remove(job.id)
+        self._jobs[job.id] = job
+        self._by_state.setdefault(job.state, set()).add(job.id)
+        if job.agent is not None:
+            self._by_agent.setdefault(job.agent, set()).add(job.id)
+        if not job.state.finished:
+            return []
+        self._finished[job.id] = None
+        dropped = []
+        while len(self._finished) > self._max_finished:
+            job_id, _ = self._finished.popitem(last=False)
+            self.remove(job_id)
+            dropped.append(job_id)
+        return dropped
+
+    def remove(self, job_id: str) -> QueuedJob | None:
+        job = self._jobs.pop(job_id, None)
+        if job is None:
+            return None
+        self._discard(self._by_state, job.state, job_id)
+        if job.agent is not None:
+            self._discard(self._by_agent, job.agent, job_id)
+        self._finished.pop(job_id, None)
+        return job
+
+    @staticmethod
+    def _discard(index: Dict, key, job_id: str):
+        ids = index[key]
+        ids.discard(job_id)
+        if len(ids) == 0:
+            del index[key]
+
+    def find(
+        self,
+        states: Iterable[CentralJobState] | None = None,
+        agent: str | None = None,
+    ) -> Iterable[QueuedJob]:
+        """The jobs in any of the states (all if None) on the agent (any if
+        None)."""
+        if states is None and agent is None:
+            return self._jobs.values()
+        if states is None:
+            ids = self._by_agent.get(agent, set())
+        else:
+            ids = set().union(*[self._by_state.get(s, set()) for s in states])
+            if agent is not None:
+                ids &= self._by_agent.get(agent, set())
+        return [self._jobs[job_id] for job_id in ids]
+
+    def live(self) -> List[QueuedJob]:
+        """The jobs that are on an agent and not finished."""
+        return list(self.find([s for s in CentralJobState if _is_live(s)]))
+
+
+def _is_live(state: CentralJobState) -> bool:
+    return state != CentralJobState.QUEUED and not state.finished
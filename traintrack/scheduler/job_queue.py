@@ -0,0 +1,210 @@
+import heapq
+import itertools
+import math
+from typing import Dict, Hashable, Iterable, List, Set, Tuple
+
+from traintrack.scheduler.policy import SchedulingPolicy
+from traintrack.schema.job import JobRequest, QueuedJob
+
+
+def constraint_key(request: JobRequest, avoided: Iterable[str] = ()) -> Hashable:
+    """Jobs with the same key can run on exactly the same set of workers."""
+    return (
+        frozenset(request.agent_blacklist),
+        frozenset(avoided),
+        frozenset(request.gpu_types),
+        request.min_gpu_memory,
+        request.num_gpus,
+    )
+
+
+class _Entry(object):
+    __slots__ = ("sort_key", "job", "alive")
+
+    def __init__(self, job: QueuedJob, tie: int):
+        self.sort_key = (-job.request.priority, job.enqueued_at, tie)
+        self.job = job
+        self.alive = True
+
+    def __lt__(self, other: "_Entry") -> bool:
+        return self.sort_key < other.sort_key
+
+
+class JobQueue(object):
+    """Priority queue of jobs, FIFO within the same priority.
+
+    Jobs are kept in one heap per constraint class (see ``constraint_key``)
+    and account of the scheduling policy, so that the scheduler can give up on
+    a whole class at once when there is no capacity left for it, and the
+    policy only has to rank the head of each heap. Removal is lazy: cancelled
+    entries are marked dead and dropped when they reach the top of their heap,
+    which makes insert, cancel and reprioritize O(log n).
+
+    Not thread safe, the caller is responsible for locking.
+
+    """
+
+    def __init__(self, policy: SchedulingPolicy | None = None):
+        self._policy = policy or SchedulingPolicy()
+        self._tie = itertools.count()
+        self._entries: Dict[str, _Entry] = {}
+        self._lanes: Dict[Hashable, List[_Entry]] = {}
+        self._dead: Dict[Hashable, int] = {}
+        # project -> group -> job ids
+        self._by_group: Dict[str, Dict[str, Set[str]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, job_id: str) -> bool:
+        return job_id in self._entries
+
+    def push(self, job: QueuedJob):
+        if job.id in self._entries:
+            raise KeyError(f"Job {job.id} is already in the queue.")
+        entry = _Entry(job, next(self._tie))
+        self._entries[job.id] = entry
+        lane = self._lane(job)
+        heapq.heappush(self._lanes.setdefault(lane, []), entry)
+        self._by_group.setdefault(job.request.job.project, {}).setdefault(
+            job.request.job.group, set()
+        ).add(job.id)
+
+    def get(self, job_id: str) -> QueuedJob | None:
+        entry = self._entries.get(job_id)
+        return None if entry is None else entry.job
+
+    def remove(self, job_id: str) -> QueuedJob | None:
+        entry = self._entries.pop(job_id, None)
+        if entry is None:
+            return None
+        entry.alive = False
+        job = entry.job
+
+        desc = job.request.job
+        groups = self._by_group[desc.project]
+        groups[desc.group].discard(job_id)
+        if len(groups[desc.group]) == 0:
+            del groups[desc.group]
+            if len(groups) == 0:
+                del self._by_group[desc.project]
+
+        lane = self._lane(job)
+        self._dead[lane] = self._dead.get(lane, 0) + 1
+        heap = self._lanes[lane]
+        if self._dead[lane] * 2 > len(heap):
+            # Too many dead entries, compact the heap.
+            heap = [e for e in heap if e.alive]
+            heapq.heapify(heap)
+            self._dead[lane] = 0
+            if len(heap) == 0:
+                del self._lanes[lane]
+                del self._dead[lane]
+            else:
+                self._lanes[lane] = heap
+        return job
+
+    def reprioritize(self, job_id: str, priority: int) -> QueuedJob | None:
+        job = self.remove(job_id)
+        if job is None:
+            return None
+        # Keep enqueued_at so that the job keeps its FIFO position among the
+        # jobs of its new priority.
+        request = job.request.copy(update={"priority": priority})
+        job = job.copy(update={"request": request})
+        self.push(job)
+        return job
+
+    def _lane(self, job: QueuedJob) -> Tuple[Hashable, Hashable]:
+        return constraint_key(job.request, job.avoided_agents), self._policy.account(
+            job
+        )
+
+    def head(self, lane: Hashable) -> QueuedJob | None:
+        heap = self._lanes.get(lane)
+        if heap is None:
+            return None
+        while len(heap) > 0 and not heap[0].alive:
+            heapq.heappop(heap)
+            self._dead[lane] -= 1
+        if len(heap) == 0:
+            del self._lanes[lane]
+            self._dead.pop(lane, None)
+            return None
+        return heap[0].job
+
+    def lanes(self) -> List[Hashable]:
+        return list(self._lanes.keys())
+
+    def next_job(self, exclude: Iterable[Hashable] = ()) -> QueuedJob | None:
+        """The next job to serve whose constraint class is not excluded.
+
+        That is the highest priority job of the account that the policy ranks
+        first. This costs O(number of constraint classes x accounts),
+        independent of the number of queued jobs.
+
+        """
+        excluded = set(exclude)
+        best: Tuple | None = None
+        result = None
+        for lane in self.lanes():
+            if lane[0] in excluded:
+                continue
+            job = self.head(lane)
+            if job is None:
+                continue
+            rank = self._policy.rank(job)
+            if rank is None:
+                # The account is over its quota
+                continue
+            key = (rank, self._entries[job.id].sort_key)
+            if best is None or key < best:
+                best = key
+                result = job
+        return result
+
+    def top(self, k: int) -> List[QueuedJob]:
+        """The next k jobs in scheduling order, as ranked by the policy now.
+
+        The lanes are merged by the rank of their account, each one walked in
+        order from the root of its heap, so this costs O((lanes + k) log(lanes
+        + k)) instead of a scan of the queue. Accounts over their quota come
+        last.
+
+        """
+        # (rank, sort key, position in the heap, heap)
+        frontier = []
+        for lane in self.lanes():
+            job = self.head(lane)
+            if job is None:
+                continue
+            rank = self._policy.rank(job)
+            rank = math.inf if rank is None else rank
+            heap = self._lanes[lane]
+            frontier.append((rank, heap[0].sort_key, 0, heap))
+        heapq.heapify(frontier)
+        result = []
+        while len(frontier) > 0 and len(result) < k:
+            rank, _, i, heap = heapq.heappop(frontier)
+            if heap[i].alive:
+                result.append(heap[i].job)
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < len(heap):
+                    heapq.heappush(frontier, (rank, heap[child].sort_key, child, heap))
+        return result
+
+    def find(
+        self, project: str | None = None, group: str | None = None
+    ) -> Iterable[QueuedJob]:
+        """The jobs of the project and group (all when None), in no order."""
+        if project is None:
+            ids = self._entries.keys()
+        else:
+            ids = self._group_ids(project, group)
+        return (self._entries[i].job for i in ids)
+
+    def _group_ids(self, project: str, group: str | None) -> Set[str]:
+        groups = self._by_group.get(project, {})
+        if group is not None:
+            return groups.get(group, set())
+        return set().union(*groups.values())
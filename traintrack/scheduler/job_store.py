@@ -0,0 +1,203 @@
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from loguru import logger
+
+from traintrack.schema.job import CentralJobState, QueuedJob
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    job TEXT NOT NULL,
+    state TEXT NOT NULL,
+    agent TEXT
+);
+CREATE TABLE IF NOT EXISTS blacklist (
+    agent TEXT PRIMARY KEY,
+    disabled INTEGER NOT NULL
+);
+"""
+
+
+class FencedError(Exception):
+    """Raised for writes made without holding the lease they are fenced by."""
+
+    pass
+
+
+class StoredJob(object):
+    def __init__(self, job: QueuedJob, state: CentralJobState, agent: str | None):
+        self.job = job
+        self.state = state
+        self.agent = agent
+
+
+class JobStore(object):
+    """Durable record of central's jobs and agent blacklist in SQLite.
+
+    Besides the live jobs, only a bounded history of finished jobs is kept, so
+    loading the store on startup takes time proportional to the jobs that
+    central holds in memory anyway. The database runs in WAL mode and all the
+    writes go through a single writer thread, which commits everything that is
+    pending in one transaction (group commit). Writes are applied in the order
+    they are made, and each returns a future that is resolved once it is
+    durable.
+
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        if path != ":memory:":
+            self._path = str(Path(path).expanduser())
+            Path(self._path).parent.mkdir(parents=True, exist_ok=True)
+        self._pending: queue.Queue = queue.Queue()
+        # (holder, term) of the leader lease that writes are conditional on
+        self._fence: Tuple[str, int] | None = None
+        self._writer = threading.Thread(
+            target=self._write_loop, name="traintrack_store", daemon=True
+        )
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self._path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        return conn
+
+    def fence(self, holder: str, term: int):
+        """Only write while the lease (see ``LeaderLease``) in the same
+        database is held by the holder for the term.
+
+        The lease is checked in the transaction of each write, so a leader
+        that has been replaced cannot overwrite what the new one writes.
+
+        """
+        self._fence = (holder, term)
+
+    def _check_fence(self, conn: sqlite3.Connection):
+        if self._fence is None:
+            return
+        row = conn.execute(
+            "SELECT 1 FROM lease WHERE holder = ? AND term = ? AND expires_at > ?",
+            (*self._fence, time.time()),
+        ).fetchone()
+        if row is None:
+            raise FencedError(f"The lease of term {self._fence[1]} is lost.")
+
+    def load(self, max_finished: int) -> Tuple[List[StoredJob], Dict[str, bool]]:
+        """The jobs, and whether each agent was disabled or enabled.
+
+        Only the ``max_finished`` most recently written finished jobs are
+        loaded, the older ones are deleted.
+
+        """
+        finished = [s.value for s in CentralJobState if s.finished]
+        marks = ", ".join("?" for _ in finished)
+        conn = self._connect()
+        try:
+            with conn:
+                # A replaced row gets a new rowid, so the most recently
+                # written rows have the largest ones.
+                conn.execute(
+                    f"DELETE FROM jobs WHERE state IN ({marks}) AND rowid NOT IN "
+                    f"(SELECT rowid FROM jobs WHERE state IN ({marks}) "
+                    "ORDER BY rowid DESC LIMIT ?)",
+                    (*finished, *finished, max_finished),
+                )
+            jobs = [
+                StoredJob(QueuedJob.parse_raw(job), CentralJobState(state), agent)
+                for job, state, agent in conn.execute(
+                    "SELECT job, state, agent FROM jobs ORDER BY rowid"
+                )
+            ]
+            blacklist = {
+                agent: bool(disabled)
+                for agent, disabled in conn.execute(
+                    "SELECT agent, disabled FROM blacklist"
+                )
+            }
+        finally:
+            conn.close()
+        return jobs, blacklist
+
+    def _write(self, sql: str, params: List[Tuple]) -> Future:
+        """Queue a statement, executed once for each set of parameters."""
+        future = Future()
+        self._pending.put((sql, params, future))
+        return future
+
+    def _write_loop(self):
+        conn = self._connect()
+        # Transactions are managed by hand
+        conn.isolation_level = None
+        while True:
+            op = self._pending.get()
+            if op is None:
+                break
+            batch = [op]
+            stop = False
+            while True:
+                try:
+                    op = self._pending.get_nowait()
+                except queue.Empty:
+                    break
+                if op is None:
+                    stop = True
+                    break
+                batch.append(op)
+            try:
+                # Takes the write lock first, so that the lease cannot change
+                # hands between the check and the writes.
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    self._check_fence(conn)
+                    for sql, params, _ in batch:
+                        conn.executemany(sql, params)
+                    conn.execute("COMMIT")
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
+            except (sqlite3.Error, FencedError) as e:
+                logger.error(f"Failed to write {len(batch)} updates to the store: {e}")
+                for _, _, future in batch:
+                    future.set_exception(e)
+            else:
+                for _, _, future in batch:
+                    future.set_result(None)
+            if stop:
+                break
+        conn.close()
+
+    def put(
+        self, job: QueuedJob, state: CentralJobState, agent: str | None = None
+    ) -> Future:
+        return self.put_many([job], state, agent)
+
+    def put_many(
+        self, jobs: List[QueuedJob], state: CentralJobState, agent: str | None = None
+    ) -> Future:
+        """Write the jobs atomically, all of them or none."""
+        return self._write(
+            "INSERT OR REPLACE INTO jobs (id, job, state, agent) VALUES (?, ?, ?, ?)",
+            [(job.id, job.json(), state.value, agent) for job in jobs],
+        )
+
+    def delete(self, job_id: str) -> Future:
+        return self._write("DELETE FROM jobs WHERE id = ?", [(job_id,)])
+
+    def set_disabled(self, agent_name: str, disabled: bool) -> Future:
+        return self._write(
+            "INSERT OR REPLACE INTO blacklist (agent, disabled) VALUES (?, ?)",
+            [(agent_name, int(disabled))],
+        )
+
+    def close(self):
+        """Flush the pending writes and stop the writer."""
+        self._pending.put(None)
+        self._writer.join()
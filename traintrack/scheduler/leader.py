@@ -0,0 +1,115 @@
+import sqlite3
+import time
+from pathlib import Path
+from typing import Tuple
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS lease (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    holder TEXT NOT NULL,
+    url TEXT,
+    term INTEGER NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+class LeaderLease(object):
+    """Leader election among the central instances that share a job store.
+
+    The lease is a single row in the store's SQLite database, taken and
+    renewed in write transactions, so at most one instance holds it at a time.
+    It lasts ``ttl`` seconds from each renewal. Another instance can only take
+    it once it has expired, e.g. when the leader died or is cut off from the
+    store. The term is bumped whenever the lease changes hands.
+
+    The holder considers its lease lost slightly before the others consider it
+    expired, as it counts from before its renewal was written.
+
+    """
+
+    def __init__(self, path: str, holder: str, url: str | None, ttl: float):
+        self._path = path
+        if path != ":memory:":
+            self._path = str(Path(path).expanduser())
+            Path(self._path).parent.mkdir(parents=True, exist_ok=True)
+        self._holder = holder
+        self._url = url
+        self._ttl = ttl
+        # Monotonic time until which the lease is known to be held
+        self._valid_until = 0.0
+        self._term = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        # Transactions are managed by hand
+        conn = sqlite3.connect(self._path, timeout=self._ttl, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        return conn
+
+    @property
+    def held(self) -> bool:
+        return time.monotonic() < self._valid_until
+
+    @property
+    def holder(self) -> str:
+        return self._holder
+
+    @property
+    def term(self) -> int:
+        return self._term
+
+    def acquire(self) -> bool:
+        """Take the lease if it is free, or renew it if it is ours. Returns
+        whether it is held."""
+        started = time.monotonic()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT holder, term, expires_at FROM lease").fetchone()
+            now = time.time()
+            if row is not None and row[0] != self._holder and row[2] > now:
+                conn.execute("ROLLBACK")
+                self._valid_until = 0.0
+                return False
+            if row is not None and row[0] == self._holder and self.held:
+                term = row[1]
+            else:
+                term = 1 if row is None else row[1] + 1
+            conn.execute(
+                "INSERT OR REPLACE INTO lease (id, holder, url, term, expires_at) "
+                "VALUES (0, ?, ?, ?, ?)",
+                (self._holder, self._url, term, now + self._ttl),
+            )
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        self._term = term
+        self._valid_until = started + self._ttl
+        return True
+
+    def leader(self) -> Tuple[str, str | None] | None:
+        """The holder of the lease and its URL, None if nobody holds it."""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT holder, url, expires_at FROM lease").fetchone()
+        finally:
+            conn.close()
+        if row is None or row[2] <= time.time():
+            return None
+        return row[0], row[1]
+
+    def release(self):
+        """Give up the lease, if held, for a standby to take over right away."""
+        if not self.held:
+            return
+        self._valid_until = 0.0
+        conn = self._connect()
+        try:
+            # Expired rather than deleted, so that terms keep increasing
+            conn.execute(
+                "UPDATE lease SET expires_at = 0 WHERE holder = ?", (self._holder,)
+            )
+        finally:
+            conn.close()
@@ -0,0 +1,206 @@
+import asyncio
+import threading
+from typing import AsyncIterator, Dict, Set, Tuple
+
+from traintrack.scheduler.http_tunnel import TunnelHTTPClient, TunnelStream
+from traintrack.schema.central_config import EndPointConfig
+
+
+# Bytes of the recent output of each followed log kept for late followers
+_TAIL_BYTES = 1024 * 1024
+# Chunks a follower can fall behind before it is dropped
+_MAX_BACKLOG = 256
+
+
+# (logical offset, bytes), or None at the end of the stream
+_Chunk = Tuple[int, bytes] | None
+
+
+class _Upstream(object):
+    def __init__(self, stream: TunnelStream, offset: int):
+        self.stream = stream
+        # Logical offset of the first byte of the buffer
+        self.start = offset
+        self.buffer = bytearray()
+        self.followers: Set[asyncio.Queue] = set()
+        self.done = False
+
+    @property
+    def end(self) -> int:
+        return self.start + len(self.buffer)
+
+
+class LogHub(object):
+    """Serves the logs of the jobs from their agents.
+
+    However many clients follow the log of a job, central keeps a single
+    stream from the agent and fans out what it receives. The last bytes of
+    each followed log are buffered, so that a client joining late catches up
+    from memory; only what is older than that is read again from the agent.
+    The stream to the agent is closed when its last follower leaves.
+
+    """
+
+    def __init__(self, http: TunnelHTTPClient):
+        self._http = http
+        self._lock = asyncio.Lock()
+        # job id -> its followed log
+        self._upstreams: Dict[str, _Upstream] = {}
+
+    @staticmethod
+    def _api(job_id: str, offset: int, length: int | None, follow: bool) -> str:
+        api = f"jobs/{job_id}/log?offset={offset}&follow={str(follow).lower()}"
+        if length is not None:
+            api += f"&length={length}"
+        return api
+
+    async def read(
+        self,
+        end_point: EndPointConfig,
+        job_id: str,
+        offset: int,
+        length: int | None = None,
+    ) -> Tuple[int, AsyncIterator[bytes]] | None:
+        """The bytes of the log from the offset, up to what is written.
+
+        Returns the actual offset of the first byte and the bytes, or None if
+        the log cannot be read from the agent.
+
+        """
+        stream = await asyncio.to_thread(
+            self._http.stream, end_point, self._api(job_id, offset, length, False)
+        )
+        if stream is None:
+            return None
+        return int(stream.header("X-Log-Offset") or 0), self._drain(stream)
+
+    @staticmethod
+    async def _drain(stream: TunnelStream) -> AsyncIterator[bytes]:
+        try:
+            while True:
+                data = await asyncio.to_thread(stream.read)
+                if len(data) == 0:
+                    break
+                yield data
+        finally:
+            stream.close()
+
+    async def follow(
+        self, end_point: EndPointConfig, job_id: str, offset: int
+    ) -> Tuple[int, AsyncIterator[bytes]] | None:
+        """Like ``read``, but keeps going until the job finishes."""
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            upstream = self._upstreams.get(job_id)
+            if upstream is None:
+                stream = await asyncio.to_thread(
+                    self._http.stream, end_point, self._api(job_id, offset, None, True)
+                )
+                if stream is None:
+                    return None
+                upstream = _Upstream(stream, int(stream.header("X-Log-Offset") or 0))
+                self._upstreams[job_id] = upstream
+                threading.Thread(
+                    target=self._pump,
+                    args=(loop, job_id, upstream),
+                    name="traintrack_log",
+                    daemon=True,
+                ).start()
+                offset = upstream.start
+            elif offset < 0:
+                offset = max(0, upstream.end + offset)
+
+        # Joining is atomic with respect to the chunks delivered on the loop,
+        # so the follower gets every byte after the buffered ones exactly once.
+        queue: asyncio.Queue = asyncio.Queue(maxsize=_MAX_BACKLOG)
+        backlog = (upstream.start, bytes(upstream.buffer))
+        gap = (offset, upstream.start) if offset < upstream.start else None
+        upstream.followers.add(queue)
+        return offset, self._follow(
+            end_point, job_id, upstream, queue, offset, backlog, gap
+        )
+
+    async def _follow(
+        self,
+        end_point: EndPointConfig,
+        job_id: str,
+        upstream: _Upstream,
+        queue: asyncio.Queue,
+        offset: int,
+        backlog: Tuple[int, bytes],
+        gap: Tuple[int, int] | None,
+    ) -> AsyncIterator[bytes]:
+        try:
+            position = max(offset, backlog[0])
+            if gap is not None:
+                # Older than what is buffered, read it again from the agent.
+                result = await self.read(end_point, job_id, gap[0], gap[1] - gap[0])
+                if result is not None:
+                    async for data in result[1]:
+                        yield data
+            chunk: _Chunk = backlog
+            while chunk is not None:
+                offset, data = chunk
+                skip = max(0, position - offset)
+                if skip < len(data):
+                    yield data[skip:]
+                    position = offset + len(data)
+                chunk = await queue.get()
+        finally:
+            self._leave(job_id, upstream, queue)
+
+    def _pump(self, loop: asyncio.AbstractEventLoop, job_id: str, upstream: _Upstream):
+        """Read the stream from the agent, runs on its own thread."""
+        while True:
+            data = upstream.stream.read()
+            if len(data) == 0:
+                break
+            loop.call_soon_threadsafe(self._deliver, upstream, data)
+        upstream.stream.close()
+        loop.call_soon_threadsafe(self._finish, job_id, upstream)
+
+    def _deliver(self, upstream: _Upstream, data: bytes):
+        chunk = (upstream.end, data)
+        upstream.buffer += data
+        if len(upstream.buffer) > _TAIL_BYTES:
+            trimmed = len(upstream.buffer) - _TAIL_BYTES
+            del upstream.buffer[:trimmed]
+            upstream.start += trimmed
+        for queue in list(upstream.followers):
+            try:
+                queue.put_nowait(chunk)
+            except asyncio.QueueFull:
+                # Too slow to keep up, end its stream. The client can
+                # reconnect from the offset it got to.
+                upstream.followers.discard(queue)
+                _end(queue)
+
+    def _finish(self, job_id: str, upstream: _Upstream):
+        upstream.done = True
+        if self._upstreams.get(job_id) is upstream:
+            del self._upstreams[job_id]
+        for queue in upstream.followers:
+            try:
+                queue.put_nowait(None)
+            except asyncio.QueueFull:
+                _end(queue)
+        upstream.followers.clear()
+
+    def _leave(self, job_id: str, upstream: _Upstream, queue: asyncio.Queue):
+        upstream.followers.discard(queue)
+        if len(upstream.followers) == 0 and not upstream.done:
+            upstream.done = True
+            if self._upstreams.get(job_id) is upstream:
+                del self._upstreams[job_id]
+            upstream.stream.close()
+
+    def close(self):
+        for upstream in list(self._upstreams.values()):
+            upstream.stream.close()
+
+
+def _end(queue: asyncio.Queue):
+    """Drop what the follower has not read yet and end its stream."""
+    while not queue.empty():
+        queue.get_nowait()
+    queue.put_nowait(None)
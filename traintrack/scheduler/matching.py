@@ -0,0 +1,222 @@
+from typing import Dict, List, Tuple
+
+from traintrack.schema.job import JobRequest
+from traintrack.schema.status import AgentStatus, WorkerStatus
+
+
+# Workers with the same GPU type and memory are interchangeable for placement.
+ResourceClass = Tuple[str, int | None]
+
+
+def resource_class(worker: WorkerStatus) -> ResourceClass:
+    return (worker.gpu_type, worker.gpu_memory)
+
+
+def satisfies(rc: ResourceClass, request: JobRequest) -> bool:
+    gpu_type, gpu_memory = rc
+    if len(request.gpu_types) > 0 and gpu_type not in request.gpu_types:
+        return False
+    if request.min_gpu_memory is not None:
+        if gpu_memory is None or gpu_memory < request.min_gpu_memory:
+            return False
+    return True
+
+
+class CapacityTable(object):
+    """Exact free worker slots, indexed by resource class and agent.
+
+    Built from the agents' status at the beginning of a scheduling pass, and
+    updated in memory as jobs are assigned, so that jobs without a feasible
+    slot are skipped without any network I/O. Finding a slot for a job looks
+    up the few resource classes that satisfy it instead of scanning workers.
+
+    Workers held back for a blocked multi-GPU job can still be used by jobs
+    that are expected to finish before the blocked job could start, given
+    when the running jobs are expected to free their workers (EASY backfill).
+
+    """
+
+    def __init__(self):
+        # resource class -> agent name -> ids of the free workers. Agents
+        # without free workers of a class are removed from its dict.
+        self._free: Dict[ResourceClass, Dict[str, List[int]]] = {}
+        self._free_by_agent: Dict[str, int] = {}
+        # (resource class, agent name) -> number of workers, busy or not
+        self._size: Dict[Tuple[ResourceClass, str], int] = {}
+        # (agent name, worker id) -> resource class of the worker
+        self._classes: Dict[Tuple[str, int], ResourceClass] = {}
+        # (resource class, agent name) -> when each busy worker is expected to
+        # be freed, None if unknown
+        self._releases: Dict[Tuple[ResourceClass, str], List[float | None]] = {}
+        # (resource class, agent name) -> when the blocked job they are held
+        # for is expected to start, and the ids of the held workers
+        self._held: Dict[Tuple[ResourceClass, str], Tuple[float, List[int]]] = {}
+
+    def add_agent(self, name: str, status: AgentStatus):
+        for w in status.workers:
+            key = (resource_class(w), name)
+            self._size[key] = self._size.get(key, 0) + 1
+            self._classes[(name, w.id)] = resource_class(w)
+            if not w.available:
+                continue
+            self._free.setdefault(resource_class(w), {}).setdefault(name, []).append(
+                w.id
+            )
+            self._free_by_agent[name] = self._free_by_agent.get(name, 0) + 1
+
+    def release_at(self, agent_name: str, worker_ids: List[int], when: float | None):
+        """Record when the busy workers are expected to be free (a timestamp),
+        None if unknown."""
+        for worker_id in worker_ids:
+            rc = self._classes.get((agent_name, worker_id))
+            if rc is not None:
+                self._releases.setdefault((rc, agent_name), []).append(when)
+
+    @property
+    def total(self) -> int:
+        return sum(self._free_by_agent.values())
+
+    @property
+    def held(self) -> int:
+        return sum(len(ids) for _, ids in self._held.values())
+
+    def free(self, agent_name: str) -> int:
+        return self._free_by_agent.get(agent_name, 0)
+
+    def find(self, request: JobRequest) -> Tuple[str, ResourceClass] | None:
+        """A feasible slot (agent and resource class) for the job.
+
+        All the GPUs of a job come from the same agent and resource class.
+        Preferred agents are picked first. Otherwise the agent with the fewest
+        free workers that still fits the job is picked (best fit), which keeps
+        larger holes open for multi-GPU jobs.
+
+        """
+        best = None
+        best_key = None
+        for rc, agents in self._free.items():
+            if not satisfies(rc, request):
+                continue
+            for agent_name, ids in agents.items():
+                if agent_name in request.agent_blacklist:
+                    continue
+                if len(ids) < request.num_gpus:
+                    continue
+                key = (
+                    agent_name not in request.preferred_agents,
+                    self._free_by_agent[agent_name],
+                )
+                if best_key is None or key < best_key:
+                    best = (agent_name, rc)
+                    best_key = key
+        return best
+
+    def take(self, agent_name: str, rc: ResourceClass, count: int = 1) -> List[int]:
+        """Reserve free workers of the class on the agent and return their ids."""
+        agents = self._free[rc]
+        ids = agents[agent_name]
+        if len(ids) < count:
+            raise KeyError(f"Agent {agent_name} does not have {count} free workers.")
+        taken, agents[agent_name] = ids[:count], ids[count:]
+        if len(agents[agent_name]) == 0:
+            del agents[agent_name]
+            if len(agents) == 0:
+                del self._free[rc]
+        self._free_by_agent[agent_name] -= count
+        return taken
+
+    def _give_back(self, agent_name: str, rc: ResourceClass, ids: List[int]):
+        self._free.setdefault(rc, {}).setdefault(agent_name, []).extend(ids)
+        self._free_by_agent[agent_name] += len(ids)
+
+    def reserve_for(self, request: JobRequest, now: float) -> str | None:
+        """Hold back capacity for a multi-GPU job that does not fit yet.
+
+        The agent that is closest to fitting the job (and large enough to ever
+        fit it) keeps its free workers of that class for the job. They are not
+        handed to smaller jobs, so the multi-GPU job is not starved by a
+        stream of single-GPU jobs. Returns the reserved agent, if any.
+
+        If the running jobs there are expected to free enough workers by some
+        time, the job is expected to start then, and the workers it will not
+        need are not held. The held ones can be backfilled until then.
+
+        """
+        best = None
+        best_free = -1
+        for (rc, agent_name), size in self._size.items():
+            if not satisfies(rc, request) or agent_name in request.agent_blacklist:
+                continue
+            if size < request.num_gpus:
+                continue
+            free = len(self._free.get(rc, {}).get(agent_name, []))
+            if free > best_free:
+                best = (agent_name, rc)
+                best_free = free
+        if best is None:
+            return None
+        agent_name, rc = best
+        if best_free > 0:
+            held = self.take(agent_name, rc, best_free)
+            key = (rc, agent_name)
+            needed = request.num_gpus - best_free
+            start = self._expected_start(key, needed)
+            if start is not None and key not in self._held:
+                start_time, freed = start
+                # Workers still free when the job starts
+                extra = min(len(held), freed - needed)
+                if extra > 0:
+                    self._give_back(agent_name, rc, held[-extra:])
+                    held = held[:-extra]
+                self._held[key] = (max(now, start_time), held)
+        return agent_name
+
+    def _expected_start(
+        self, key: Tuple[ResourceClass, str], needed: int
+    ) -> Tuple[float, int] | None:
+        """When the running jobs are expected to have freed ``needed`` workers
+        of the class on the agent, and how many they will have freed by then.
+        None if that cannot be told."""
+        known = sorted(t for t in self._releases.get(key, []) if t is not None)
+        if len(known) < needed:
+            return None
+        start_time = known[needed - 1]
+        return start_time, sum(1 for t in known if t <= start_time)
+
+    def backfill(
+        self, request: JobRequest, duration: float | None, now: float
+    ) -> Tuple[str, List[int]] | None:
+        """Take held workers for a job expected to run for ``duration``
+        seconds, if it is done before the job they are held for can start.
+        Returns the agent and the ids of the workers."""
+        if duration is None:
+            return None
+        for (rc, agent_name), (start_time, ids) in self._held.items():
+            if now + duration > start_time or len(ids) < request.num_gpus:
+                continue
+            if not satisfies(rc, request) or agent_name in request.agent_blacklist:
+                continue
+            taken = ids[: request.num_gpus]
+            del ids[: request.num_gpus]
+            return agent_name, taken
+        return None
+
+    def candidates(self, request: JobRequest) -> List[str]:
+        """Agents that could run the job once enough workers are free.
+
+        Preferred agents come first, then the agents with the most free
+        workers that satisfy the job, which are the most likely to run it.
+
+        """
+        free: Dict[str, int] = {}
+        for (rc, agent_name), size in self._size.items():
+            if not satisfies(rc, request) or agent_name in request.agent_blacklist:
+                continue
+            if size < request.num_gpus:
+                continue
+            count = len(self._free.get(rc, {}).get(agent_name, []))
+            free[agent_name] = max(free.get(agent_name, 0), count)
+        return sorted(
+            free.keys(),
+            key=lambda name: (name not in request.preferred_agents, -free[name]),
+        )
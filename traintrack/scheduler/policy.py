@@ -0,0 +1,129 @@
+import math
+import time
+from typing import Dict, Hashable, Iterable
+
+from traintrack.schema.central_config import CentralConfig, ShareConfig
+from traintrack.schema.job import QueuedJob
+
+
+class SchedulingPolicy(object):
+    """Decides which account is served first in a scheduling pass.
+
+    The queue keeps the jobs of each account apart, and serves them by
+    priority and then in order of arrival within an account. The policy ranks
+    the accounts against each other, given the job at the head of each.
+
+    The base policy has a single account, i.e. plain priority then FIFO.
+
+    """
+
+    def account(self, job: QueuedJob) -> Hashable:
+        return None
+
+    def rank(self, job: QueuedJob) -> float | None:
+        """Accounts with the lowest rank go first. None if the job's account
+        cannot take more GPUs for now."""
+        return 0.0
+
+    def refresh(self, live: Iterable[QueuedJob]):
+        """Called at the start of a pass with the jobs that hold GPUs."""
+        pass
+
+    def charge(self, job: QueuedJob):
+        """Called when a job is placed during a pass."""
+        pass
+
+
+class FifoPolicy(SchedulingPolicy):
+    pass
+
+
+class FairSharePolicy(SchedulingPolicy):
+    """Serves first the account that has used the least for its weight.
+
+    Accounts are projects, or (project, group) pairs. The usage of an account
+    is in GPU-hours, sampled at each pass from the GPUs its dispatched and
+    running jobs hold, and decays with a half-life so that old usage is
+    forgiven. The GPUs held right now also count, so that what frees up in a
+    pass is spread across the accounts instead of all going to the least used
+    one. Accounts can have a quota on the GPUs they hold at the same time.
+
+    Usage is kept in memory and starts over when central restarts.
+
+    """
+
+    def __init__(
+        self,
+        by_group: bool,
+        shares: Dict[str, ShareConfig],
+        default_share: ShareConfig,
+        half_life: float,
+        held_gpu_hours: float,
+    ):
+        self._by_group = by_group
+        self._shares = shares
+        self._default_share = default_share
+        # In seconds
+        self._half_life = half_life * 3600.0
+        self._held_gpu_hours = held_gpu_hours
+        # account -> decayed GPU-hours as of the last refresh
+        self._usage: Dict[str, float] = {}
+        # account -> GPUs held
+        self._held: Dict[str, int] = {}
+        self._last_refresh = time.monotonic()
+
+    def account(self, job: QueuedJob) -> str:
+        desc = job.request.job
+        if self._by_group:
+            return f"{desc.project}/{desc.group}"
+        return desc.project
+
+    def _share(self, account: str) -> ShareConfig:
+        return self._shares.get(account, self._default_share)
+
+    def rank(self, job: QueuedJob) -> float | None:
+        account = self.account(job)
+        share = self._share(account)
+        held = self._held.get(account, 0)
+        if share.max_gpus is not None and held + job.request.num_gpus > share.max_gpus:
+            return None
+        usage = self._usage.get(account, 0.0) + held * self._held_gpu_hours
+        return usage / share.weight
+
+    def refresh(self, live: Iterable[QueuedJob]):
+        now = time.monotonic()
+        elapsed = now - self._last_refresh
+        self._last_refresh = now
+        decay = 0.5 ** (elapsed / self._half_life)
+        # GPU-hours of what was held since the last refresh, decayed as it
+        # accrued: integral of 2^(-t / half_life) over the elapsed time.
+        accrued = (1.0 - decay) * self._half_life / math.log(2) / 3600.0
+        usage = {}
+        for account in self._usage.keys() | self._held.keys():
+            value = self._usage.get(account, 0.0) * decay
+            value += self._held.get(account, 0) * accrued
+            # Forget the accounts whose usage has decayed to nothing
+            if value > 1e-6:
+                usage[account] = value
+        self._usage = usage
+
+        self._held = {}
+        for job in live:
+            account = self.account(job)
+            self._held[account] = self._held.get(account, 0) + job.request.num_gpus
+
+    def charge(self, job: QueuedJob):
+        account = self.account(job)
+        self._held[account] = self._held.get(account, 0) + job.request.num_gpus
+
+
+def init_policy(config: CentralConfig) -> SchedulingPolicy:
+    if config.scheduling_policy == "fair_share":
+        return FairSharePolicy(
+            by_group=config.fair_share_by == "group",
+            shares=config.shares,
+            default_share=config.default_share,
+            half_life=config.usage_half_life,
+            held_gpu_hours=config.held_gpu_hours,
+        )
+    return FifoPolicy()
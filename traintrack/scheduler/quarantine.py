@@ -0,0 +1,56 @@
+import time
+from collections import deque
+from typing import Deque, Dict, List
+
+
+class Quarantine(object):
+    """Keeps flapping agents out of scheduling for a while.
+
+    Failures are counted per agent over a sliding window of ``window``
+    seconds. An agent that reaches ``max_failures`` of them is quarantined for
+    ``duration`` seconds, after which it starts over with a clean record.
+    ``max_failures`` of 0 disables the quarantine.
+
+    """
+
+    def __init__(self, max_failures: int, window: float, duration: float):
+        self._max_failures = max_failures
+        self._window = window
+        self._duration = duration
+        # agent -> when its recent failures happened
+        self._failures: Dict[str, Deque[float]] = {}
+        # agent -> when its quarantine ends
+        self._until: Dict[str, float] = {}
+
+    def __contains__(self, agent_name: str) -> bool:
+        return agent_name in self._until
+
+    def record_failure(self, agent_name: str) -> bool:
+        """Returns True if the agent has just been quarantined."""
+        if self._max_failures <= 0 or agent_name in self._until:
+            return False
+        now = time.monotonic()
+        failures = self._failures.setdefault(agent_name, deque())
+        failures.append(now)
+        while failures[0] < now - self._window:
+            failures.popleft()
+        if len(failures) < self._max_failures:
+            return False
+        del self._failures[agent_name]
+        self._until[agent_name] = now + self._duration
+        return True
+
+    def release(self, agent_name: str):
+        self._until.pop(agent_name, None)
+        self._failures.pop(agent_name, None)
+
+    def expire(self) -> List[str]:
+        """Release and return the agents whose quarantine is over."""
+        now = time.monotonic()
+        expired = [name for name, until in self._until.items() if until <= now]
+        for name in expired:
+            del self._until[name]
+        return expired
+
+    def next_expiry(self) -> float | None:
+        return min(self._until.values(), default=None)
@@ -0,0 +1,50 @@
+from collections import deque
+from typing import Deque, Dict, Hashable
+
+from traintrack.schema.job import CentralJobState, JobRequest, QueuedJob
+
+
+def runtime_key(request: JobRequest) -> Hashable:
+    """Jobs with the same key are expected to run for about as long."""
+    desc = request.job
+    return (desc.project, desc.group, desc.spec.config)
+
+
+class RuntimeEstimator(object):
+    """Expected run time of the jobs, learned from the ones that succeeded.
+
+    The run times of the last ``history`` jobs of each key (see
+    ``runtime_key``) are kept, and the estimate is their ``quantile``. A high
+    quantile errs on the long side, which is the safe side for backfilling.
+    The ``expected_duration`` of a job, when given, takes precedence.
+
+    Not thread safe, the caller is responsible for locking.
+
+    """
+
+    def __init__(self, history: int, quantile: float):
+        self._history = history
+        self._quantile = quantile
+        # key -> run times in seconds, the oldest first
+        self._samples: Dict[Hashable, Deque[float]] = {}
+
+    def observe(self, job: QueuedJob):
+        if job.state != CentralJobState.SUCCEEDED:
+            return
+        if job.started_at is None or job.finished_at is None:
+            return
+        duration = (job.finished_at - job.started_at).total_seconds()
+        samples = self._samples.setdefault(
+            runtime_key(job.request), deque(maxlen=self._history)
+        )
+        samples.append(max(0.0, duration))
+
+    def estimate(self, request: JobRequest) -> float | None:
+        """Seconds the job is expected to run, None if unknown."""
+        if request.expected_duration is not None:
+            return request.expected_duration
+        samples = self._samples.get(runtime_key(request))
+        if samples is None or len(samples) == 0:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(self._quantile * len(ordered)))]
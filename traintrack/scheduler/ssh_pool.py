@@ -0,0 +1,174 @@
+import os
+import time
+import threading
+from typing import Dict
+
+import paramiko
+from loguru import logger
+
+from traintrack.schema.central_config import EndPointConfig
+
+
+def connect_ssh(
+    end_point: EndPointConfig, timeout: float | None = None
+) -> paramiko.SSHClient | None:
+    """Connect to the end point, giving up on each of the TCP connect, the SSH
+    banner and the authentication after ``timeout`` seconds."""
+    ssh = paramiko.SSHClient()
+    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy)
+    proxy = None
+    if end_point.ssh_proxy is not None:
+        proxy = paramiko.ProxyCommand(
+            "ssh -o StrictHostKeyChecking=no "
+            f"{end_point.ssh_proxy} nc "
+            f"{end_point.ssh_uri} {end_point.ssh_proxy_port}"
+        )
+    try:
+        ssh.connect(
+            hostname=end_point.ssh_uri,
+            username=os.environ.get("USER"),
+            key_filename=end_point.ssh_key_file,
+            sock=proxy,
+            timeout=timeout,
+            banner_timeout=timeout,
+            auth_timeout=timeout,
+        )
+    except Exception as e:
+        logger.warning(f"SSH connection to {end_point.name} failed: {e}")
+        ssh.close()
+        return None
+    return ssh
+
+
+class _PooledConnection(object):
+    def __init__(self, client: paramiko.SSHClient):
+        self.client = client
+        self.last_used = time.monotonic()
+
+    @property
+    def transport(self) -> paramiko.Transport | None:
+        return self.client.get_transport()
+
+    def close(self):
+        self.client.close()
+
+
+class SSHConnectionPool(object):
+    """Keeps one live SSH transport per agent end point.
+
+    Channels (exec or direct-tcpip) are multiplexed over the pooled transport,
+    so the handshake is paid once per agent instead of once per request. Dead
+    transports are reconnected with exponential backoff, and transports that
+    have not been used for ``idle_timeout`` seconds are closed.
+
+    """
+
+    def __init__(
+        self,
+        keepalive_interval: int = 30,
+        idle_timeout: int = 600,
+        backoff: float = 1.0,
+        backoff_max: float = 60.0,
+        connect_timeout: float | None = None,
+    ):
+        self._keepalive_interval = keepalive_interval
+        self._idle_timeout = idle_timeout
+        self._backoff = backoff
+        self._backoff_max = backoff_max
+        self._connect_timeout = connect_timeout
+
+        self._lock = threading.Lock()
+        # Per end point locks so that a slow handshake to one agent does not
+        # block requests to the others.
+        self._end_point_locks: Dict[str, threading.Lock] = {}
+        self._connections: Dict[str, _PooledConnection] = {}
+        self._failures: Dict[str, int] = {}
+        self._retry_at: Dict[str, float] = {}
+
+    def _end_point_lock(self, name: str) -> threading.Lock:
+        with self._lock:
+            if name not in self._end_point_locks:
+                self._end_point_locks[name] = threading.Lock()
+            return self._end_point_locks[name]
+
+    def _is_healthy(self, conn: _PooledConnection) -> bool:
+        transport = conn.transport
+        if transport is None or not transport.is_active():
+            return False
+        # The keepalive packets only notice a dead peer when they are sent, so
+        # probe the transport explicitly if it has been idle for a while.
+        if time.monotonic() - conn.last_used > self._keepalive_interval:
+            try:
+                transport.send_ignore()
+            except Exception:
+                return False
+        return True
+
+    def _connect(self, end_point: EndPointConfig) -> _PooledConnection | None:
+        now = time.monotonic()
+        if now < self._retry_at.get(end_point.name, 0.0):
+            return None
+
+        client = connect_ssh(end_point, timeout=self._connect_timeout)
+        if client is None:
+            failures = self._failures.get(end_point.name, 0) + 1
+            delay = min(self._backoff_max, self._backoff * 2 ** (failures - 1))
+            self._failures[end_point.name] = failures
+            self._retry_at[end_point.name] = now + delay
+            logger.warning(f"Will not retry {end_point.name} in the next {delay}s.")
+            return None
+
+        self._failures.pop(end_point.name, None)
+        self._retry_at.pop(end_point.name, None)
+        transport = client.get_transport()
+        if transport is not None:
+            transport.set_keepalive(self._keepalive_interval)
+        logger.info(f"SSH connection to {end_point.name} established.")
+        return _PooledConnection(client)
+
+    def get(self, end_point: EndPointConfig) -> paramiko.SSHClient | None:
+        """Return a live SSH client for the end point, connecting if needed.
+
+        Returns None if the end point is unreachable or still in backoff.
+
+        """
+        self.evict_idle()
+        with self._end_point_lock(end_point.name):
+            with self._lock:
+                conn = self._connections.get(end_point.name)
+            if conn is not None and not self._is_healthy(conn):
+                logger.info(f"SSH connection to {end_point.name} is broken.")
+                self.invalidate(end_point.name)
+                conn = None
+            if conn is None:
+                conn = self._connect(end_point)
+                if conn is None:
+                    return None
+                with self._lock:
+                    self._connections[end_point.name] = conn
+            conn.last_used = time.monotonic()
+            return conn.client
+
+    def invalidate(self, name: str):
+        with self._lock:
+            conn = self._connections.pop(name, None)
+        if conn is not None:
+            conn.close()
+
+    def evict_idle(self):
+        now = time.monotonic()
+        with self._lock:
+            idle = [
+                name
+                for name, conn in self._connections.items()
+                if now - conn.last_used > self._idle_timeout
+            ]
+        for name in idle:
+            logger.info(f"Closing idle SSH connection to {name}.")
+            self.invalidate(name)
+
+    def close(self):
+        with self._lock:
+            names = list(self._connections.keys())
+        for name in names:
+            self.invalidate(name)
@@ -1,17 +1,47 @@
-from typing import Dict, List
+from typing import Dict, List, Literal
 from pydantic import BaseModel
 
 
 class RepoConfig(BaseModel):
     path: str
     work_dir: str
+    # Where jobs fetch the code from. Defaults to the origin of the checkout
+    # at ``path``.
+    url: str | None = None
 
 
 class WorkerConfig(BaseModel):
     gpu_id: int
     gpu_type: str
+    # In GB
+    gpu_memory: int | None = None
     repos: Dict[str, RepoConfig]
 
 
 class AgentConfig(BaseModel):
     workers: List[WorkerConfig]
+    # Name of this agent in central's configuration. Defaults to the hostname.
+    name: str | None = None
+    # When set, the agent pushes its status to central at this URL (e.g. through
+    # an SSH reverse tunnel) instead of waiting to be polled.
+    central_url: str | None = None
+    # Standby central instances, tried in turn when the one at central_url
+    # does not answer as the leader
+    standby_urls: List[str] = []
+    heartbeat_interval: float = 10.0
+    # How jobs are run: in the panes of a tmux session, or as child processes
+    # supervised by the agent.
+    runner: Literal["tmux", "process"] = "tmux"
+    # Where the agent keeps its state, e.g. job logs and pid files
+    state_dir: str = "~/.local/state/traintrack"
+    # Budget of the code and environments kept ready for jobs: the number of
+    # branches kept in the git mirrors, and of evaluated dev environments.
+    # The least recently used ones are evicted first.
+    max_cached_branches: int = 16
+    max_cached_envs: int = 16
+    # The log of a job is rotated once it grows over this many bytes, and at
+    # most twice as much is kept on disk.
+    max_log_bytes: int = 64 * 1024 * 1024
+    # Bytes kept for the logs of all the finished jobs together. The oldest
+    # logs are removed first.
+    max_finished_log_bytes: int = 1024 * 1024 * 1024
@@ -1,4 +1,4 @@
-from typing import List
+from typing import Dict, List, Literal
 from pydantic import BaseModel
 
 
@@ -13,7 +13,87 @@ class EndPointConfig(BaseModel):
     ssh_key_file: str
 
 
+class ShareConfig(BaseModel):
+    # Relative share of the GPUs under the fair share policy
+    weight: float = 1.0
+    # Most GPUs the jobs of the account can hold at the same time
+    max_gpus: int | None = None
+
+
 class CentralConfig(BaseModel):
     agents: List[EndPointConfig] = []
     default_blacklist: List[str] = []
     schedule_interval: int = 30
+    # Seconds for which a cached agent status is considered fresh
+    status_ttl: float = 10.0
+    # Agents that push heartbeats are marked stale after this many seconds of
+    # silence, and are polled again from then on.
+    heartbeat_timeout: float = 30.0
+    # How many blocked multi-GPU jobs can hold back free workers in a pass, so
+    # that they are not starved by single-GPU jobs.
+    max_gang_reservations: int = 1
+    # Run times are estimated from the last runtime_history jobs of the same
+    # project, group and config, at runtime_quantile. With an estimate, jobs
+    # can use the workers held for a blocked multi-GPU job as long as they
+    # are expected to finish before it can start (backfill).
+    runtime_history: int = 20
+    runtime_quantile: float = 0.9
+    # The code of the next queued jobs is prefetched ahead of time on the
+    # agents most likely to run them. This sets how many jobs to look ahead
+    # (0 to disable), how many agents to hint per job, and how many seconds to
+    # wait before repeating the same hint to an agent.
+    prefetch_top_k: int = 8
+    prefetch_agents: int = 2
+    prefetch_interval: float = 300.0
+    # "fifo" serves the jobs by priority, and then in order of arrival.
+    # "fair_share" serves first the account (the project, or the project and
+    # group with fair_share_by = "group") that has used the fewest decayed
+    # GPU-hours for its weight, and jobs by priority and arrival within it.
+    scheduling_policy: Literal["fifo", "fair_share"] = "fifo"
+    fair_share_by: Literal["project", "group"] = "project"
+    # Weights and quotas of the accounts by name ("project" or
+    # "project/group"), and of the accounts not listed
+    shares: Dict[str, ShareConfig] = {}
+    default_share: ShareConfig = ShareConfig()
+    # Hours after which usage only counts for half
+    usage_half_life: float = 24.0
+    # Each GPU held by an account counts for this many GPU-hours on top of
+    # its usage
+    held_gpu_hours: float = 1.0
+    # Where the queued and dispatched jobs and the blacklist are persisted, so
+    # that they survive a restart of central
+    job_store: str = "~/.local/state/traintrack/central.sqlite"
+    # Several central instances can share the job store, one of them leads
+    # and the others stand by. A standby takes over at most lease_ttl seconds
+    # after the leader is gone.
+    lease_ttl: float = 10.0
+    # Finished jobs kept for queries, the ones that finished first are
+    # forgotten first
+    max_finished_jobs: int = 10000
+    # Seconds between two checks of the dispatched jobs against the jobs that
+    # the agents actually have. Also done on startup.
+    reconcile_interval: float = 300.0
+    # An agent that has not been heard of for this many seconds is considered
+    # gone, and its jobs are requeued. Should be longer than
+    # reconcile_interval, which also checks on the agents.
+    agent_lost_timeout: float = 900.0
+    # Agents with quarantine_failures lost or crashed jobs within
+    # quarantine_window seconds are blacklisted for quarantine_duration
+    # seconds (0 failures to disable).
+    quarantine_failures: int = 3
+    quarantine_window: float = 600.0
+    quarantine_duration: float = 1800.0
+    # Jobs are run in two phases: their workers are reserved on the agent,
+    # then the jobs are sent. Reservations of jobs that are not sent expire
+    # after this many seconds.
+    reservation_ttl: float = 30.0
+    # Timeout in seconds for a single HTTP request to an agent
+    agent_timeout: float = 30.0
+    # Maximum number of agent requests in flight at the same time
+    max_concurrent_requests: int = 32
+
+    # Pooled SSH connections to the agents
+    ssh_keepalive_interval: int = 30
+    ssh_idle_timeout: int = 600
+    ssh_reconnect_backoff: float = 1.0
+    ssh_reconnect_backoff_max: float = 60.0
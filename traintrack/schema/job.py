@@ -1,3 +1,5 @@
+from datetime import datetime
+from enum import Enum
 from typing import Dict, List
 from pydantic import BaseModel
 
@@ -20,17 +22,207 @@ class JobDescription(BaseModel):
     spec: HobotSpec
 
 
+class RetryPolicy(BaseModel):
+    # Number of times the job may fail before it is given up, 1 for no retry
+    max_attempts: int = 1
+    # Seconds to wait before the first retry, multiplied by backoff_factor for
+    # every further retry and capped at max_backoff
+    backoff: float = 60.0
+    backoff_factor: float = 2.0
+    max_backoff: float = 3600.0
+    # Do not retry on the agents where the job failed, unless no other agent
+    # that is not disabled or quarantined can run it
+    avoid_failed_agents: bool = True
+
+
 class JobRequest(BaseModel):
     job: JobDescription
     # Do not use agents from this list for this job
     agent_blacklist: List[str] = []
+    # Jobs with higher priority are scheduled first
+    priority: int = 0
+
+    # Resource requirements. An empty list means any GPU type is fine.
+    gpu_types: List[str] = []
+    # Minimum GPU memory in GB
+    min_gpu_memory: int | None = None
+    # Number of GPUs, all allocated on the same agent
+    num_gpus: int = 1
+    # Agents to use first when several of them can run the job
+    preferred_agents: List[str] = []
+    retry: RetryPolicy = RetryPolicy()
+    # Seconds the job is expected to run. Learned from the jobs of the same
+    # project, group and config when not given.
+    expected_duration: float | None = None
+
+
+class CentralJobState(str, Enum):
+    """queued -> dispatched -> preparing -> running -> succeeded / failed.
+
+    A job can be cancelled from any state before it finishes. Everything
+    after dispatched is reported by the agent (see ``JobState``).
+
+    """
+
+    QUEUED = "queued"
+    DISPATCHED = "dispatched"
+    PREPARING = "preparing"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+    @property
+    def finished(self) -> bool:
+        return self in _CENTRAL_FINISHED
+
+
+_CENTRAL_FINISHED = (
+    CentralJobState.SUCCEEDED,
+    CentralJobState.FAILED,
+    CentralJobState.CANCELLED,
+)
+
+
+class QueuedJob(BaseModel):
+    # Assigned by central when the job is enqueued
+    id: str
+    request: JobRequest
+    enqueued_at: datetime
+    state: CentralJobState = CentralJobState.QUEUED
+    # The agent running the job, once it is dispatched
+    agent: str | None = None
+    dispatched_at: datetime | None = None
+    # The workers of the agent the job is placed on
+    worker_ids: List[int] = []
+    # Bumped every time the job goes back to the queue from an agent
+    attempt: int = 1
+    # Number of attempts that failed on an agent
+    failures: int = 0
+    # Agents the job failed on, not used again while another agent can run it
+    avoided_agents: List[str] = []
+    # Not scheduled before this time, while backing off after a failure
+    not_before: datetime | None = None
+    # As reported by the agent
+    commit: str | None = None
+    message: str | None = None
+    started_at: datetime | None = None
+    finished_at: datetime | None = None
+    exit_code: int | None = None
+
+    @property
+    def agent_job_id(self) -> str:
+        """The id of the current attempt on its agent."""
+        return self.id if self.attempt == 1 else f"{self.id}-{self.attempt}"
+
+
+class JobPage(BaseModel):
+    jobs: List[QueuedJob]
+    # Pass it back to get the next page, None on the last page
+    next_cursor: str | None = None
+
+
+class EnqueueBatchRequest(BaseModel):
+    jobs: List[JobRequest]
 
 
 class JobList(BaseModel):
     jobs: List[JobDescription]
 
 
+class Placement(BaseModel):
+    job: JobDescription
+    # The id of the job in central, used by the agent to track it
+    job_id: str | None = None
+    # The workers chosen by central to run the job. All of them are on the
+    # same agent, and the job gets all their GPUs.
+    worker_ids: List[int] = []
+    # The same for every time this placement is sent. The agent runs a job id
+    # once, and answers a placement it has seen again with the same result.
+    idempotency_key: str | None = None
+
+
+class RunBatchRequest(BaseModel):
+    placements: List[Placement]
+
+
 # TODO(breakds): Add datetime in the response
 class RunJobResponse(BaseModel):
     accepted: bool
     reason: str | None = None
+    # Set when accepted, for querying the job on the agent
+    job_id: str | None = None
+
+
+class RunBatchResponse(BaseModel):
+    # One result per job, in the same order as the request
+    results: List[RunJobResponse]
+
+
+class Reservation(BaseModel):
+    # The job the workers are held for, which is run with this id
+    job_id: str
+    worker_ids: List[int]
+
+
+class ReserveRequest(BaseModel):
+    reservations: List[Reservation]
+    # Seconds after which the workers are free again, unless the jobs are run
+    ttl: float = 30.0
+
+
+class ReserveResult(BaseModel):
+    accepted: bool
+    reason: str | None = None
+
+
+class ReserveResponse(BaseModel):
+    # One result per reservation, in the same order as the request
+    results: List[ReserveResult]
+
+
+class ReleaseRequest(BaseModel):
+    job_ids: List[str]
+
+
+class PrepareHint(BaseModel):
+    """Code that the agent is likely to run soon."""
+
+    repo: str
+    branch: str
+
+
+class PrepareRequest(BaseModel):
+    hints: List[PrepareHint]
+
+
+class JobState(str, Enum):
+    PREPARING = "preparing"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+    @property
+    def finished(self) -> bool:
+        return self in _FINISHED
+
+
+_FINISHED = (JobState.SUCCEEDED, JobState.FAILED, JobState.CANCELLED)
+
+
+class AgentJob(BaseModel):
+    """A job accepted by an agent."""
+
+    id: str
+    job: JobDescription
+    worker_ids: List[int]
+    state: JobState
+    # The commit the job runs, once its branch has been resolved
+    commit: str | None = None
+    # Details about the current state, e.g. why preparation failed
+    message: str | None = None
+    created_at: datetime
+    started_at: datetime | None = None
+    finished_at: datetime | None = None
+    exit_code: int | None = None
@@ -1,12 +1,18 @@
 from typing import List
 from pydantic import BaseModel
 
+from traintrack.schema.job import AgentJob
+
 
 class WorkerStatus(BaseModel):
     host: str
     id: int
     gpu_type: str
+    # In GB
+    gpu_memory: int | None = None
     available: bool
+    # Set by central when the status comes from an outdated cache entry
+    stale: bool = False
 
 
 class AgentStatus(BaseModel):
@@ -15,3 +21,20 @@ class AgentStatus(BaseModel):
 
 class ListWorkersResponse(BaseModel):
     workers: List[WorkerStatus]
+
+
+class AgentHeartbeat(BaseModel):
+    # Name of the agent as configured in central
+    name: str
+    # Bumped by the agent every time its status changes
+    version: int
+    # Only sent when the status changed since the last acknowledged heartbeat
+    status: AgentStatus | None = None
+    # The latest state of the jobs that changed since the last acknowledged
+    # heartbeat
+    jobs: List[AgentJob] = []
+
+
+class HeartbeatResponse(BaseModel):
+    # Central does not have the status for this version and asks for it
+    need_status: bool = False
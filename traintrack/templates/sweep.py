@@ -0,0 +1,93 @@
+import itertools
+import math
+import random
+from typing import Dict, List, Tuple
+
+from traintrack.schema.job import JobRequest
+
+
+# (low, high, log scale) of a randomly sampled override
+RandomRange = Tuple[float, float, bool]
+
+
+def parse_grid(options: List[str]) -> Dict[str, List[str]]:
+    """Parse ``KEY=V1,V2,...`` options."""
+    grid = {}
+    for option in options:
+        key, sep, values = option.partition("=")
+        if sep == "" or len(values) == 0:
+            raise ValueError(f"Invalid grid '{option}', expecting KEY=V1,V2,...")
+        grid[key] = values.split(",")
+    return grid
+
+
+def parse_random(options: List[str]) -> Dict[str, RandomRange]:
+    """Parse ``KEY=LOW:HIGH`` (uniform) or ``KEY=log:LOW:HIGH`` options."""
+    ranges = {}
+    for option in options:
+        key, sep, spec = option.partition("=")
+        parts = spec.split(":")
+        log = len(parts) == 3 and parts[0] == "log"
+        if log:
+            parts = parts[1:]
+        if sep == "" or len(parts) != 2:
+            raise ValueError(
+                f"Invalid range '{option}', expecting KEY=LOW:HIGH or KEY=log:LOW:HIGH"
+            )
+        low, high = float(parts[0]), float(parts[1])
+        if log and (low <= 0 or high <= 0):
+            raise ValueError(f"Log range '{option}' must be positive")
+        ranges[key] = (low, high, log)
+    return ranges
+
+
+def _sample(rng: random.Random, low: float, high: float, log: bool) -> str:
+    if log:
+        value = math.exp(rng.uniform(math.log(low), math.log(high)))
+    else:
+        value = rng.uniform(low, high)
+    return f"{value:.4g}"
+
+
+def expand_sweep(
+    base: JobRequest,
+    grid: Dict[str, List[str]],
+    ranges: Dict[str, RandomRange],
+    samples: int = 1,
+    seed: int | None = None,
+) -> List[JobRequest]:
+    """One job per point of the grid and random sample.
+
+    Every point of the grid is combined with ``samples`` random draws of the
+    ranges. The swept overrides are applied on top of the base job's, the jobs
+    are named after the base job with an index, and the swept values are
+    appended to the notes.
+
+    """
+    rng = random.Random(seed)
+    keys = list(grid.keys())
+    points = list(itertools.product(*[grid[k] for k in keys]))
+    num_draws = samples if len(ranges) > 0 else 1
+
+    jobs = []
+    for point in points:
+        for _ in range(num_draws):
+            swept = dict(zip(keys, point))
+            for key, (low, high, log) in ranges.items():
+                swept[key] = _sample(rng, low, high, log)
+            desc = base.job
+            notes = " ".join(f"{k}={v}" for k, v in swept.items())
+            if desc.notes:
+                notes = f"{desc.notes} {notes}"
+            spec = desc.spec.copy(
+                update={"overrides": {**desc.spec.overrides, **swept}}
+            )
+            desc = desc.copy(
+                update={
+                    "name": f"{desc.name}.{len(jobs):03d}",
+                    "notes": notes,
+                    "spec": spec,
+                }
+            )
+            jobs.append(base.copy(update={"job": desc}))
+    return jobs